@@ -1,8 +1,17 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import json
-import os
+import time
 import datetime
+from hospital_service import (DATA_PATHS, STORAGE_MODE, SQLITE_PATH, WRITE_BEHIND_MS, WATCH_MODE, SLOT_MINUTES,
+                              SLOT_DURATIONS, BILLABLE, RecordStore, HospitalService, DataWatcher, make_backend,
+                              migrate_json_to_sqlite,
+                              convert_to_snapshot, convert_from_snapshot, RECORD_FIELDS, IMPORT_CHUNK_ROWS,
+                              import_file, export_file, metrics)
 
 # Constants for styling & files
 COLOR_PRIMARY = "#007bff"
@@ -13,33 +22,351 @@ COLOR_LIGHT = "#f8f9fa"
 COLOR_DARK = "#343a40"
 FONT = ("Segoe UI", 10)
 FONT_BOLD = ("Segoe UI", 11, "bold")
+ROW_HEIGHT = 25
+UI_POLL_MS = 30
+PREWARM_DELAY_MS = 500  # Idle time between building pages after login
+
+# Runs persistence and loading off the Tk thread. Jobs for one collection run
+# in submission order on that collection's own thread; results are handed
+# back to the UI thread through the post callback.
+class IOWorker:
+    def __init__(self, post):
+        self.post = post  # callable(fn, *args) that runs fn on the UI thread
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, on_done=None, on_error=None):
+        with self._lock:
+            executor = self._executors.get(key)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"io-{key}")
+                self._executors[key] = executor
+        future = executor.submit(fn, *args)
+
+        def finished(f):
+            error = f.exception()
+            if error is not None:
+                self.post(on_error or _report_io_error, error)
+            elif on_done is not None:
+                self.post(on_done, f.result())
+        future.add_done_callback(finished)
+        return future
+
+    def shutdown(self):
+        # Lets queued writes finish before the process exits
+        with self._lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+def _report_io_error(error):
+    messagebox.showerror("Error", f"Could not access data: {error}")
+
+# Table widget that only materializes the visible window of a large row list
+# (plus a small buffer above and below); the scrollbar drives a virtual offset
+# and rows are paged into the Treeview as it moves. Clicking a heading calls
+# on_sort(column); the caller supplies the order and marks it with show_sort.
+class VirtualTable(tk.Frame):
+    def __init__(self, parent, columns, headings=None, width=150, buffer=20):
+        super().__init__(parent, bg="white")
+        self.buffer = buffer
+        self.on_sort = None
+        self._headings = dict(zip(columns, headings or columns))
+        self._ids = []                # row ids in display order
+        self._id_set = set()          # the same ids, so a repeated insert is dropped
+        self._row = lambda rid: ()    # row id -> column values
+        self._start = 0               # index of the first materialized row
+        self._offset = 0              # index of the first visible row
+        self._visible = 20
+        self._rendering = False
+
+        self.count_label = tk.Label(self, text="", font=FONT, bg="white", fg="#6c757d", anchor="e")
+        self.count_label.pack(side="bottom", fill="x", padx=5)
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", selectmode="browse")
+        for col, text in self._headings.items():
+            self.tree.heading(col, text=text, command=lambda col=col: self.on_sort and self.on_sort(col))
+            self.tree.column(col, width=width, anchor="center")
+        self.tree.pack(side="left", fill="both", expand=True, padx=(5, 0), pady=5)
+
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.configure(yscrollcommand=self._on_tree_yview)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self._scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda e: self._scroll_by(3))
+
+    def set_rows(self, ids, row):
+        self._ids = list(ids)
+        self._id_set = set(self._ids)
+        self._row = row
+        self.tree.delete(*self.tree.get_children())
+        self._render()
+
+    def selection(self):
+        return self.tree.selection()
+
+    def show_sort(self, column, descending):
+        for col, text in self._headings.items():
+            arrow = (" \u25bc" if descending else " \u25b2") if col == column else ""
+            self.tree.heading(col, text=text + arrow)
+
+    def set_loading(self):
+        # Shown until the next set_rows call
+        self.count_label.config(text="Loading...")
+
+    # Patch rows for a store notification; False means the caller must reload
+    def apply_change(self, event, records):
+        if event == "insert":
+            self.insert_rows([r["id"] for r in records])
+        elif event == "delete":
+            self.remove_rows([r["id"] for r in records])
+        elif event == "update":
+            for _, new in records:
+                if self.tree.exists(new["id"]):
+                    self.tree.item(new["id"], values=self._row(new["id"]))
+        else:
+            return False
+        return True
+
+    def insert_rows(self, ids):
+        # An insert notification can land after a set_rows that already has the row
+        new = [rid for rid in dict.fromkeys(ids) if rid not in self._id_set]
+        self._ids.extend(new)
+        self._id_set.update(new)
+        self._render()
+
+    def remove_rows(self, ids):
+        gone = set(ids)
+        self._id_set -= gone
+        if len(gone) == 1:
+            rid = next(iter(gone))
+            if rid in self._ids:
+                self._ids.remove(rid)
+        else:
+            self._ids = [rid for rid in self._ids if rid not in gone]
+        existing = [rid for rid in gone if self.tree.exists(rid)]
+        if existing:
+            self.tree.delete(*existing)
+        self._render()
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self._offset = int(float(args[1]) * len(self._ids))
+        elif args[0] == "scroll":
+            step = self._visible if args[2] == "pages" else 1
+            self._offset += int(args[1]) * step
+        self._render()
+
+    def _scroll_by(self, rows):
+        self._offset += rows
+        self._render()
+        return "break"
+
+    def _on_wheel(self, event):
+        notches = event.delta // 120 if abs(event.delta) >= 120 else (1 if event.delta > 0 else -1)
+        return self._scroll_by(-3 * notches)
+
+    def _on_resize(self, event):
+        visible = max(1, (event.height - ROW_HEIGHT) // ROW_HEIGHT)
+        if visible != self._visible:
+            self._visible = visible
+            self._render()
+
+    def _on_tree_yview(self, first, last):
+        # Keyboard navigation scrolls the Treeview itself within the buffer
+        if self._rendering:
+            return
+        materialized = len(self.tree.get_children())
+        if materialized:
+            self._offset = self._start + int(round(float(first) * materialized))
+        near_top = self._start > 0 and self._offset < self._start + self._visible // 2
+        near_bottom = (self._start + materialized < len(self._ids) and
+                       self._offset + self._visible > self._start + materialized - self._visible // 2)
+        if near_top or near_bottom:
+            self.after_idle(self._render)
+        else:
+            self._update_scrollbar()
+
+    def _render(self):
+        total = len(self._ids)
+        self._offset = max(0, min(self._offset, total - self._visible))
+        start = max(0, self._offset - self.buffer)
+        window = self._ids[start:self._offset + self._visible + self.buffer]
+
+        self._rendering = True
+        try:
+            wanted = set(window)
+            stale = [iid for iid in self.tree.get_children() if iid not in wanted]
+            if stale:
+                self.tree.delete(*stale)
+            for index, rid in enumerate(window):
+                if not self.tree.exists(rid):
+                    self.tree.insert("", index, iid=rid, values=self._row(rid))
+                elif self.tree.index(rid) != index:
+                    self.tree.move(rid, "", index)
+            self._start = start
+            if window:
+                self.tree.yview_moveto((self._offset - start) / len(window))
+        finally:
+            self._rendering = False
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = len(self._ids)
+        if total:
+            last = min(total, self._offset + self._visible)
+            self.scrollbar.set(self._offset / total, last / total)
+            self.count_label.config(text=f"Showing {self._offset + 1}-{last} of {total}")
+        else:
+            self.scrollbar.set(0, 1)
+            self.count_label.config(text="No records")
+
+# Search box that calls on_search(query) once typing pauses
+class SearchBar(tk.Frame):
+    def __init__(self, parent, on_search, delay=150):
+        super().__init__(parent, bg=COLOR_LIGHT)
+        self.on_search = on_search
+        self.delay = delay
+        self._pending = None
+
+        tk.Label(self, text="Search:", font=FONT, bg=COLOR_LIGHT).pack(side="left")
+        self.var = tk.StringVar()
+        self.entry = tk.Entry(self, textvariable=self.var, font=FONT, width=40)
+        self.entry.pack(side="left", padx=5, ipady=3)
+        tk.Button(self, text="Clear", font=FONT, bd=0, bg="#e2e6ea", padx=8,
+                  command=lambda: self.var.set("")).pack(side="left")
+        self.var.trace_add("write", self._on_type)
+
+    def query(self):
+        return self.var.get().strip()
+
+    def _on_type(self, *args):
+        if self._pending is not None:
+            self.after_cancel(self._pending)
+        self._pending = self.after(self.delay, self._fire)
+
+    def _fire(self):
+        self._pending = None
+        self.on_search(self.query())
+
+# Keeps a VirtualTable in sync with one store collection: loading on the
+# IOWorker, patching rows from store notifications, search filtering and
+# sorting by a column through the service's cached sort indexes
+class CollectionTable:
+    def __init__(self, controller, key, table, search_bar, row, fields):
+        self.controller = controller
+        self.key = key
+        self.table = table
+        self.search_bar = search_bar
+        self._row = row  # record -> column values
+        self.fields = dict(zip(table.tree["columns"], fields))  # column -> record field
+        self.sort = None  # (field, descending) while sorted by a column
+        self.records = {}
+        table.on_sort = self.sort_by
+        controller.io.submit(key, controller.service.index, key)
+        self.load()
+        controller.store.subscribe(key, controller.ui(self.on_change))
+
+    def load(self):
+        self.table.set_loading()
+        self.controller.io.submit(self.key, self.controller.store.load, self.key, on_done=self.show)
+
+    def refresh(self):
+        # Picks up changes made on disk; subscribers are notified on reload
+        self.controller.io.submit(self.key, self.controller.store.load, self.key)
+
+    def show(self, records):
+        self.records = records
+        self.apply_search(self.search_bar.query())
+
+    def set_rows(self, ids):
+        with metrics.span("rebuild", self.key):
+            self.table.set_rows(ids, self.row)
+
+    def row(self, rid):
+        # Rows may be dropped by an IOWorker thread before the delete event arrives
+        return self._row(self.records.get(rid, {}))
+
+    def sort_by(self, column):
+        # First click sorts ascending, the next reverses
+        field = self.fields[column]
+        self.sort = (field, not self.sort[1] if self.sort and self.sort[0] == field else False)
+        self.table.show_sort(column, self.sort[1])
+        self.apply_search(self.search_bar.query())
+
+    def _matching(self, query, sort):
+        # On the IOWorker, which is where the store's dict changes
+        if not query and not sort:
+            return list(self.records)
+        ids = self.controller.service.search(self.key, query) if query else None
+        if sort:
+            ids = self.controller.service.sorted_ids(self.key, *sort, among=ids)
+        return ids
+
+    def apply_search(self, query):
+        self.table.set_loading()
+        sort = self.sort
+        self.controller.io.submit(self.key, self._matching, query, sort,
+                                  on_done=lambda ids: self.show_matches(query, sort, ids))
+
+    def show_matches(self, query, sort, ids):
+        # Ignore results for stale keystrokes and clicks
+        if query == self.search_bar.query() and sort == self.sort:
+            self.set_rows(ids)
+
+    def on_change(self, event, records):
+        if event == "reload":
+            self.load()
+        elif self.search_bar.query() or self.sort:
+            self.apply_search(self.search_bar.query())
+        else:
+            with metrics.span("patch", self.key):
+                self.table.apply_change(event, records)
 
-# Data file paths
-DATA_PATHS = {
-    "patients": "patients.json",
-    "doctors": "doctors.json",
-    "staff": "staff.json",
-    "medicines": "medicines.json",
-    "lab_tests": "lab_tests.json",
-    "appointments": "appointments.json",
-    "machinery": "machinery.json",
-    "billing": "billing.json",
-}
-
-# Utility functions to load/save JSON
-def load_data(filename):
-    if os.path.exists(filename):
-        with open(filename, "r") as f:
-            return json.load(f)
-    return []
-
-def save_data(filename, data):
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=2)
+# Bulk Import/Export buttons for one collection; files are streamed on the
+# collection's IOWorker thread, so the import lands in order with other writes
+class TransferBar(tk.Frame):
+    FILE_TYPES = [("CSV files", "*.csv"), ("JSON lines", "*.jsonl *.ndjson")]
+
+    def __init__(self, parent, controller, key, title):
+        super().__init__(parent, bg=COLOR_LIGHT)
+        self.controller = controller
+        self.key = key
+        self.title = title
+        tk.Button(self, text="Import...", bg=COLOR_SUCCESS, fg="white", font=FONT, bd=0, padx=10, pady=3,
+                  command=self.import_file).pack(side="left", padx=5)
+        tk.Button(self, text="Export...", bg=COLOR_DARK, fg="white", font=FONT, bd=0, padx=10, pady=3,
+                  command=self.export_file).pack(side="left", padx=5)
+
+    def import_file(self):
+        path = filedialog.askopenfilename(title=f"Import {self.title}", filetypes=self.FILE_TYPES)
+        if not path:
+            return
+        self.controller.io.submit(self.key, import_file, self.controller.service, self.key, path,
+                                  on_done=self.imported, on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+    def imported(self, report):
+        message = f"Imported {report['imported']} {self.title.lower()}, rejected {report['rejected']}"
+        if report["rejects_file"]:
+            message += f"\nRejected rows were written to {report['rejects_file']}"
+        messagebox.showinfo("Import", message)
+
+    def export_file(self):
+        path = filedialog.asksaveasfilename(title=f"Export {self.title}", filetypes=self.FILE_TYPES,
+                                            defaultextension=".csv", initialfile=f"{self.key}.csv")
+        if not path:
+            return
+        self.controller.io.submit(self.key, export_file, self.controller.service, self.key, path,
+                                  on_done=lambda count: messagebox.showinfo(
+                                      "Export", f"Exported {count} {self.title.lower()} to {path}"),
+                                  on_error=lambda e: messagebox.showerror("Error", str(e)))
 
 # Main Application Class
 class HospitalApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, service, prewarm=True, watch=WATCH_MODE):
         super().__init__()
         self.title("Hospital Management System")
         self.geometry("1200x750")
@@ -50,12 +377,32 @@ class HospitalApp(tk.Tk):
         self.style = ttk.Style(self)
         self.style.theme_use('clam')
         self.style.configure("Treeview.Heading", font=FONT_BOLD, background=COLOR_PRIMARY, foreground="white")
-        self.style.configure("Treeview", font=FONT, rowheight=25)
+        self.style.configure("Treeview", font=FONT, rowheight=ROW_HEIGHT)
         self.style.map("Treeview", background=[('selected', COLOR_PRIMARY)])
 
         # Login system state
         self.current_user = None
 
+        # Background I/O; results come back through post() on the UI thread
+        self._ui_queue = queue.Queue()
+        self.io = IOWorker(self.post)
+        self.after(UI_POLL_MS, self._drain_ui_queue)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.bind_all("<Control-s>", lambda e: self.save_now())
+
+        # All reads and writes go through the service: in-process, or a
+        # RemoteService talking to hospital_server.py. Pages render from its store.
+        # Nothing is read until login.
+        self.service = service
+        self.store = service.store
+        self.prewarm = prewarm
+        self._prewarm_job = None
+
+        # Live refresh: writes from other workstations are picked up by a
+        # DataWatcher while logged in (a RemoteService's data isn't watched)
+        self.watcher = DataWatcher(self.store.backend, lambda keys: self.post(self.on_data_changed, keys), watch)
+        self.store.on_flush_error = lambda error: self.post(self.on_flush_error, error)
+
         # Frames
         self.login_frame = LoginPage(self, self)
         self.login_frame.pack(fill="both", expand=True)
@@ -68,34 +415,117 @@ class HospitalApp(tk.Tk):
         self.content_area = tk.Frame(self.main_frame, bg=COLOR_LIGHT)
         self.content_area.pack(side="right", fill="both", expand=True)
 
-        # All Pages
+        # Pages are built on first use, since each one loads its collections;
+        # after login the rest are built one at a time while the app is idle
+        self.pages = (DashboardPage, PatientManagementPage, DoctorManagementPage, StaffManagementPage,
+                      MedicineManagementPage, LabTestManagementPage, AppointmentBookingPage,
+                      MachineryManagementPage, BillingPage, ReportsPage, DiagnosticsPage)
         self.frames = {}
-        for F in (DashboardPage, PatientManagementPage, DoctorManagementPage, StaffManagementPage,
-                  MedicineManagementPage, LabTestManagementPage, AppointmentBookingPage,
-                  MachineryManagementPage, BillingPage):
-            page = F(self.content_area, self)
-            self.frames[F] = page
-            page.grid(row=0, column=0, sticky="nsew")
+        self.visible = None
 
-        self.main_frame.pack_forget()
+    def page(self, page):
+        frame = self.frames.get(page)
+        if frame is None:
+            with metrics.span("build", page.__name__):
+                frame = self.frames[page] = page(self.content_area, self)
+                frame.grid(row=0, column=0, sticky="nsew")
+        return frame
 
     def login_success(self):
         self.login_frame.pack_forget()
         self.main_frame.pack(fill="both", expand=True)
+        self.io.submit("dashboard", self.service.prime)
         self.show_frame(DashboardPage)
         self.sidebar.activate_button("Dashboard")
+        self.watcher.start()
+        if self.prewarm and self._prewarm_job is None:
+            self._prewarm_job = self.after(PREWARM_DELAY_MS, self._prewarm_next)
+
+    def _prewarm_next(self):
+        # One page per PREWARM_DELAY_MS, so input is never held up for long
+        self._prewarm_job = None
+        remaining = [page for page in self.pages if page not in self.frames]
+        if not remaining or self.current_user is None:
+            return
+        frame = self.page(remaining[0])
+        frame.lower()  # Keep the visible page on top
+        if len(remaining) > 1:
+            self._prewarm_job = self.after(PREWARM_DELAY_MS, self._prewarm_next)
 
     def logout(self):
+        if self._prewarm_job is not None:
+            self.after_cancel(self._prewarm_job)
+            self._prewarm_job = None
+        self.watcher.stop()
+        self.io.submit("store", self.store.flush)
         self.main_frame.pack_forget()
         self.login_frame.pack(fill="both", expand=True)
         self.current_user = None
 
     def show_frame(self, page):
-        frame = self.frames[page]
-        frame.tkraise()
-        if hasattr(frame, "refresh"):
+        with metrics.span("show_frame", page.__name__):
+            built = page in self.frames
+            frame = self.page(page)
+            frame.tkraise()
+            self.visible = frame
+            if built and hasattr(frame, "refresh"):
+                frame.refresh()
+
+    def on_data_changed(self, keys):
+        # Files behind `keys` changed on disk: only the visible page is
+        # refreshed, and only if it shows one of them. Other pages catch up
+        # when shown, and the store re-reads nothing whose signature is unchanged
+        frame = self.visible
+        changed = [key for key in keys if key in getattr(frame, "collections", ())]
+        if self.current_user is None or not changed:
+            return
+        if hasattr(frame, "refresh_changed"):
+            frame.refresh_changed(changed)
+        else:
             frame.refresh()
 
+    def post(self, fn, *args):
+        # Thread-safe: queue fn to run on the Tk thread
+        self._ui_queue.put((fn, args))
+
+    def ui(self, fn):
+        # Wraps a store listener so it runs on the Tk thread
+        return lambda *args: self.post(fn, *args)
+
+    def _drain_ui_queue(self):
+        try:
+            while True:
+                fn, args = self._ui_queue.get_nowait()
+                fn(*args)
+        except queue.Empty:
+            pass
+        finally:
+            self.after(UI_POLL_MS, self._drain_ui_queue)
+
+    def on_flush_error(self, error):
+        # Write-behind couldn't write the queued changes (error), or has since
+        # managed to (None); the Save button shows it while they're unsaved
+        button = self.sidebar.buttons.get("Save")
+        if button is not None:
+            button.configure(text="Save (unsaved!)" if error is not None else "Save")
+        if error is not None:
+            messagebox.showwarning("Unsaved changes", f"Changes could not be saved and will be retried: {error}")
+
+    def save_now(self):
+        # Explicit save: writes anything write-behind is still holding
+        self.io.submit("store", self.store.flush,
+                       on_done=lambda _: messagebox.showinfo("Save", "All changes saved"))
+
+    def on_close(self):
+        self.watcher.stop()
+        self.io.shutdown()
+        try:
+            self.store.flush()
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not save changes: {e}")
+            return
+        self.destroy()
+
 # Login Page
 class LoginPage(tk.Frame):
     def __init__(self, parent, controller):
@@ -155,6 +585,10 @@ class Sidebar(tk.Frame):
         self.add_button("Appointments", lambda: self.on_button_click(AppointmentBookingPage, "Appointments"))
         self.add_button("Machinery", lambda: self.on_button_click(MachineryManagementPage, "Machinery"))
         self.add_button("Billing", lambda: self.on_button_click(BillingPage, "Billing"))
+        self.add_button("Reports", lambda: self.on_button_click(ReportsPage, "Reports"))
+        self.add_button("Diagnostics", lambda: self.on_button_click(DiagnosticsPage, "Diagnostics"))
+        if controller.store.write_behind:
+            self.add_button("Save", controller.save_now)
         self.add_button("Logout", self.controller.logout)
 
     def add_button(self, text, command):
@@ -177,6 +611,18 @@ class Sidebar(tk.Frame):
 
 # Dashboard with summary cards and live time
 class DashboardPage(tk.Frame):
+    # Cards that depend on each collection
+    CARDS = {
+        "patients": ("Patients", "Available Beds"),
+        "doctors": ("Doctors",),
+        "staff": ("Staff",),
+        "medicines": ("Medicines", "Low Stock"),
+        "appointments": ("Appointments", "Today's Appointments"),
+        "machinery": ("Machinery",),
+        "billing": ("Today's Revenue",),
+    }
+    collections = tuple(CARDS)
+
     def __init__(self, parent, controller):
         super().__init__(parent, bg=COLOR_LIGHT)
         self.controller = controller
@@ -197,11 +643,14 @@ class DashboardPage(tk.Frame):
             ("Appointments", "#17a2b8"),  # info color
             ("Available Beds", "#6c757d"),
             ("Machinery", "#fd7e14"),
+            ("Today's Appointments", "#17a2b8"),
+            ("Low Stock", COLOR_DANGER),
+            ("Today's Revenue", COLOR_SUCCESS),
         ]
 
         for i, (title, color) in enumerate(card_infos):
             card = tk.Frame(self.cards_frame, bg=color, width=160, height=100, bd=0, relief="ridge")
-            card.grid(row=0, column=i, padx=10, sticky="nsew")
+            card.grid(row=i // 5, column=i % 5, padx=10, pady=10, sticky="nsew")
             card.pack_propagate(False)
 
             label_title = tk.Label(card, text=title, font=FONT_BOLD, bg=color, fg="white")
@@ -212,6 +661,10 @@ class DashboardPage(tk.Frame):
 
             self.cards[title] = label_value
 
+        # Medicines furthest below their reorder level
+        self.reorder_label = tk.Label(self, font=FONT, bg=COLOR_LIGHT, fg=COLOR_DANGER, justify="left")
+        self.reorder_label.pack(pady=(0, 5))
+
         # Live clock
         self.clock_label = tk.Label(self, font=("Segoe UI", 14, "bold"), bg=COLOR_LIGHT, fg=COLOR_DARK)
         self.clock_label.pack(pady=10)
@@ -220,14 +673,31 @@ class DashboardPage(tk.Frame):
         self.update_stats()
 
     def update_stats(self):
-        self.cards["Patients"].config(text=str(len(load_data(DATA_PATHS["patients"]))))
-        self.cards["Doctors"].config(text=str(len(load_data(DATA_PATHS["doctors"]))))
-        self.cards["Staff"].config(text=str(len(load_data(DATA_PATHS["staff"]))))
-        self.cards["Medicines"].config(text=str(len(load_data(DATA_PATHS["medicines"]))))
-        self.cards["Appointments"].config(text=str(len(load_data(DATA_PATHS["appointments"]))))
-        self.cards["Machinery"].config(text=str(len(load_data(DATA_PATHS["machinery"]))))
-        # Beds static for demo
-        self.cards["Available Beds"].config(text="15")
+        for label in self.cards.values():
+            label.config(text="...")
+        self.controller.io.submit("dashboard", self.controller.service.dashboard, on_done=self.show_stats)
+        self.controller.io.submit("dashboard", self.controller.service.reorder, 5, on_done=self.show_reorder)
+
+    def refresh_changed(self, keys):
+        # Re-reads just the changed collections and redraws their cards
+        titles = [title for key in keys for title in self.CARDS[key]]
+        self.controller.io.submit("dashboard", self._reload, keys,
+                                  on_done=lambda values: self.show_stats({title: values[title] for title in titles}))
+        if "medicines" in keys:
+            self.controller.io.submit("dashboard", self.controller.service.reorder, 5, on_done=self.show_reorder)
+
+    def _reload(self, keys):
+        for key in keys:
+            self.controller.store.load(key)
+        return self.controller.service.dashboard()
+
+    def show_stats(self, values):
+        for title, value in values.items():
+            self.cards[title].config(text=str(value))
+
+    def show_reorder(self, items):
+        text = ", ".join(f"{name} ({quantity:g}/{level:g})" for _, name, quantity, level in items)
+        self.reorder_label.config(text=f"Reorder Soon: {text}" if text else "")
 
     def update_clock(self):
         now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -243,12 +713,16 @@ class BaseManagementPage(tk.Frame):
         super().__init__(parent, bg=COLOR_LIGHT)
         self.controller = controller
         self.title_text = title
-        self.fields = fields  # List of (field_label, field_width)
+        self.fields = fields  # List of (field_label, field_width), labels as in RECORD_FIELDS
         self.data_key = data_key
+        self.collections = (data_key,)
 
         header = tk.Label(self, text=title, font=("Segoe UI", 20, "bold"), bg=COLOR_LIGHT)
         header.pack(pady=15)
 
+        self.search_bar = SearchBar(self, lambda query: self.view.apply_search(query))
+        self.search_bar.pack(fill="x", padx=20)
+
         content = tk.Frame(self, bg=COLOR_LIGHT)
         content.pack(fill="both", expand=True, padx=20, pady=10)
 
@@ -273,124 +747,180 @@ class BaseManagementPage(tk.Frame):
         table_frame = tk.Frame(content, bg="white", bd=1, relief="solid")
         table_frame.pack(side="right", fill="both", expand=True)
 
-        cols = [f[0] for f in fields]
-        self.tree = ttk.Treeview(table_frame, columns=cols, show="headings", selectmode="browse")
-        for col in cols:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=150, anchor="center")
-        self.tree.pack(side="left", fill="both", expand=True, padx=(5, 0), pady=5)
-
-        scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.table = VirtualTable(table_frame, [f[0] for f in fields])
+        self.table.pack(fill="both", expand=True)
 
         # Delete button
         del_btn = tk.Button(self, text=f"Delete Selected {title[:-1]}", bg=COLOR_DANGER, fg="white",
                             font=FONT_BOLD, bd=0, padx=10, pady=5, command=self.delete_record)
         del_btn.pack(pady=10)
+        TransferBar(self, controller, data_key, title).pack(pady=(0, 10))
 
-        self.load_records()
+        self.view = CollectionTable(controller, data_key, self.table, self.search_bar,
+                                    lambda rec: [rec.get(f.lower(), "") for f, _ in fields],
+                                    [f.lower() for f, _ in fields])
 
     def load_records(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        records = load_data(DATA_PATHS[self.data_key])
-        for rec in records:
-            values = [rec.get(f.lower(), "") for f, _ in self.fields]
-            self.tree.insert("", "end", values=values)
+        self.view.load()
 
     def add_record(self):
-        # Validate inputs
-        record = {}
-        for field, _ in self.fields:
-            val = self.entries[field.lower()].get().strip()
-            if not val:
-                messagebox.showerror("Error", f"{field} is required")
-                return
-            record[field.lower()] = val
-
-        # Example: age and numeric fields check (you can customize per field)
-        if "age" in record and not record["age"].isdigit():
-            messagebox.showerror("Error", "Age must be a number")
-            return
-        if "quantity" in record and not record["quantity"].isdigit():
-            messagebox.showerror("Error", "Quantity must be a number")
-            return
-        if "price" in record and not self.is_float(record["price"]):
-            messagebox.showerror("Error", "Price must be a number")
-            return
-
-        # Save
-        records = load_data(DATA_PATHS[self.data_key])
-        records.append(record)
-        save_data(DATA_PATHS[self.data_key], records)
-        self.load_records()
+        # Required and numeric fields are checked by the service
+        record = {field.lower(): self.entries[field.lower()].get().strip() for field, _ in self.fields}
+        self.controller.io.submit(self.data_key, self.controller.service.add_record, self.data_key, record,
+                                  on_done=self.record_added,
+                                  on_error=lambda e: messagebox.showerror("Error", str(e)))
 
+    def record_added(self, record):
         for e in self.entries.values():
             e.delete(0, tk.END)
         messagebox.showinfo("Success", f"{self.title_text[:-1]} added successfully")
 
     def delete_record(self):
-        selected = self.tree.selection()
+        selected = self.table.selection()
         if not selected:
             messagebox.showwarning("Warning", f"No {self.title_text[:-1]} selected")
             return
-        values = self.tree.item(selected[0], "values")
-        records = load_data(DATA_PATHS[self.data_key])
-        # Filter out matching record
-        def match(r): 
-            return all(str(r.get(f.lower(), "")) == v for f, v in zip(self.fields, values))
-        new_records = []
-        for r in records:
-            if any(str(r.get(f[0].lower(), "")) != val for f, val in zip(self.fields, values)):
-                new_records.append(r)
-        save_data(DATA_PATHS[self.data_key], new_records)
-        self.load_records()
-        messagebox.showinfo("Success", f"{self.title_text[:-1]} deleted successfully")
-
-    def is_float(self, value):
-        try:
-            float(value)
-            return True
-        except:
-            return False
+        self.controller.io.submit(self.data_key, self.controller.service.delete_records, self.data_key, [selected[0]],
+                                  on_done=lambda removed: messagebox.showinfo(
+                                      "Success", f"{self.title_text[:-1]} deleted successfully"))
 
     def refresh(self):
-        self.load_records()
+        self.view.refresh()
 
 # Specific Management Pages
 class PatientManagementPage(BaseManagementPage):
     def __init__(self, parent, controller):
-        fields = [("Name", 30), ("Age", 10), ("Disease", 30)]
+        fields = list(zip(RECORD_FIELDS["patients"], (30, 10, 30, 10)))
         super().__init__(parent, controller, "Patients", fields, "patients")
 
+        history_btn = tk.Button(self, text="View Patient History", bg=COLOR_PRIMARY, fg="white", font=FONT_BOLD,
+                                bd=0, padx=10, pady=5, command=self.show_history)
+        history_btn.pack(pady=(0, 10))
+        self.table.tree.bind("<Double-1>", lambda e: self.show_history())
+
+    def show_history(self):
+        selected = self.table.selection()
+        if not selected:
+            messagebox.showwarning("Warning", "No Patient selected")
+            return
+        PatientHistoryWindow(self, self.controller, selected[0])
+
+# Patient History: one patient's appointments and bills with totals, looked up
+# through the service's reference indexes and re-queried when either changes
+class PatientHistoryWindow(tk.Toplevel):
+    def __init__(self, parent, controller, patient_id):
+        super().__init__(parent, bg=COLOR_LIGHT)
+        self.controller = controller
+        self.patient_id = patient_id
+        self.title("Patient History")
+        self.geometry("760x580")
+
+        self.header = tk.Label(self, text="Loading...", font=("Segoe UI", 16, "bold"), bg=COLOR_LIGHT)
+        self.header.pack(pady=(15, 5))
+        self.totals_var = tk.StringVar()
+        tk.Label(self, textvariable=self.totals_var, font=FONT, bg=COLOR_LIGHT).pack(pady=(0, 10))
+
+        self.appointments_tree = self._section("Appointments", ("date", "time", "doctor", "duration"))
+        self.bills_tree = self._section("Bills", ("date", "invoice", "item", "quantity", "total"))
+
+        self._listener = controller.ui(lambda event, records: self.load())
+        for key in ("appointments", "billing"):
+            controller.store.subscribe(key, self._listener)
+        self.bind("<Destroy>", self._on_destroy)
+        self.load()
+
+    def _section(self, title, columns):
+        frame = tk.LabelFrame(self, text=title, font=FONT_BOLD, bg="white")
+        frame.pack(fill="both", expand=True, padx=15, pady=5)
+        tree = ttk.Treeview(frame, columns=columns, show="headings", height=8)
+        for col in columns:
+            tree.heading(col, text=col.title())
+            tree.column(col, width=120, anchor="center")
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill="both", expand=True, padx=(5, 0), pady=5)
+        scrollbar.pack(side="right", fill="y")
+        return tree
+
+    def load(self):
+        self.controller.io.submit("appointments", self.controller.service.patient_history, self.patient_id,
+                                  on_done=self.show, on_error=self.show_error)
+
+    def show(self, history):
+        if not self.winfo_exists():
+            return
+        patient, totals = history["patient"], history["totals"]
+        self.header.config(text=f"{patient.get('name', '')} ({patient.get('disease', '')})")
+        self.totals_var.set(f"{totals['appointments']} appointments ({totals['upcoming']} upcoming)   "
+                            f"{totals['invoices']} invoices   Total billed: {totals['billed']:.2f}")
+        self.appointments_tree.delete(*self.appointments_tree.get_children())
+        for appt in history["appointments"]:
+            self.appointments_tree.insert("", "end", values=(appt.get("date", ""), appt.get("time", ""),
+                                                             appt.get("doctor", ""), appt.get("duration", "")))
+        self.bills_tree.delete(*self.bills_tree.get_children())
+        for bill in history["bills"]:
+            self.bills_tree.insert("", "end", values=(bill.get("date", ""), bill.get("invoice", ""),
+                                                      bill.get("item", bill.get("medicine", "")),
+                                                      bill.get("quantity", ""), bill.get("total", "")))
+
+    def show_error(self, error):
+        if not self.winfo_exists():
+            return
+        if isinstance(error, LookupError):
+            self.header.config(text="This patient no longer exists")
+        else:
+            messagebox.showerror("Error", str(error), parent=self)
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            for key in ("appointments", "billing"):
+                self.controller.store.unsubscribe(key, self._listener)
+
 class DoctorManagementPage(BaseManagementPage):
     def __init__(self, parent, controller):
-        fields = [("Name", 30), ("Specialization", 30), ("Phone", 20)]
+        fields = list(zip(RECORD_FIELDS["doctors"], (30, 30, 20)))
         super().__init__(parent, controller, "Doctors", fields, "doctors")
 
 class StaffManagementPage(BaseManagementPage):
     def __init__(self, parent, controller):
-        fields = [("Name", 30), ("Role", 30), ("Phone", 20)]
+        fields = list(zip(RECORD_FIELDS["staff"], (30, 30, 20)))
         super().__init__(parent, controller, "Staff", fields, "staff")
 
 class MedicineManagementPage(BaseManagementPage):
     def __init__(self, parent, controller):
-        fields = [("Name", 30), ("Quantity", 10), ("Price", 10)]
+        fields = list(zip(RECORD_FIELDS["medicines"], (30, 10, 10, 10)))
         super().__init__(parent, controller, "Medicines", fields, "medicines")
 
+        # Medicines furthest below their reorder level, lowest first
+        self.reorder_label = tk.Label(self, font=FONT, bg=COLOR_LIGHT, fg=COLOR_DANGER, justify="left")
+        self.reorder_label.pack(pady=(0, 10))
+        controller.store.subscribe("medicines", controller.ui(lambda event, records: self.load_reorder()))
+
+    def load_reorder(self):
+        self.controller.io.submit("dashboard", self.controller.service.reorder, 5, on_done=self.show_reorder)
+
+    def show_reorder(self, items):
+        lines = [f"{name}: {quantity:g} left (reorder at {level:g})" for _, name, quantity, level in items]
+        self.reorder_label.config(text="Reorder Soon:\n" + "\n".join(lines) if lines else "Stock levels OK")
+
+    def refresh(self):
+        super().refresh()
+        self.load_reorder()
+
 class LabTestManagementPage(BaseManagementPage):
     def __init__(self, parent, controller):
-        fields = [("Test Name", 30), ("Price", 10)]
+        fields = list(zip(RECORD_FIELDS["lab_tests"], (30, 10)))
         super().__init__(parent, controller, "Lab Tests", fields, "lab_tests")
 
 class MachineryManagementPage(BaseManagementPage):
     def __init__(self, parent, controller):
-        fields = [("Machine Name", 30), ("Quantity", 10), ("Supplier", 30)]
+        fields = list(zip(RECORD_FIELDS["machinery"], (30, 10, 30)))
         super().__init__(parent, controller, "Machinery", fields, "machinery")
 
 # Appointment Booking Page
 class AppointmentBookingPage(tk.Frame):
+    collections = ("appointments", "doctors")
+
     def __init__(self, parent, controller):
         super().__init__(parent, bg=COLOR_LIGHT)
         self.controller = controller
@@ -398,6 +928,9 @@ class AppointmentBookingPage(tk.Frame):
         header = tk.Label(self, text="Book Doctor Appointment", font=("Segoe UI", 20, "bold"), bg=COLOR_LIGHT)
         header.pack(pady=15)
 
+        self.search_bar = SearchBar(self, lambda query: self.view.apply_search(query))
+        self.search_bar.pack(fill="x", padx=20)
+
         content = tk.Frame(self, bg=COLOR_LIGHT)
         content.pack(fill="both", expand=True, padx=20, pady=10)
 
@@ -420,108 +953,122 @@ class AppointmentBookingPage(tk.Frame):
         self.time_entry = tk.Entry(form_frame, width=30)
         self.time_entry.grid(row=3, column=1, pady=5, padx=5)
 
+        tk.Label(form_frame, text="Duration (min):", bg="white").grid(row=4, column=0, sticky="e", pady=5, padx=5)
+        self.duration_combo = ttk.Combobox(form_frame, width=28, state="readonly", values=SLOT_DURATIONS)
+        self.duration_combo.set(SLOT_MINUTES)
+        self.duration_combo.grid(row=4, column=1, pady=5, padx=5)
+
+        slots_btn = tk.Button(form_frame, text="Find Free Slots", bg=COLOR_SUCCESS, fg="white", font=FONT,
+                              bd=0, padx=10, pady=3, command=self.find_free_slots)
+        slots_btn.grid(row=5, column=0, columnspan=2, pady=(10, 0))
+
+        tk.Label(form_frame, text="Available:", bg="white").grid(row=6, column=0, sticky="e", pady=5, padx=5)
+        self.slot_combo = ttk.Combobox(form_frame, width=28, state="readonly")
+        self.slot_combo.grid(row=6, column=1, pady=5, padx=5)
+        self.slot_combo.bind("<<ComboboxSelected>>", self.use_slot)
+
         book_btn = tk.Button(form_frame, text="Book Appointment", bg=COLOR_PRIMARY, fg="white", font=FONT_BOLD,
                              bd=0, padx=10, pady=5, command=self.book_appointment)
-        book_btn.grid(row=4, column=0, columnspan=2, pady=15)
+        book_btn.grid(row=7, column=0, columnspan=2, pady=15)
 
         # Right side - Appointments List
         list_frame = tk.Frame(content, bg="white", bd=1, relief="solid")
         list_frame.pack(side="right", fill="both", expand=True)
 
         columns = ("patient", "doctor", "date", "time")
-        self.tree = ttk.Treeview(list_frame, columns=columns, show="headings")
-        for col in columns:
-            self.tree.heading(col, text=col.title())
-            self.tree.column(col, width=150, anchor="center")
-        self.tree.pack(side="left", fill="both", expand=True, padx=(5, 0), pady=5)
-
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.table = VirtualTable(list_frame, columns, [col.title() for col in columns])
+        self.table.pack(fill="both", expand=True)
 
         del_btn = tk.Button(self, text="Delete Selected Appointment", bg=COLOR_DANGER, fg="white",
                             font=FONT_BOLD, bd=0, padx=10, pady=5, command=self.delete_appointment)
         del_btn.pack(pady=10)
+        TransferBar(self, controller, "appointments", "Appointments").pack(pady=(0, 10))
 
-        self.refresh()
+        self.load_doctors()
+        self.view = CollectionTable(controller, "appointments", self.table, self.search_bar, lambda appt: (
+            appt.get("patient name", ""), appt.get("doctor", ""), appt.get("date", ""), appt.get("time", "")),
+            ("patient name", "doctor", "date", "time"))
+        controller.store.subscribe("doctors", controller.ui(lambda event, records: self.load_doctors()))
 
     def refresh(self):
-        # Update doctor list in combobox
-        doctors = load_data(DATA_PATHS["doctors"])
-        self.doctor_combo['values'] = [d.get("name", "") for d in doctors]
+        self.controller.io.submit("doctors", self.controller.store.load, "doctors")
+        self.view.refresh()
 
-        # Load appointments
-        self.load_appointments()
+    def load_doctors(self):
+        self.controller.io.submit("doctors", self.controller.store.load, "doctors", on_done=self.show_doctors)
+
+    def show_doctors(self, doctors):
+        # Update doctor list in combobox
+        self.doctor_combo['values'] = [d.get("name", "") for d in list(doctors.values())]
 
     def load_appointments(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        appointments = load_data(DATA_PATHS["appointments"])
-        for appt in appointments:
-            self.tree.insert("", "end", values=(appt.get("patient name", ""), appt.get("doctor", ""),
-                                                appt.get("date", ""), appt.get("time", "")))
+        self.view.load()
 
     def book_appointment(self):
-        patient = self.patient_name_entry.get().strip()
+        # The service validates the fields and rejects overlapping bookings
+        self.controller.io.submit("appointments", self.controller.service.book_appointment, {
+            "patient name": self.patient_name_entry.get(),
+            "doctor": self.doctor_combo.get(),
+            "date": self.date_entry.get(),
+            "time": self.time_entry.get(),
+            "duration": int(self.duration_combo.get())
+        }, on_done=self.appointment_booked, on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+    def find_free_slots(self):
         doctor = self.doctor_combo.get().strip()
-        date = self.date_entry.get().strip()
-        time = self.time_entry.get().strip()
-
-        if not patient or not doctor or not date or not time:
-            messagebox.showerror("Error", "All fields are required")
-            return
-
-        # Simple date and time format validation
-        try:
-            datetime.datetime.strptime(date, "%Y-%m-%d")
-        except ValueError:
-            messagebox.showerror("Error", "Date must be in YYYY-MM-DD format")
-            return
-        try:
-            datetime.datetime.strptime(time, "%H:%M")
-        except ValueError:
-            messagebox.showerror("Error", "Time must be in HH:MM format")
+        if not doctor:
+            messagebox.showerror("Error", "Select a doctor first")
             return
+        self.slot_combo.set("Searching...")
+        self.controller.io.submit("appointments", self.controller.service.free_slots, doctor,
+                                  self.date_entry.get().strip(), int(self.duration_combo.get()),
+                                  on_done=self.show_free_slots,
+                                  on_error=lambda e: (self.slot_combo.set(""), messagebox.showerror("Error", str(e))))
+
+    def show_free_slots(self, slots):
+        self.slot_combo['values'] = [f"{date} {time}" for date, time in slots]
+        self.slot_combo.set(f"{len(slots)} slots found" if slots else "No free slots")
+
+    def use_slot(self, event=None):
+        date, time = self.slot_combo.get().split()
+        self.date_entry.delete(0, tk.END)
+        self.date_entry.insert(0, date)
+        self.time_entry.delete(0, tk.END)
+        self.time_entry.insert(0, time)
 
-        # Save appointment
-        appointments = load_data(DATA_PATHS["appointments"])
-        appointments.append({
-            "patient name": patient,
-            "doctor": doctor,
-            "date": date,
-            "time": time
-        })
-        save_data(DATA_PATHS["appointments"], appointments)
+    def appointment_booked(self, records):
         messagebox.showinfo("Success", "Appointment booked successfully")
         self.patient_name_entry.delete(0, tk.END)
         self.date_entry.delete(0, tk.END)
         self.time_entry.delete(0, tk.END)
-        self.load_appointments()
+        self.slot_combo.set("")
+        self.slot_combo['values'] = []
 
     def delete_appointment(self):
-        selected = self.tree.selection()
+        selected = self.table.selection()
         if not selected:
             messagebox.showwarning("Warning", "No appointment selected")
             return
-        values = self.tree.item(selected[0], "values")
-        appointments = load_data(DATA_PATHS["appointments"])
-        new_appointments = [a for a in appointments if not (
-            a.get("patient name") == values[0] and a.get("doctor") == values[1]
-            and a.get("date") == values[2] and a.get("time") == values[3]
-        )]
-        save_data(DATA_PATHS["appointments"], new_appointments)
-        self.load_appointments()
-        messagebox.showinfo("Success", "Appointment deleted successfully")
-
-# Billing Page (simplified)
+        self.controller.io.submit("appointments", self.controller.service.delete_records, "appointments", [selected[0]],
+                                  on_done=lambda removed: messagebox.showinfo(
+                                      "Success", "Appointment deleted successfully"))
+
+# Billing Page: builds a multi-line invoice of medicines and lab tests
 class BillingPage(tk.Frame):
+    collections = ("billing",) + tuple(BILLABLE)
+
     def __init__(self, parent, controller):
         super().__init__(parent, bg=COLOR_LIGHT)
         self.controller = controller
+        self.lines = []   # (collection key, item name, quantity, price) on the open invoice
+        self.prices = {}  # collection key -> {name: price}
 
         header = tk.Label(self, text="Medical Billing", font=("Segoe UI", 20, "bold"), bg=COLOR_LIGHT)
         header.pack(pady=15)
 
+        self.search_bar = SearchBar(self, lambda query: self.view.apply_search(query))
+        self.search_bar.pack(fill="x", padx=20)
+
         content = tk.Frame(self, bg=COLOR_LIGHT)
         content.pack(fill="both", expand=True, padx=20, pady=10)
 
@@ -533,114 +1080,381 @@ class BillingPage(tk.Frame):
         self.patient_entry = tk.Entry(form_frame, width=30)
         self.patient_entry.grid(row=0, column=1, pady=5, padx=5)
 
-        # Medicine selection with price display
-        tk.Label(form_frame, text="Select Medicine:", bg="white").grid(row=1, column=0, sticky="e", pady=5, padx=5)
-        self.medicine_combo = ttk.Combobox(form_frame, width=28, state="readonly")
-        self.medicine_combo.grid(row=1, column=1, pady=5, padx=5)
-        self.medicine_combo.bind("<<ComboboxSelected>>", self.show_price)
+        # Item selection with price display
+        tk.Label(form_frame, text="Item Type:", bg="white").grid(row=1, column=0, sticky="e", pady=5, padx=5)
+        self.type_combo = ttk.Combobox(form_frame, width=28, state="readonly",
+                                       values=[label for label, _ in BILLABLE.values()])
+        self.type_combo.set(BILLABLE["medicines"][0])
+        self.type_combo.grid(row=1, column=1, pady=5, padx=5)
+        self.type_combo.bind("<<ComboboxSelected>>", self.show_items)
+
+        tk.Label(form_frame, text="Select Item:", bg="white").grid(row=2, column=0, sticky="e", pady=5, padx=5)
+        self.item_combo = ttk.Combobox(form_frame, width=28, state="readonly")
+        self.item_combo.grid(row=2, column=1, pady=5, padx=5)
+        self.item_combo.bind("<<ComboboxSelected>>", self.show_price)
 
-        tk.Label(form_frame, text="Price:", bg="white").grid(row=2, column=0, sticky="e", pady=5, padx=5)
+        tk.Label(form_frame, text="Price:", bg="white").grid(row=3, column=0, sticky="e", pady=5, padx=5)
         self.price_var = tk.StringVar()
         self.price_label = tk.Label(form_frame, textvariable=self.price_var, bg="white")
-        self.price_label.grid(row=2, column=1, pady=5, padx=5)
+        self.price_label.grid(row=3, column=1, pady=5, padx=5)
 
-        tk.Label(form_frame, text="Quantity:", bg="white").grid(row=3, column=0, sticky="e", pady=5, padx=5)
+        tk.Label(form_frame, text="Quantity:", bg="white").grid(row=4, column=0, sticky="e", pady=5, padx=5)
         self.quantity_entry = tk.Entry(form_frame, width=30)
-        self.quantity_entry.grid(row=3, column=1, pady=5, padx=5)
+        self.quantity_entry.grid(row=4, column=1, pady=5, padx=5)
+
+        line_btns = tk.Frame(form_frame, bg="white")
+        line_btns.grid(row=5, column=0, columnspan=2, pady=5)
+        tk.Button(line_btns, text="Add Line", bg=COLOR_SUCCESS, fg="white", font=FONT, bd=0, padx=10, pady=3,
+                  command=self.add_line).pack(side="left", padx=5)
+        tk.Button(line_btns, text="Remove Line", bg=COLOR_WARNING, font=FONT, bd=0, padx=10, pady=3,
+                  command=self.remove_line).pack(side="left", padx=5)
+
+        self.lines_tree = ttk.Treeview(form_frame, columns=("item", "quantity", "total"), show="headings", height=6)
+        for col, width in (("item", 150), ("quantity", 70), ("total", 80)):
+            self.lines_tree.heading(col, text=col.title())
+            self.lines_tree.column(col, width=width, anchor="center")
+        self.lines_tree.grid(row=6, column=0, columnspan=2, padx=5, pady=5)
+
+        self.invoice_total_var = tk.StringVar(value="Invoice Total: 0.00")
+        tk.Label(form_frame, textvariable=self.invoice_total_var, font=FONT_BOLD, bg="white").grid(
+            row=7, column=0, columnspan=2, pady=5)
 
         bill_btn = tk.Button(form_frame, text="Generate Bill", bg=COLOR_PRIMARY, fg="white", font=FONT_BOLD,
                              bd=0, padx=10, pady=5, command=self.generate_bill)
-        bill_btn.grid(row=4, column=0, columnspan=2, pady=15)
+        bill_btn.grid(row=8, column=0, columnspan=2, pady=15)
 
         # Billing List
         list_frame = tk.Frame(content, bg="white", bd=1, relief="solid")
         list_frame.pack(side="right", fill="both", expand=True)
 
-        columns = ("patient", "medicine", "quantity", "price", "total")
-        self.tree = ttk.Treeview(list_frame, columns=columns, show="headings")
-        for col in columns:
-            self.tree.heading(col, text=col.title())
-            self.tree.column(col, width=120, anchor="center")
-        self.tree.pack(side="left", fill="both", expand=True, padx=(5, 0), pady=5)
-
-        scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        columns = ("patient", "item", "quantity", "price", "total", "date")
+        self.table = VirtualTable(list_frame, columns, [col.title() for col in columns], width=100)
+        self.table.pack(fill="both", expand=True)
 
         del_btn = tk.Button(self, text="Delete Selected Bill", bg=COLOR_DANGER, fg="white",
                             font=FONT_BOLD, bd=0, padx=10, pady=5, command=self.delete_bill)
         del_btn.pack(pady=10)
+        TransferBar(self, controller, "billing", "Bills").pack(pady=(0, 10))
+
+        for key in BILLABLE:
+            self.load_prices(key)
+            controller.store.subscribe(key, controller.ui(lambda event, records, key=key: self.load_prices(key)))
+        self.view = CollectionTable(controller, "billing", self.table, self.search_bar, lambda b: (
+            b.get("patient"), b.get("item", b.get("medicine")), b.get("quantity"), b.get("price"),
+            b.get("total"), b.get("date", "")), columns)
+
+    def refresh(self):
+        for key in BILLABLE:
+            self.controller.io.submit(key, self.controller.store.load, key)
+        self.view.refresh()
+
+    def load_prices(self, key):
+        self.controller.io.submit(key, self.controller.service.prices, key,
+                                  on_done=lambda prices: self.show_prices(key, prices))
 
-        self.load_medicines()
-        self.load_bills()
+    def show_prices(self, key, prices):
+        self.prices[key] = prices
+        self.show_items()
 
-    def load_medicines(self):
-        medicines = load_data(DATA_PATHS["medicines"])
-        self.medicine_combo['values'] = [m.get("name", "") for m in medicines]
-        self.medicines_data = {m.get("name", ""): m for m in medicines}
+    def selected_type(self):
+        label = self.type_combo.get()
+        return next(key for key, (text, _) in BILLABLE.items() if text == label)
+
+    def show_items(self, event=None):
+        items = self.prices.get(self.selected_type(), {})
+        self.item_combo['values'] = list(items)
+        if self.item_combo.get() not in items:
+            self.item_combo.set("")
+        self.show_price()
 
     def show_price(self, event=None):
-        med_name = self.medicine_combo.get()
-        if med_name in self.medicines_data:
-            self.price_var.set(self.medicines_data[med_name].get("price", "0"))
-        else:
-            self.price_var.set("")
+        price = self.prices.get(self.selected_type(), {}).get(self.item_combo.get())
+        self.price_var.set("" if price is None else price)
 
-    def generate_bill(self):
-        patient = self.patient_entry.get().strip()
-        medicine = self.medicine_combo.get().strip()
+    def add_line(self):
+        item = self.item_combo.get().strip()
         quantity = self.quantity_entry.get().strip()
-        if not patient or not medicine or not quantity:
-            messagebox.showerror("Error", "All fields are required")
+        if not item or not quantity:
+            messagebox.showerror("Error", "Select an item and enter a quantity")
             return
         if not quantity.isdigit():
             messagebox.showerror("Error", "Quantity must be a number")
             return
+        key = self.selected_type()
+        price = self.prices[key][item]
+        self.lines.append((key, item, int(quantity), price))
+        self.lines_tree.insert("", "end", values=(item, quantity, f"{price * int(quantity):.2f}"))
+        self.quantity_entry.delete(0, tk.END)
+        self.update_invoice_total()
+
+    def remove_line(self):
+        selected = self.lines_tree.selection()
+        if not selected:
+            return
+        del self.lines[self.lines_tree.index(selected[0])]
+        self.lines_tree.delete(selected[0])
+        self.update_invoice_total()
+
+    def update_invoice_total(self):
+        total = sum(price * qty for _, _, qty, price in self.lines)
+        self.invoice_total_var.set(f"Invoice Total: {total:.2f}")
+
+    def generate_bill(self):
+        # The whole invoice is priced and written in one batched commit
+        items = [(key, item, qty) for key, item, qty, _ in self.lines]
+        self.controller.io.submit("billing", self.controller.service.create_invoice, self.patient_entry.get(), items,
+                                  on_done=self.bill_generated,
+                                  on_error=lambda e: messagebox.showerror("Error", str(e)))
 
-        price = float(self.price_var.get())
-        qty = int(quantity)
-        total = price * qty
-
-        bills = load_data(DATA_PATHS["billing"])
-        bills.append({
-            "patient": patient,
-            "medicine": medicine,
-            "quantity": qty,
-            "price": price,
-            "total": total
-        })
-        save_data(DATA_PATHS["billing"], bills)
-        messagebox.showinfo("Success", "Bill generated successfully")
+    def bill_generated(self, records):
+        messagebox.showinfo("Success", f"Bill generated successfully ({len(records)} lines)")
 
         self.patient_entry.delete(0, tk.END)
         self.quantity_entry.delete(0, tk.END)
-        self.load_bills()
+        self.lines = []
+        self.lines_tree.delete(*self.lines_tree.get_children())
+        self.update_invoice_total()
 
     def load_bills(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        bills = load_data(DATA_PATHS["billing"])
-        for b in bills:
-            self.tree.insert("", "end", values=(b.get("patient"), b.get("medicine"),
-                                                b.get("quantity"), b.get("price"), b.get("total")))
+        self.view.load()
 
     def delete_bill(self):
-        selected = self.tree.selection()
+        selected = self.table.selection()
         if not selected:
             messagebox.showwarning("Warning", "No bill selected")
             return
-        values = self.tree.item(selected[0], "values")
-        bills = load_data(DATA_PATHS["billing"])
-        new_bills = [b for b in bills if not (
-            b.get("patient") == values[0] and b.get("medicine") == values[1]
-            and str(b.get("quantity")) == values[2] and str(b.get("price")) == values[3]
-            and str(b.get("total")) == values[4]
-        )]
-        save_data(DATA_PATHS["billing"], new_bills)
-        self.load_bills()
-        messagebox.showinfo("Success", "Bill deleted successfully")
+        self.controller.io.submit("billing", self.controller.service.delete_records, "billing", [selected[0]],
+                                  on_done=lambda removed: messagebox.showinfo(
+                                      "Success", "Bill deleted successfully"))
+
+# End-of-period reports (hospital_reports), worked out on the "reports"
+# IOWorker thread from the store's records; after an edit only the days it
+# touched are aggregated again
+class ReportsPage(tk.Frame):
+    collections = ("billing", "appointments")
+    FILE_TYPES = [("CSV files", "*.csv"), ("JSON files", "*.json")]
+
+    def __init__(self, parent, controller):
+        super().__init__(parent, bg=COLOR_LIGHT)
+        self.controller = controller
+        # hospital_reports (and the multiprocessing it pulls in) is imported
+        # only once this page is first shown
+        from hospital_reports import REPORTS, ReportEngine
+        self.engine = ReportEngine(controller.store.backend, controller.store)
+        self.names = {title: name for name, (title, _, _) in REPORTS.items()}
+        self.sources = {name: key for name, (_, key, _) in REPORTS.items()}
+        self.tables = {}  # report name -> VirtualTable, built when first shown
+        self.shown = None  # The report on screen
+
+        header = tk.Label(self, text="Reports", font=("Segoe UI", 20, "bold"), bg=COLOR_LIGHT)
+        header.pack(pady=15)
+
+        controls = tk.Frame(self, bg=COLOR_LIGHT)
+        controls.pack(fill="x", padx=20)
+        tk.Label(controls, text="Report:", font=FONT, bg=COLOR_LIGHT).pack(side="left")
+        self.report_combo = ttk.Combobox(controls, values=list(self.names), state="readonly", width=32)
+        self.report_combo.current(0)
+        self.report_combo.pack(side="left", padx=5)
+        self.report_combo.bind("<<ComboboxSelected>>", lambda e: self.run())
+        today = datetime.date.today()
+        tk.Label(controls, text="From:", font=FONT, bg=COLOR_LIGHT).pack(side="left", padx=(10, 0))
+        self.from_entry = tk.Entry(controls, font=FONT, width=12)
+        self.from_entry.insert(0, today.replace(day=1).isoformat())
+        self.from_entry.pack(side="left", padx=5)
+        tk.Label(controls, text="To:", font=FONT, bg=COLOR_LIGHT).pack(side="left")
+        self.to_entry = tk.Entry(controls, font=FONT, width=12)
+        self.to_entry.insert(0, today.isoformat())
+        self.to_entry.pack(side="left", padx=5)
+        for text, color, command in (("Run", COLOR_PRIMARY, self.run), ("Export...", COLOR_DARK, self.export)):
+            tk.Button(controls, text=text, bg=color, fg="white", font=FONT, bd=0, padx=10, pady=3,
+                      command=command).pack(side="left", padx=5)
+        self.status_label = tk.Label(controls, font=FONT, bg=COLOR_LIGHT, fg="#6c757d")
+        self.status_label.pack(side="right")
+
+        self.table_frame = tk.Frame(self, bg="white", bd=1, relief="solid")
+        self.table_frame.pack(fill="both", expand=True, padx=20, pady=10)
+
+    def selected(self):
+        return self.names[self.report_combo.get()]
+
+    def run(self):
+        # A blank date leaves that end of the period open
+        start, end = self.from_entry.get().strip() or None, self.to_entry.get().strip() or None
+        try:
+            for date in (start, end):
+                if date is not None:
+                    datetime.date.fromisoformat(date)
+        except ValueError:
+            messagebox.showerror("Error", "Dates must be YYYY-MM-DD")
+            return
+        self.status_label.config(text="Working...")
+        self.controller.io.submit("reports", self._report, self.selected(), start, end, on_done=self.show,
+                                  on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+    def _report(self, name, start, end):
+        started = time.perf_counter()
+        report = self.engine.report(name, start, end)
+        return report, self.engine.recomputed[self.sources[name]], time.perf_counter() - started
+
+    def show(self, result):
+        report, recomputed, seconds = result
+        if report["report"] != self.selected():
+            return  # Another report was picked meanwhile
+        for table in self.tables.values():
+            table.pack_forget()
+        table = self.tables.get(report["report"])
+        if table is None:
+            columns = report["columns"]
+            table = self.tables[report["report"]] = VirtualTable(self.table_frame, columns,
+                                                                 [c.title() for c in columns])
+        table.pack(fill="both", expand=True)
+        rows = report["rows"]
+        table.set_rows([str(i) for i in range(len(rows))], lambda rid: rows[int(rid)])
+        self.shown = report
+        days = "all days" if recomputed == "all" else f"{recomputed} changed day{'s' * (recomputed != 1)}"
+        self.status_label.config(text=f"{len(rows)} rows, {days} recomputed in {seconds * 1000:.0f} ms")
+
+    def refresh(self):
+        # Brings the report on screen up to date, if there is one
+        if self.shown is not None:
+            self.run()
+
+    def export(self):
+        if self.shown is None:
+            messagebox.showwarning("Warning", "Run a report first")
+            return
+        report = self.shown
+        path = filedialog.asksaveasfilename(title=f"Export {report['title']}", filetypes=self.FILE_TYPES,
+                                            defaultextension=".csv", initialfile=f"{report['report']}.csv")
+        if not path:
+            return
+        from hospital_reports import save_report
+        self.controller.io.submit("reports", save_report, report, path,
+                                  on_done=lambda _: messagebox.showinfo("Export", f"Report written to {path}"),
+                                  on_error=lambda e: messagebox.showerror("Error", str(e)))
+
+# Diagnostics Page: per-operation latency histograms from the instrumentation
+class DiagnosticsPage(tk.Frame):
+    COLUMNS = (("operation", "Operation", 200), ("count", "Count", 70), ("p50_ms", "p50 ms", 80),
+               ("p95_ms", "p95 ms", 80), ("p99_ms", "p99 ms", 80), ("max_ms", "Max ms", 80),
+               ("bytes_read", "Bytes Read", 110), ("bytes_written", "Bytes Written", 110))
+
+    def __init__(self, parent, controller):
+        super().__init__(parent, bg=COLOR_LIGHT)
+        self.controller = controller
+
+        header = tk.Label(self, text="Diagnostics", font=("Segoe UI", 20, "bold"), bg=COLOR_LIGHT)
+        header.pack(pady=15)
+
+        controls = tk.Frame(self, bg=COLOR_LIGHT)
+        controls.pack(fill="x", padx=20)
+        self.enabled_var = tk.BooleanVar(value=metrics.enabled)
+        tk.Checkbutton(controls, text="Record timings", variable=self.enabled_var, font=FONT, bg=COLOR_LIGHT,
+                       command=self.toggle).pack(side="left")
+        for text, color, command in (("Refresh", COLOR_PRIMARY, self.refresh), ("Reset", COLOR_WARNING, self.reset),
+                                     ("Export JSON...", COLOR_DARK, self.export)):
+            tk.Button(controls, text=text, bg=color, fg="white" if color != COLOR_WARNING else "black", font=FONT,
+                      bd=0, padx=10, pady=3, command=command).pack(side="left", padx=5)
+        self.since_label = tk.Label(controls, font=FONT, bg=COLOR_LIGHT, fg="#6c757d")
+        self.since_label.pack(side="right")
+
+        table_frame = tk.Frame(self, bg="white", bd=1, relief="solid")
+        table_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        self.tree = ttk.Treeview(table_frame, columns=[c for c, _, _ in self.COLUMNS], show="headings")
+        for col, text, width in self.COLUMNS:
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor="w" if col == "operation" else "e")
+        scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side="left", fill="both", expand=True, padx=(5, 0), pady=5)
+        scrollbar.pack(side="right", fill="y")
+
+    def toggle(self):
+        metrics.enabled = self.enabled_var.get()
+        self.refresh()
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def refresh(self):
+        snapshot = metrics.snapshot()
+        self.since_label.config(text=f"Since {snapshot['since']}" if snapshot["enabled"] else "Not recording")
+        self.tree.delete(*self.tree.get_children())
+        for name, stats in snapshot["operations"].items():
+            self.tree.insert("", "end", values=[name] + [stats[col] for col, _, _ in self.COLUMNS[1:]])
+
+    def export(self):
+        path = filedialog.asksaveasfilename(title="Export Timings", defaultextension=".json",
+                                            filetypes=[("JSON files", "*.json")], initialfile="timings.json")
+        if not path:
+            return
+        try:
+            with open(path, "w") as f:
+                json.dump(metrics.snapshot(), f, indent=2)
+        except OSError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        messagebox.showinfo("Export", f"Timings written to {path}")
 
 # Run application
 if __name__ == "__main__":
-    app = HospitalApp()
+    parser = argparse.ArgumentParser(description="Hospital Management System")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default=STORAGE_MODE,
+                        help="storage backend for all collections")
+    parser.add_argument("--db", default=SQLITE_PATH, help="SQLite database file for --storage sqlite")
+    parser.add_argument("--migrate-to-sqlite", action="store_true",
+                        help="copy the JSON data files into the SQLite database and exit")
+    parser.add_argument("--to-snapshot", action="store_true",
+                        help="write each JSON data file (and journal) as a .hms snapshot and exit")
+    parser.add_argument("--from-snapshot", action="store_true",
+                        help="write each .hms snapshot back to its JSON data file and exit")
+    parser.add_argument("--import", dest="import_file", nargs=2, action="append", metavar=("COLLECTION", "FILE"),
+                        help="bulk-import a .csv or .jsonl file into a collection and exit (repeatable)")
+    parser.add_argument("--export", dest="export_file", nargs=2, action="append", metavar=("COLLECTION", "FILE"),
+                        help="export a collection to a .csv or .jsonl file and exit (repeatable)")
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_ROWS, help="rows per commit when importing")
+    parser.add_argument("--server", metavar="URL",
+                        help="use a running hospital_server.py (e.g. http://127.0.0.1:8765) instead of local files")
+    parser.add_argument("--metrics", action="store_true", help="record operation timings from startup")
+    parser.add_argument("--write-behind", type=int, default=WRITE_BEHIND_MS, metavar="MS",
+                        help="hold edits in memory and save each collection MS ms after the last one")
+    parser.add_argument("--no-prewarm", action="store_true",
+                        help="build each page on first visit only, not in idle time after login")
+    parser.add_argument("--watch", choices=["auto", "poll", "off"], default=WATCH_MODE,
+                        help="refresh the open page when another workstation changes its data: inotify where "
+                             "available (auto), stat polling (poll, for network shares) or not at all (off)")
+    args = parser.parse_args()
+    metrics.enabled = metrics.enabled or args.metrics
+
+    for key, _ in (args.import_file or []) + (args.export_file or []):
+        if key not in DATA_PATHS:
+            parser.error(f"unknown collection {key!r} (choose from {', '.join(DATA_PATHS)})")
+    if args.import_file or args.export_file:
+        service = HospitalService(RecordStore(make_backend(args.storage, DATA_PATHS, args.db)))
+        try:
+            for key, path in args.import_file or ():
+                print(json.dumps(import_file(service, key, path, chunk_size=args.chunk_size)))
+            for key, path in args.export_file or ():
+                print(json.dumps({"collection": key, "file": path, "exported": export_file(service, key, path)}))
+        except (OSError, ValueError) as e:
+            raise SystemExit(f"error: {e}")
+        raise SystemExit(0)
+
+    if args.migrate_to_sqlite or args.to_snapshot or args.from_snapshot:
+        if args.migrate_to_sqlite:
+            counts = migrate_json_to_sqlite(DATA_PATHS, args.db)
+        else:
+            counts = (convert_to_snapshot if args.to_snapshot else convert_from_snapshot)(DATA_PATHS)
+        for key, count in counts.items():
+            print(f"{key}: {count} records")
+        raise SystemExit(0)
+
+    if args.server:
+        from hospital_server import RemoteService
+        service = RemoteService(args.server)
+    else:
+        service = HospitalService(RecordStore(make_backend(args.storage, DATA_PATHS, args.db),
+                                              args.write_behind or None))
+    app = HospitalApp(service, prewarm=not args.no_prewarm, watch=args.watch)
     app.mainloop()
@@ -0,0 +1,588 @@
+import json
+import os
+import sys
+import time
+import queue
+import random
+import shutil
+import datetime
+import platform
+import tempfile
+import tracemalloc
+import argparse
+import subprocess
+import multiprocessing
+import hospital_service
+from hospital_service import (DATA_PATHS, STORAGE_MODE, SQLITE_PATH, TOTAL_BEDS, CLINIC_HOURS, SLOT_MINUTES,
+                              RecordStore, HospitalService, SqliteBackend, make_backend, load_data, save_data,
+                              JsonBackend, SnapshotBackend, SnapshotFile, snapshot_path, write_snapshot)
+
+FIRST_NAMES = ("James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "Aarav", "Priya", "Rahul", "Ananya", "Vikram", "Sneha", "Arjun", "Kavya", "Rohan", "Isha")
+LAST_NAMES = ("Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Wilson", "Taylor",
+              "Sharma", "Patel", "Singh", "Kumar", "Gupta", "Reddy", "Iyer", "Nair", "Das", "Joshi")
+DISEASES = ("Flu", "Diabetes", "Hypertension", "Asthma", "Fracture", "Migraine", "Malaria", "Dengue",
+            "Bronchitis", "Allergy", "Typhoid", "Arthritis", "Anemia", "Gastritis", "Covid-19")
+SPECIALIZATIONS = ("General", "Cardiology", "Neurology", "Orthopedics", "Pediatrics", "Dermatology",
+                   "ENT", "Gynecology", "Oncology", "Psychiatry")
+ROLES = ("Nurse", "Receptionist", "Pharmacist", "Technician", "Cleaner", "Accountant", "Ward Boy")
+DRUGS = ("Paracetamol", "Amoxicillin", "Ibuprofen", "Metformin", "Amlodipine", "Omeprazole", "Cetirizine",
+         "Azithromycin", "Insulin", "Salbutamol", "Atorvastatin", "Losartan", "Pantoprazole", "Dolo")
+FORMS = ("500mg", "250mg", "10mg", "Syrup", "Injection", "Drops")
+TESTS = ("Blood Count", "Lipid Profile", "Thyroid Panel", "X-Ray", "MRI", "CT Scan", "Urinalysis",
+         "ECG", "Liver Function", "Kidney Function", "HbA1c", "Vitamin D")
+MACHINES = ("Ventilator", "ECG Monitor", "Defibrillator", "Infusion Pump", "Ultrasound", "Dialysis Unit",
+            "Autoclave", "Patient Monitor")
+SUPPLIERS = ("Medline", "Philips", "GE Healthcare", "Siemens", "Mindray", "BPL")
+
+# Rows per collection for a given patient count: appointments and bills grow
+# with patients, the reference collections much more slowly
+def collection_sizes(rows):
+    return {
+        "patients": rows,
+        "doctors": max(5, rows // 200),
+        "staff": max(5, rows // 100),
+        "medicines": max(20, rows // 500),
+        "lab_tests": max(10, rows // 5000),
+        "appointments": rows,
+        "machinery": max(5, rows // 1000),
+        "billing": rows,
+    }
+
+# Seeded synthetic records for every collection, shaped like the ones the
+# entry forms, the booking page and create_invoice write. Appointments are
+# laid out on each doctor's slot grid from `start` on, so none overlap.
+class SyntheticData:
+    def __init__(self, rows, seed=0, start=None):
+        self.rows = rows
+        self.sizes = collection_sizes(rows)
+        self.seed = seed
+        self.start = start or datetime.date.today() - datetime.timedelta(days=60)
+
+    def records(self, key):
+        rng = random.Random(f"{self.seed}-{key}")
+        for i in range(self.sizes[key]):
+            rec = getattr(self, "_" + key)(rng, i)
+            rec["id"] = f"{rng.getrandbits(128):032x}"
+            yield rec
+
+    def _name(self, rng, i):
+        return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+
+    def patient_name(self, i):
+        # Same as the name the patients collection gives patient i
+        return self._name(random.Random(f"{self.seed}-patient-{i}"), i)
+
+    def doctor_name(self, i):
+        return f"Dr {self._name(random.Random(f'{self.seed}-doctor-{i}'), i)}"
+
+    def medicine_name(self, i):
+        return f"{DRUGS[i % len(DRUGS)]} {FORMS[i // len(DRUGS) % len(FORMS)]} #{i}"
+
+    def lab_test_name(self, i):
+        return f"{TESTS[i % len(TESTS)]} #{i}"
+
+    def _patients(self, rng, i):
+        rec = {"name": self.patient_name(i), "age": str(rng.randint(1, 95)), "disease": rng.choice(DISEASES)}
+        if i < TOTAL_BEDS * 4 // 5:
+            rec["bed"] = f"B{i + 1:02d}"
+        return rec
+
+    def _doctors(self, rng, i):
+        return {"name": self.doctor_name(i), "specialization": rng.choice(SPECIALIZATIONS),
+                "phone": f"98{rng.randrange(10 ** 8):08d}"}
+
+    def _staff(self, rng, i):
+        return {"name": self._name(rng, i), "role": rng.choice(ROLES), "phone": f"97{rng.randrange(10 ** 8):08d}"}
+
+    def _medicines(self, rng, i):
+        return {"name": self.medicine_name(i), "quantity": str(rng.randint(0, 5000)),
+                "price": f"{rng.uniform(1, 500):.2f}", "reorder level": str(rng.choice((10, 20, 50, 100)))}
+
+    def _lab_tests(self, rng, i):
+        return {"test name": self.lab_test_name(i), "price": f"{rng.uniform(100, 5000):.2f}"}
+
+    def _machinery(self, rng, i):
+        return {"machine name": f"{rng.choice(MACHINES)} #{i}", "quantity": str(rng.randint(1, 20)),
+                "supplier": rng.choice(SUPPLIERS)}
+
+    def _appointments(self, rng, i):
+        doctors = self.sizes["doctors"]
+        opens, closes = (hospital_service._minutes(t) for t in CLINIC_HOURS)
+        per_day = (closes - opens) // SLOT_MINUTES
+        slot = i // doctors
+        return {"patient name": self.patient_name(rng.randrange(self.rows)), "doctor": self.doctor_name(i % doctors),
+                "date": (self.start + datetime.timedelta(days=slot // per_day)).isoformat(),
+                "time": hospital_service._hhmm(opens + slot % per_day * SLOT_MINUTES), "duration": SLOT_MINUTES}
+
+    def _billing(self, rng, i):
+        if rng.random() < 0.7:
+            key, name = "medicines", self.medicine_name(rng.randrange(self.sizes["medicines"]))
+            price = round(rng.uniform(1, 500), 2)
+        else:
+            key, name = "lab_tests", self.lab_test_name(rng.randrange(self.sizes["lab_tests"]))
+            price = round(rng.uniform(100, 5000), 2)
+        qty = rng.randint(1, 10)
+        line = {"invoice": f"{rng.getrandbits(64):016x}", "patient": self.patient_name(rng.randrange(self.rows)),
+                "type": key, "item": name, "quantity": qty, "price": price, "total": round(price * qty, 2),
+                "date": (self.start + datetime.timedelta(days=rng.randrange(90))).isoformat()}
+        if key == "medicines":
+            line["medicine"] = name
+        return line
+
+def _write_json(path, records):
+    # Streams the same text json.dump(records, f, indent=2) would produce
+    with open(path, "w") as f:
+        f.write("[")
+        for n, rec in enumerate(records):
+            f.write(",\n" if n else "\n")
+            f.write("  " + json.dumps(rec, indent=2).replace("\n", "\n  "))
+        f.write("\n]" if f.tell() > 1 else "]")
+
+def generate(directory, rows, storage="json", seed=0, force=False):
+    # Writes every collection into `directory` (the DATA_PATHS files, their
+    # snapshots or the SQLite database); returns the row count per collection
+    os.makedirs(directory, exist_ok=True)
+    paths = _paths(directory)
+    if storage == "sqlite":
+        targets = [os.path.join(directory, SQLITE_PATH)]
+    elif storage == "snapshot":
+        targets = [snapshot_path(path) for path in paths.values()]
+    else:
+        targets = list(paths.values())
+    existing = [p for p in targets if os.path.exists(p)]
+    if existing and not force:
+        raise FileExistsError(f"{existing[0]} exists (use --force to overwrite)")
+    data = SyntheticData(rows, seed)
+    if storage == "sqlite":
+        backend = SqliteBackend(targets[0])
+        for key in paths:
+            backend.write(key, data.records(key))
+        backend.conn.close()
+    elif storage == "snapshot":
+        for key, path in zip(paths, targets):
+            write_snapshot(path, data.records(key))
+    else:
+        for key, path in paths.items():
+            _write_json(path, data.records(key))
+            if os.path.exists(path + ".journal"):
+                os.remove(path + ".journal")
+    return dict(data.sizes)
+
+def _paths(directory):
+    return {key: os.path.join(directory, path) for key, path in DATA_PATHS.items()}
+
+def _summary(timings):
+    timings = sorted(timings)
+    ms = lambda s: round(s * 1000, 3)
+    return {"runs": len(timings), "mean_ms": ms(sum(timings) / len(timings)), "min_ms": ms(timings[0]),
+            "p50_ms": ms(timings[len(timings) // 2]), "p95_ms": ms(timings[int(len(timings) * 0.95)]),
+            "max_ms": ms(timings[-1])}
+
+def _time(fn, repeat, setup=None):
+    timings = []
+    for i in range(repeat):
+        args = setup(i) if setup is not None else ()
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return _summary(timings)
+
+def _booking(service, data, i):
+    # A free slot for one of the doctors, found outside the timed call
+    doctor = data.doctor_name(i % data.sizes["doctors"])
+    (date, at), = service.free_slots(doctor, count=1)
+    return {"patient name": data.patient_name(i % data.rows), "doctor": doctor, "date": date, "time": at,
+            "duration": SLOT_MINUTES}
+
+def _walk_in(i):
+    return {"name": f"Bench Walk-in {i}", "age": "40", "disease": "Flu"}
+
+# Data layer timings: load_data cold (files re-read) and warm (cached), a full
+# save_data rewrite, and the service calls behind the page actions
+def service_benchmarks(service, data, repeat):
+    results = {}
+    results["prime"] = _time(service.prime, 1)
+    for key, path in DATA_PATHS.items():
+        results[f"load_data[{key}].cold"] = _time(load_data, repeat, lambda i, key=key, path=path: (
+            service.store.invalidate(key), (path,))[1])
+        results[f"load_data[{key}].warm"] = _time(load_data, repeat, lambda i, path=path: (path,))
+    for key in ("patients", "appointments", "billing"):
+        path = DATA_PATHS[key]
+        records = load_data(path)
+        results[f"save_data[{key}]"] = _time(save_data, repeat, lambda i, path=path: (path, records))
+
+    added = []
+    results["add_record[patients]"] = _time(lambda rec: added.append(service.add_record("patients", rec)["id"]),
+                                            repeat, lambda i: (_walk_in(i),))
+    results["delete_record[patients]"] = _time(service.delete_records, repeat,
+                                               lambda i: ("patients", [added[i]]))
+    results["dashboard"] = _time(service.dashboard, repeat)
+    results["book_appointment"] = _time(service.book_appointment, repeat,
+                                        lambda i: (_booking(service, data, i),))
+
+    # Column sorts: a full build parses every record's key; later clicks (either
+    # direction) copy the cached order, and writes patch it in place
+    for key, field in (("patients", "age"), ("appointments", "date"), ("billing", "total")):
+        index = service.sort_index(key, field)
+        results[f"sort[{key}.{field}].build"] = _time(index.rebuild, repeat)
+        results[f"sort[{key}.{field}].cached"] = _time(service.sorted_ids, repeat,
+                                                       lambda i, key=key, field=field: (key, field, i % 2 == 1))
+    # One patient's history: the first call builds the reference indexes
+    patients = list(service.store.load("patients"))
+    results["patient_history.first"] = _time(service.patient_history, 1, lambda i: (patients[0],))
+    results["patient_history"] = _time(service.patient_history, repeat,
+                                       lambda i: (patients[(i + 1) * 7919 % len(patients)],))
+    added = []
+    results["add_record[patients].sorted"] = _time(
+        lambda rec: added.append(service.add_record("patients", rec)["id"]), repeat, lambda i: (_walk_in(i),))
+    service.delete_records("patients", added)
+    return results
+
+# Stands in for tkinter.messagebox while the pages are driven, so actions
+# finish on their confirmation instead of waiting for a click
+class _Dialogs:
+    def __init__(self):
+        self.shown = []
+
+    def _show(self, kind):
+        return lambda title, message, **kw: self.shown.append((kind, title, message))
+
+    def __getattr__(self, name):
+        if name.startswith("show"):
+            return self._show(name[4:])
+        raise AttributeError(name)
+
+def _pump(app, done, timeout=600):
+    # Runs posted IOWorker results on this thread until done() holds and
+    # nothing is left in the queue, then lets Tk redraw
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            fn, args = app._ui_queue.get(timeout=0.01)
+        except queue.Empty:
+            if done():
+                break
+            if time.perf_counter() > deadline:
+                raise TimeoutError("UI action did not finish")
+            continue
+        fn(*args)
+    app.update_idletasks()
+
+# Page timings through the real Tk widgets. Needs a display; run under
+# xvfb-run on a headless machine. Returns None when no display is available.
+def ui_benchmarks(service, data, repeat):
+    try:
+        import tkinter
+        import Hospital
+    except ImportError as e:
+        return None, str(e)
+    try:
+        started = time.perf_counter()
+        app = Hospital.HospitalApp(service, prewarm=False)
+        app.update_idletasks()
+        startup = _summary([time.perf_counter() - started])
+    except tkinter.TclError as e:  # no display
+        return None, str(e)
+
+    dialogs = _Dialogs()
+    real_dialogs, Hospital.messagebox = Hospital.messagebox, dialogs
+    try:
+        app.withdraw()
+        app.login_success()
+        patients = app.page(Hospital.PatientManagementPage)
+        booking = app.page(Hospital.AppointmentBookingPage)
+        dashboard = app.page(Hospital.DashboardPage)
+        loaded = lambda page: page.table.count_label.cget("text") != "Loading..."
+        _pump(app, lambda: all(loaded(page) for page in app.frames.values() if hasattr(page, "table")))
+
+        def confirmed(action):
+            # Runs a page action and waits for its confirmation dialog
+            count = len(dialogs.shown)
+            action()
+            _pump(app, lambda: len(dialogs.shown) > count)
+            kind, title, message = dialogs.shown[-1]
+            if kind != "info":
+                raise RuntimeError(f"{title}: {message}")
+
+        def load_records():
+            patients.load_records()
+            _pump(app, lambda: loaded(patients))
+
+        def add_record(i):
+            for field, value in _walk_in(f"ui {i}").items():
+                patients.entries[field].delete(0, tkinter.END)
+                patients.entries[field].insert(0, value)
+            confirmed(patients.add_record)
+
+        def delete_record():
+            patients.table.tree.selection_set(patients.table.tree.get_children()[0])
+            confirmed(patients.delete_record)
+
+        def update_stats():
+            dashboard.update_stats()
+            _pump(app, lambda: all(label.cget("text") != "..." for label in dashboard.cards.values()))
+
+        def book(record):
+            booking.patient_name_entry.insert(0, record["patient name"])
+            booking.doctor_combo.set(record["doctor"])
+            booking.date_entry.insert(0, record["date"])
+            booking.time_entry.insert(0, record["time"])
+            booking.duration_combo.set(record["duration"])
+            confirmed(booking.book_appointment)
+
+        def show_frame(i):
+            app.show_frame(app.pages[i % len(app.pages)])
+            app.update_idletasks()
+
+        return {
+            "HospitalApp.startup": startup,
+            "BaseManagementPage.load_records[patients]": _time(load_records, repeat),
+            "BaseManagementPage.add_record[patients]": _time(add_record, repeat, lambda i: (i,)),
+            "BaseManagementPage.delete_record[patients]": _time(delete_record, repeat),
+            "DashboardPage.update_stats": _time(update_stats, repeat),
+            "AppointmentBookingPage.book_appointment": _time(book, repeat,
+                                                             lambda i: (_booking(service, data, repeat + i),)),
+            "HospitalApp.show_frame": _time(show_frame, repeat, lambda i: (i,)),
+        }, None
+    finally:
+        Hospital.messagebox = real_dialogs
+        app.on_close()
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def format_benchmarks(store, workdir, repeat):
+    # The same records as JSON files and as snapshots: a full parse, a cold
+    # load into the store's records, and (snapshots only, JSON has to parse
+    # everything for either) counting rows and decoding a 50-row page.
+    # Returns (timings, file sizes in bytes).
+    paths = _paths(os.path.join(workdir, "formats"))
+    os.makedirs(os.path.dirname(paths["patients"]))
+    backends = {"json": JsonBackend(paths), "snapshot": SnapshotBackend(paths)}
+    results, sizes = {}, {}
+    for key in ("patients", "appointments", "billing"):
+        records = list(store.load(key).values())
+        for name, backend in backends.items():
+            backend.write(key, records)
+            sizes[f"{key}.{name}"] = os.path.getsize(paths[key] if name == "json" else snapshot_path(paths[key]))
+            results[f"read[{key}].{name}"] = _time(backend.read, repeat, lambda i, key=key: (key,))
+            results[f"load[{key}].{name}"] = _time(lambda key=key, backend=backend: RecordStore(backend).load(key),
+                                                   repeat)
+        path = snapshot_path(paths[key])
+        middle = len(records) // 2
+        results[f"count[{key}].snapshot"] = _time(backends["snapshot"].count, repeat, lambda i, key=key: (key,))
+        results[f"page[{key}].snapshot"] = _time(lambda path=path: _read_page(path, middle, middle + 50), repeat)
+    return results, sizes
+
+def _read_page(path, start, stop):
+    with SnapshotFile(path) as snapshot:
+        return snapshot.records(start, stop)
+
+def record_memory(workdir, storage):
+    # Bytes per cached record of each collection, held as its TypedRecord class
+    # and as plain dicts (traced allocations still live after a cold load)
+    sizes = {}
+    for compact in (True, False):
+        for key in DATA_PATHS:
+            store = RecordStore(make_backend(storage, _paths(workdir), os.path.join(workdir, SQLITE_PATH)),
+                                compact=compact)
+            tracemalloc.start()
+            try:
+                records = store.load(key)
+                held = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            entry = sizes.setdefault(key, {"records": len(records)})
+            entry["compact" if compact else "dict"] = round(held / len(records)) if records else None
+    return sizes
+
+def _version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Runs both suites on a scratch copy of the data (freshly generated, or copied
+# from `source`) and returns the JSON-serializable report
+def run(rows=1000, storage="json", repeat=5, seed=0, source=None, ui=True, write_behind=None):
+    workdir = tempfile.mkdtemp(prefix="hms-bench-")
+    try:
+        if source:
+            for name in list(DATA_PATHS.values()) + [SQLITE_PATH]:
+                for path in (name, name + ".journal", snapshot_path(name)):
+                    if os.path.exists(os.path.join(source, path)):
+                        shutil.copy(os.path.join(source, path), workdir)
+        else:
+            started = time.perf_counter()
+            generate(workdir, rows, storage, seed)
+            generated = time.perf_counter() - started
+        store = RecordStore(make_backend(storage, _paths(workdir), os.path.join(workdir, SQLITE_PATH)), write_behind)
+        # load_data/save_data go through the module-level store
+        real_store, hospital_service.store = hospital_service.store, store
+        try:
+            service = HospitalService(store)
+            data = SyntheticData(rows, seed)
+            files = {name: os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)}
+            results = service_benchmarks(service, data, repeat)
+            store.flush()
+            memory = record_memory(workdir, storage)
+            formats, format_bytes = format_benchmarks(store, workdir, repeat)
+            results.update(formats)
+            ui_results, ui_skipped = ui_benchmarks(service, data, repeat) if ui else (None, "disabled")
+            store.flush()
+        finally:
+            hospital_service.store = real_store
+        return {
+            "version": _version(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rows": None if source else rows,
+            "storage": storage,
+            "write_behind_ms": write_behind,
+            "repeat": repeat,
+            "generate_seconds": None if source else round(generated, 3),
+            "collections": {key: len(store.load(key)) for key in DATA_PATHS},
+            "file_bytes": files,
+            "peak_rss_mb": _peak_rss_mb(),
+            "record_bytes": memory,
+            "format_bytes": format_bytes,
+            "results": results,
+            "ui_results": ui_results,
+            "ui_skipped": ui_skipped,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+STRESS_MEDICINE = "Stress Med"
+
+def _stress_worker(workdir, storage, worker, appends, write_behind=None):
+    # One workstation: books `appends` appointments for its own doctor, every
+    # third one through a full load-modify-save, and bills one unit of the
+    # shared medicine every fifth. Returns (appointment ids, bills).
+    store = RecordStore(make_backend(storage, _paths(workdir), os.path.join(workdir, SQLITE_PATH)), write_behind)
+    service = HospitalService(store)
+    opens, closes = (hospital_service._minutes(t) for t in CLINIC_HOURS)
+    per_day = (closes - opens) // SLOT_MINUTES
+    ids, bills = [], 0
+    for i in range(appends):
+        record = {"patient name": f"Stress {worker}-{i}", "doctor": f"Dr Stress {worker}",
+                  "date": (datetime.date(2030, 1, 1) + datetime.timedelta(days=i // per_day)).isoformat(),
+                  "time": hospital_service._hhmm(opens + i % per_day * SLOT_MINUTES), "duration": SLOT_MINUTES}
+        if i % 3 == 0:
+            records = store.checkout("appointments")
+            records.append(record)
+            store.save("appointments", records)
+            ids.append(record["id"])
+        else:
+            ids.append(service.book_appointment(record)[0]["id"])
+        if i % 5 == 0:
+            service.create_invoice(record["patient name"], [("medicines", STRESS_MEDICINE, 1)])
+            bills += 1
+    store.flush()
+    return ids, bills
+
+# Several processes writing the same collections at once; checks that every
+# appointment and every stock decrement survived
+def stress(processes=8, appends=50, storage="json", write_behind=None):
+    workdir = tempfile.mkdtemp(prefix="hms-stress-")
+    try:
+        make = lambda: RecordStore(make_backend(storage, _paths(workdir), os.path.join(workdir, SQLITE_PATH)))
+        stock = processes * appends
+        make().save("medicines", [{"name": STRESS_MEDICINE, "quantity": str(stock), "price": "1"}],
+                    overwrite=True)
+        started = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(_stress_worker, [(workdir, storage, n, appends, write_behind)
+                                                    for n in range(processes)])
+        elapsed = time.perf_counter() - started
+
+        store = make()
+        found = store.load("appointments")
+        booked = [rid for ids, _ in results for rid in ids]
+        billed = sum(bills for _, bills in results)
+        quantity = int(next(iter(store.load("medicines").values()))["quantity"])
+        lost = [rid for rid in booked if rid not in found]
+        return {"processes": processes, "appends": appends, "storage": storage, "write_behind_ms": write_behind,
+                "seconds": round(elapsed, 3),
+                "appointments_written": len(booked), "appointments_found": len(found),
+                "appointments_lost": len(lost), "bills_written": billed,
+                "bills_found": len(store.load("billing")), "stock_expected": stock - billed,
+                "stock_found": quantity,
+                "ok": not lost and len(found) == len(booked) and len(store.load("billing")) == billed
+                      and quantity == stock - billed}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(old, new, metric="p50_ms"):
+    # (operation, old, new, new / old) for the operations both reports timed
+    rows = []
+    for section in ("results", "ui_results"):
+        before, after = old.get(section) or {}, new.get(section) or {}
+        for op in before:
+            if op in after:
+                a, b = before[op][metric], after[op][metric]
+                rows.append((op, a, b, round(b / a, 3) if a else None))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hospital Management System benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen_cmd = commands.add_parser("generate", help="write synthetic data files")
+    gen_cmd.add_argument("--rows", type=int, default=1000, help="patients (appointments and bills match)")
+    gen_cmd.add_argument("--out", default=".", help="directory for the data files")
+    gen_cmd.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default=STORAGE_MODE)
+    gen_cmd.add_argument("--seed", type=int, default=0)
+    gen_cmd.add_argument("--force", action="store_true", help="overwrite existing data files")
+    run_cmd = commands.add_parser("run", help="time the data layer and pages, print a JSON report")
+    run_cmd.add_argument("--rows", type=int, default=1000)
+    run_cmd.add_argument("--data", metavar="DIR", help="benchmark a copy of existing data instead of generating")
+    run_cmd.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default="json")
+    run_cmd.add_argument("--repeat", type=int, default=5, help="runs per operation")
+    run_cmd.add_argument("--seed", type=int, default=0)
+    run_cmd.add_argument("--write-behind", type=int, metavar="MS", help="time with write-behind on")
+    run_cmd.add_argument("--no-ui", action="store_true", help="skip the Tk page timings")
+    run_cmd.add_argument("--output", metavar="FILE", help="also write the report to FILE")
+    stress_cmd = commands.add_parser("stress", help="write from many processes at once, check nothing is lost")
+    stress_cmd.add_argument("--processes", type=int, default=8)
+    stress_cmd.add_argument("--appends", type=int, default=50, help="appointments per process")
+    stress_cmd.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default="json")
+    stress_cmd.add_argument("--write-behind", type=int, metavar="MS", help="run the writers with write-behind on")
+    cmp_cmd = commands.add_parser("compare", help="compare two reports operation by operation")
+    cmp_cmd.add_argument("old")
+    cmp_cmd.add_argument("new")
+    cmp_cmd.add_argument("--metric", default="p50_ms", choices=["mean_ms", "min_ms", "p50_ms", "p95_ms", "max_ms"])
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        try:
+            sizes = generate(args.out, args.rows, args.storage, args.seed, args.force)
+        except FileExistsError as e:
+            raise SystemExit(f"error: {e}")
+        print(json.dumps(sizes, indent=2))
+    elif args.command == "run":
+        report = run(args.rows, args.storage, args.repeat, args.seed, args.data, not args.no_ui, args.write_behind)
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text + "\n")
+        print(text)
+    elif args.command == "stress":
+        report = stress(args.processes, args.appends, args.storage, args.write_behind)
+        print(json.dumps(report, indent=2))
+        raise SystemExit(0 if report["ok"] else 1)
+    else:
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        print(f"{'operation':<48}{'old':>12}{'new':>12}{'ratio':>8}")
+        for op, a, b, ratio in compare(old, new, args.metric):
+            print(f"{op:<48}{a:>12.3f}{b:>12.3f}{ratio if ratio is not None else '-':>8}")
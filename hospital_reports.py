@@ -0,0 +1,428 @@
+import csv
+import json
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import calendar
+import datetime
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import hospital_service
+from hospital_service import (DATA_PATHS, STORAGE_MODE, SQLITE_PATH, SLOT_MINUTES, FileLock, SqliteBackend,
+                              SnapshotBackend, SnapshotFile, snapshot_path, make_backend, metrics)
+
+# Per-day partial results are kept here between runs, tagged with the
+# signature of the collection they were computed from and a digest of each
+# day's records, so a run after an edit only aggregates the days whose digest moved
+REPORT_CACHE_PATH = os.environ.get("HMS_REPORT_CACHE", "reports.cache.json")
+REPORT_CHUNK_ROWS = 20000
+
+# Report name -> (title, source collection, columns)
+REPORTS = {
+    "revenue_by_medicine": ("Revenue by Medicine", "billing", ("medicine", "quantity", "revenue")),
+    "revenue_by_patient": ("Revenue by Patient", "billing", ("patient", "invoices", "revenue")),
+    "doctor_load": ("Appointments per Doctor per Day", "appointments", ("date", "doctor", "appointments", "minutes")),
+    "lab_tests": ("Lab Test Volumes", "billing", ("test", "tests", "revenue")),
+}
+
+# Partial results of a chunk of records, by date. A partial is nested dicts
+# ending in [count, amount] lists; an invoice count is a set of invoice ids
+# until the chunks are merged, since one invoice's lines may straddle two.
+def _billing_partials(records):
+    days = {}
+    number = hospital_service._to_number
+    for rec in records:
+        get = rec.get
+        date = get("date") or ""
+        day = days.get(date)
+        if day is None:
+            day = days[date] = {"medicines": {}, "lab_tests": {}, "patients": {}}
+        total = number(get("total"))
+        # Lines billed before lab tests existed are all medicines
+        items = day["lab_tests"] if get("type") in ("lab_tests", "Lab Test") else day["medicines"]
+        item = items.get(get("item") or get("medicine") or "")
+        if item is None:
+            item = items[get("item") or get("medicine") or ""] = [0, 0.0]
+        item[0] += number(get("quantity"))
+        item[1] += total
+        patient = day["patients"].get(get("patient") or "")
+        if patient is None:
+            patient = day["patients"][get("patient") or ""] = [set(), 0.0]
+        patient[0].add(get("invoice") or get("id") or object())
+        patient[1] += total
+    return days
+
+def _appointment_partials(records):
+    days = {}
+    for appt in records:
+        doctor = days.setdefault(appt.get("date") or "", {}).setdefault(appt.get("doctor") or "", [0, 0])
+        doctor[0] += 1
+        doctor[1] += int(hospital_service._to_number(appt.get("duration"), SLOT_MINUTES) or SLOT_MINUTES)
+    return days
+
+PARTIALS = {"billing": _billing_partials, "appointments": _appointment_partials}
+
+# The fields the partials read; a day's digest is [records, sum of their
+# hashes], so it doesn't depend on record order or on which chunk read them
+DIGEST_FIELDS = {
+    "billing": ("date", "type", "item", "medicine", "patient", "invoice", "id", "quantity", "total"),
+    "appointments": ("date", "doctor", "duration"),
+}
+DIGEST_NUMBERS = ("quantity", "total", "duration")
+DIGEST_MASK = (1 << 64) - 1
+
+def _record_hash(rec, fields):
+    # The same for a stored TypedRecord and the plain dict read from disk
+    number = hospital_service._to_number
+    text = "\x1f".join(repr(number(rec.get(field))) if field in DIGEST_NUMBERS else str(rec.get(field) or "")
+                       for field in fields)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+def _digests_and_partials(key, records, days=None):
+    # ({date: digest} of every record, partials of those dated in `days` (None: all))
+    digests, chosen = {}, []
+    fields = DIGEST_FIELDS[key]
+    for rec in records:
+        date = rec.get("date") or ""
+        digest = digests.get(date)
+        if digest is None:
+            digest = digests[date] = [0, 0]
+        digest[0] += 1
+        digest[1] = (digest[1] + _record_hash(rec, fields)) & DIGEST_MASK
+        if days is None or date in days:
+            chosen.append(rec)
+    return digests, PARTIALS[key](chosen)
+
+def _merge_digests(into, part):
+    for date, (count, total) in part.items():
+        digest = into.setdefault(date, [0, 0])
+        digest[0] += count
+        digest[1] = (digest[1] + total) & DIGEST_MASK
+    return into
+
+def _merge(into, part):
+    for name, value in part.items():
+        mine = into.get(name)
+        if mine is None:
+            into[name] = value
+        elif isinstance(mine, dict):
+            _merge(mine, value)
+        else:
+            for i, v in enumerate(value):
+                if isinstance(v, set):
+                    mine[i] |= v
+                else:
+                    mine[i] += v
+    return into
+
+def _finish(part):
+    # Invoice id sets become counts, leaving plain JSON for the cache
+    if isinstance(part, dict):
+        return {name: _finish(value) for name, value in part.items()}
+    return [len(v) if isinstance(v, set) else v for v in part]
+
+def _changed_days(digests, known):
+    return {day for day in digests.keys() | known.keys() if digests.get(day) != known.get(day)}
+
+# Runs in a pool process: one chunk, read by the worker itself where the
+# storage allows (a row range of a snapshot, a rowid range of a SQLite table).
+# Returns the chunk's day digests and the partials of its records dated in `days`
+def _chunk_partials(days, key, source, *args):
+    if source == "snapshot":
+        path, start, stop = args
+        with SnapshotFile(path) as snapshot:
+            records = snapshot.records(start, stop)
+    elif source == "sqlite":
+        db_path, low, high = args
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(f"SELECT data FROM {key} WHERE rowid >= ? AND rowid < ?", (low, high)).fetchall()
+        finally:
+            conn.close()
+        records = [json.loads(data) for (data,) in rows]
+    else:
+        (records,) = args
+    return _digests_and_partials(key, records, days)
+
+def _chunks(backend, key, chunk_rows):
+    # Argument tuples for _chunk_partials covering the whole collection
+    if isinstance(backend, SnapshotBackend) and os.path.exists(snapshot_path(backend.paths[key])):
+        path = snapshot_path(backend.paths[key])
+        rows = backend.count(key)
+        return [(key, "snapshot", path, start, start + chunk_rows) for start in range(0, rows, chunk_rows)]
+    if isinstance(backend, SqliteBackend):
+        low, high = backend.conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {key}").fetchone()
+        if low is None:
+            return []
+        return [(key, "sqlite", backend.db_path, start, start + chunk_rows)
+                for start in range(low, high + 1, chunk_rows)]
+    # A JSON array (and its journal) can't be split without parsing it, so it
+    # is read once here and only the aggregation is spread out
+    records = backend.read(key)
+    return [(key, "records", records[i:i + chunk_rows]) for i in range(0, len(records), chunk_rows)]
+
+def _period(days, start, end):
+    # Undated records only count when the period is open-ended both ways
+    if start is None and end is None:
+        return days.items()
+    return ((day, part) for day, part in days.items()
+            if day and (start is None or day >= start) and (end is None or day <= end))
+
+def _revenue_rows(days, start, end, group):
+    totals = {}
+    for _, part in _period(days, start, end):
+        _merge(totals, {name: list(value) for name, value in part[group].items()})
+    return sorted(([name, _amount(count), round(revenue, 2)] for name, (count, revenue) in totals.items()),
+                  key=lambda row: (-row[2], row[0]))
+
+def _amount(value):
+    return int(value) if float(value).is_integer() else value
+
+def _doctor_rows(days, start, end):
+    return [[day, doctor, count, minutes] for day, doctors in sorted(_period(days, start, end))
+            for doctor, (count, minutes) in sorted(doctors.items())]
+
+ROWS = {
+    "revenue_by_medicine": lambda days, start, end: _revenue_rows(days, start, end, "medicines"),
+    "revenue_by_patient": lambda days, start, end: _revenue_rows(days, start, end, "patients"),
+    "doctor_load": _doctor_rows,
+    "lab_tests": lambda days, start, end: _revenue_rows(days, start, end, "lab_tests"),
+}
+
+# Computes the REPORTS from per-day partial results of their collections,
+# cached in cache_path under the collection's storage signature.
+# Standalone (the CLI), a collection whose signature changed is streamed from
+# disk in chunks of chunk_rows across `workers` processes (None: one per CPU,
+# 0: in this process), holding its lock so every chunk sees the same version.
+# A first pass only digests each day's records; the chunks holding a day whose
+# digest differs from the cached one are then aggregated for those days alone.
+# Following a RecordStore (the Reports page), partials come from the store's
+# records instead, and its change events mark the days that need recomputing,
+# so after an edit only those days are aggregated again.
+class ReportEngine:
+    def __init__(self, backend, store=None, cache_path=REPORT_CACHE_PATH, workers=None,
+                 chunk_rows=REPORT_CHUNK_ROWS):
+        self.backend = backend
+        self.store = store
+        self.cache_path = cache_path  # None: nothing read or written
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self._cache = None    # collection key -> {"signature": ..., "days": {date: partial}, "digests": {date: digest}}
+        self._dirty = {}      # collection key -> dates changed since its cached signature, None if unknown
+        self.recomputed = {}  # collection key -> days aggregated by the last run ("all" for a full pass)
+        if store is not None:
+            for key in PARTIALS:
+                store.subscribe(key, lambda event, records, key=key: self._on_change(key, event, records))
+
+    def _on_change(self, key, event, records):
+        # Store listener, so called under store.lock
+        dirty = self._dirty.get(key)
+        if dirty is None:
+            return
+        if event == "reload":
+            self._dirty[key] = None
+        elif event == "update":
+            dirty.update(rec.get("date") or "" for pair in records for rec in pair)
+        else:
+            dirty.update(rec.get("date") or "" for rec in records)
+
+    def _signature(self, key):
+        # Plain JSON, and never equal across storage modes
+        return json.loads(json.dumps([type(self.backend).__name__, self.backend.signature(key)]))
+
+    def _load_cache(self):
+        if self._cache is None and not self.cache_path:
+            self._cache = {}
+        elif self._cache is None:
+            try:
+                with open(self.cache_path) as f:
+                    self._cache = json.load(f)
+            except (OSError, ValueError):
+                self._cache = {}
+        return self._cache
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        with open(self.cache_path + ".tmp", "w") as f:
+            f.write(json.dumps(self._cache, separators=(",", ":")))  # dump() would use the pure-Python encoder
+        os.replace(self.cache_path + ".tmp", self.cache_path)
+
+    def days(self, key):
+        # {date: partial} for the whole collection
+        with metrics.span("report", key):
+            cached = self._load_cache().get(key)
+            if self.store is not None:
+                entry = self._days_from_store(key, cached)
+            else:
+                entry = self._days_from_disk(key, cached)
+            if entry is not cached:
+                self._cache[key] = entry
+                self._save_cache()
+            return entry["days"]
+
+    def _days_from_store(self, key, cached):
+        store = self.store
+        with store.lock:
+            stats = store.stats()
+            if (key not in stats["cached"] and key not in stats["pending"] and cached is not None
+                    and cached["signature"] == self._signature(key)):
+                # Unchanged and not loaded here yet, so not worth loading. Its
+                # first load won't announce writes made elsewhere before it, so
+                # the days it changes next are unknown
+                self._dirty[key] = None
+                self.recomputed[key] = 0
+                return cached
+            store.flush(key)  # So the cache's signature covers everything in it
+            records = store.load(key)  # Reloads (and so invalidates) anything written elsewhere first
+            signature = self._signature(key)
+            dirty, self._dirty[key] = self._dirty.get(key), set()
+            if cached is not None and cached["signature"] == signature:
+                self.recomputed[key] = 0
+                return cached
+            if cached is not None and dirty is not None and "digests" in cached:
+                # Only this process wrote since the cache was made
+                days, digests = dict(cached["days"]), dict(cached["digests"])
+                for day in dirty:
+                    days.pop(day, None)
+                    digests.pop(day, None)
+                fresh_digests, fresh = _digests_and_partials(
+                    key, (rec for rec in records.values() if (rec.get("date") or "") in dirty))
+                days.update(_finish(fresh))
+                digests.update(fresh_digests)
+                self.recomputed[key] = len(dirty)
+            elif cached is not None and "digests" in cached:
+                # Written elsewhere too: the digests tell which days moved
+                digests, _ = _digests_and_partials(key, records.values(), set())
+                changed = _changed_days(digests, cached["digests"])
+                fresh = PARTIALS[key](rec for rec in records.values() if (rec.get("date") or "") in changed)
+                days = {day: part for day, part in cached["days"].items() if day not in changed}
+                days.update(_finish(fresh))
+                self.recomputed[key] = len(changed)
+            else:
+                digests, days = _digests_and_partials(key, records.values())
+                days = _finish(days)
+                self.recomputed[key] = "all"
+        return {"signature": signature, "days": days, "digests": digests}
+
+    def _days_from_disk(self, key, cached):
+        # A lock of our own rather than backend.locks[key], so a store sharing
+        # the backend keeps its own
+        lock = FileLock(self.backend.locks[key].path)
+        lock.acquire()
+        try:
+            signature = self._signature(key)
+            if cached is not None and cached["signature"] == signature:
+                self.recomputed[key] = 0
+                return cached
+            chunks = _chunks(self.backend, key, self.chunk_rows)
+            known = cached.get("digests") if cached is not None else None
+            if known is None:
+                results = self._aggregate(chunks, None)
+                digests, days = {}, {}
+                for chunk_digests, part in results:
+                    _merge_digests(digests, chunk_digests)
+                    _merge(days, part)
+                days = _finish(days)
+                self.recomputed[key] = "all"
+            else:
+                # Records the JSON path already read here are cheaper to digest than to ship to a pool
+                inline = bool(chunks) and chunks[0][1] == "records"
+                found = [chunk_digests for chunk_digests, _ in self._aggregate(chunks, set(), inline)]
+                digests = {}
+                for chunk_digests in found:
+                    _merge_digests(digests, chunk_digests)
+                changed = _changed_days(digests, known)
+                fresh = {}
+                wanted = [chunk for chunk, chunk_digests in zip(chunks, found) if changed & chunk_digests.keys()]
+                for _, part in self._aggregate(wanted, changed, inline):
+                    _merge(fresh, part)
+                days = {day: part for day, part in cached["days"].items() if day not in changed}
+                days.update(_finish(fresh))
+                self.recomputed[key] = len(changed)
+        finally:
+            lock.release()
+        return {"signature": signature, "days": days, "digests": digests}
+
+    def _aggregate(self, chunks, days, inline=False):
+        # _chunk_partials over `chunks`, in pool processes unless there's one chunk
+        if inline or self.workers == 0 or len(chunks) <= 1:
+            return [_chunk_partials(days, *chunk) for chunk in chunks]
+        with ProcessPoolExecutor(self.workers) as pool:
+            return list(pool.map(_chunk_partials, *zip(*((days,) + chunk for chunk in chunks))))
+
+    def report(self, name, start=None, end=None):
+        # start/end: ISO dates, inclusive; None leaves that end open
+        title, key, columns = REPORTS[name]
+        return {"report": name, "title": title, "from": start, "to": end, "columns": list(columns),
+                "rows": ROWS[name](self.days(key), start, end)}
+
+def month_period(month):
+    # "2026-09" -> ("2026-09-01", "2026-09-30")
+    first = datetime.datetime.strptime(month, "%Y-%m").date()
+    last = first.replace(day=calendar.monthrange(first.year, first.month)[1])
+    return first.isoformat(), last.isoformat()
+
+def write_report(report, f, fmt):
+    if fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(report["columns"])
+        writer.writerows(report["rows"])
+    else:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+def save_report(report, path):
+    # Format from the extension: .csv, else JSON
+    with open(path, "w", newline="") as f:
+        write_report(report, f, "csv" if path.lower().endswith(".csv") else "json")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hospital Management System end-of-period reports")
+    parser.add_argument("reports", nargs="*", metavar="REPORT",
+                        help=f"reports to run (default: all of {', '.join(REPORTS)})")
+    parser.add_argument("--month", help="period as YYYY-MM")
+    parser.add_argument("--from", dest="start", metavar="DATE", help="first day of the period (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", metavar="DATE", help="last day of the period (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--out", metavar="DIR", help="write each report to DIR/<report>.<format> instead of stdout")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default=STORAGE_MODE)
+    parser.add_argument("--db", default=SQLITE_PATH, help="SQLite database file for --storage sqlite")
+    parser.add_argument("--workers", type=int, help="processes aggregating chunks (default: one per CPU, 0: none)")
+    parser.add_argument("--chunk-rows", type=int, default=REPORT_CHUNK_ROWS, help="records per chunk")
+    parser.add_argument("--cache", default=REPORT_CACHE_PATH, help="per-day partial results file")
+    parser.add_argument("--no-cache", action="store_true", help="recompute everything and leave the cache alone")
+    args = parser.parse_args()
+
+    for name in args.reports:
+        if name not in REPORTS:
+            parser.error(f"unknown report {name!r} (choose from {', '.join(REPORTS)})")
+    start, end = args.start, args.end
+    try:
+        if args.month:
+            start, end = month_period(args.month)
+        for date in (start, end):
+            if date is not None:
+                datetime.date.fromisoformat(date)
+    except ValueError:
+        parser.error("dates must be YYYY-MM-DD and --month YYYY-MM")
+
+    engine = ReportEngine(make_backend(args.storage, DATA_PATHS, args.db), workers=args.workers,
+                          cache_path=None if args.no_cache else args.cache, chunk_rows=args.chunk_rows)
+    started = time.perf_counter()
+    recomputed = {}
+    for n, name in enumerate(args.reports or REPORTS):
+        report = engine.report(name, start, end)
+        for key, days in engine.recomputed.items():
+            recomputed.setdefault(key, days)
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+            save_report(report, os.path.join(args.out, f"{name}.{args.format}"))
+        else:
+            if n and args.format == "csv":
+                sys.stdout.write("\n")
+            write_report(report, sys.stdout, args.format)
+    print(json.dumps({"elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                      "recomputed_days": recomputed}), file=sys.stderr)
@@ -0,0 +1,448 @@
+import json
+import os
+import sys
+import socket
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import argparse
+import itertools
+import collections
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from hospital_service import (DATA_PATHS, STORAGE_MODE, SQLITE_PATH, SLOT_MINUTES, RecordStore, HospitalService,
+                              IMPORT_CHUNK_ROWS, ValidationError, BookingError, BillingError, make_backend,
+                              json_default, metrics)
+
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 32
+IDLE_TIMEOUT_S = 10    # Server side: idle keep-alive connections give their worker back
+REUSE_IDLE_S = 5       # Client side: writes open a fresh connection after this long idle
+
+# Service exceptions travel as {"error": message, "kind": class name} with a
+# 400 (404 for LookupError) status and are raised again on the client side
+ERROR_KINDS = {cls.__name__: cls for cls in (ValidationError, BookingError, BillingError, ValueError, LookupError)}
+
+class ServiceError(RuntimeError):
+    pass
+
+# Request bodies come from any client, so a body of the wrong shape is a 400
+# naming what is wrong rather than a TypeError inside the service
+def _object_body(body):
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    return body
+
+def _import_rows(body):
+    rows = _object_body(body).get("rows", [])
+    if not isinstance(rows, list):
+        raise ValueError("rows must be a list of [line, row] pairs")
+    for pair in rows:
+        if not (isinstance(pair, list) and len(pair) == 2 and isinstance(pair[0], int)
+                and isinstance(pair[1], dict)):
+            raise ValueError(f"Import row {json.dumps(pair)[:80]} is not a [line, {{field: value}}] pair")
+    return rows
+
+def _invoice_items(body):
+    items = _object_body(body).get("items", [])
+    if not isinstance(items, list) or not all(isinstance(item, list) and len(item) == 3
+                                              and isinstance(item[0], str) and isinstance(item[1], str)
+                                              for item in items):
+        raise ValueError("items must be a list of [collection, name, quantity] lines")
+    return items
+
+# JSON API over one HospitalService:
+#   GET    /api/<collection>[?q=query]   records, optionally filtered by search
+#   GET    /api/<collection>/version     storage signature, changes on every write
+#   GET    /api/<collection>/<id>        one record
+#   POST   /api/<collection>             add a record (appointments are booked)
+#   DELETE /api/<collection>/<id>        delete a record
+#   POST   /api/<collection>/import      {"rows": [[line, row], ...]}, one chunk of a bulk import
+#   GET    /api/slots?doctor=&date=&duration=&count=
+#   POST   /api/invoices                 {"patient": ..., "items": [[collection, name, quantity], ...]}
+#   GET    /api/prices/<collection>, /api/dashboard, /api/reorder?k=
+#   GET    /api/metrics                  server-side operation timings (HMS_METRICS=1)
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so a client reuses one connection
+    timeout = IDLE_TIMEOUT_S
+    # Headers and body leave in one segment with Nagle off; otherwise each
+    # response waits out the client's delayed ACK (~40 ms on Linux)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(p) for p in url.path.strip("/").split("/")]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length)) if length else None
+            if parts[0] != "api" or len(parts) < 2:
+                raise LookupError(self.path)
+            status, result = self.route(method, parts[1:], query, body)
+        except LookupError:
+            status, result = 404, {"error": f"Not found: {method} {url.path}", "kind": "LookupError"}
+        except ValueError as e:
+            status, result = 400, {"error": str(e), "kind": type(e).__name__}
+        except Exception as e:
+            self.log_error("%s %s failed: %r", method, url.path, e)
+            status, result = 500, {"error": f"Internal error: {e}", "kind": "ServiceError"}
+        self._send(status, result)
+
+    def route(self, method, parts, query, body):
+        service = self.server.service
+        name = parts[0]
+        if method == "GET" and name == "dashboard":
+            return 200, service.dashboard()
+        if method == "GET" and name == "metrics":
+            return 200, metrics.snapshot()
+        if method == "GET" and name == "reorder":
+            return 200, service.reorder(query.get("k", 5))
+        if method == "GET" and name == "slots":
+            return 200, service.free_slots(query.get("doctor", ""), query.get("date"),
+                                           query.get("duration", SLOT_MINUTES), query.get("count", 8))
+        if method == "GET" and name == "prices" and len(parts) == 2 and parts[1] in DATA_PATHS:
+            return 200, service.prices(parts[1])
+        if method == "GET" and name == "history" and len(parts) == 2:
+            return 200, service.patient_history(parts[1])
+        if method == "GET" and name == "doctor-appointments" and len(parts) == 2:
+            return 200, service.doctor_appointments(parts[1])
+        if method == "POST" and name == "invoices":
+            return 201, service.create_invoice(_object_body(body).get("patient", ""), _invoice_items(body))
+        if name not in DATA_PATHS:
+            raise LookupError(name)
+        if len(parts) == 1 and method == "GET":
+            if query.get("q"):
+                return 200, [service.get(name, rid) for rid in service.search(name, query["q"])]
+            return 200, service.records(name)
+        if len(parts) == 1 and method == "POST":
+            if name == "appointments":
+                return 201, service.book_appointment(_object_body(body))[0]
+            return 201, service.add_record(name, _object_body(body))
+        if len(parts) == 2 and method == "POST" and parts[1] == "import":
+            rejected = []
+            imported, _ = service.import_rows(name, _import_rows(body),
+                                              lambda line, row, error: rejected.append((line, row, error)))
+            return 200, {"imported": imported, "rejected": rejected}
+        if len(parts) == 2 and method == "GET" and parts[1] == "version":
+            return 200, {"version": service.store.backend.signature(name)}
+        if len(parts) == 2 and method == "GET":
+            record = service.get(name, parts[1])
+            if record is None:
+                raise LookupError(parts[1])
+            return 200, record
+        if len(parts) == 2 and method == "DELETE":
+            return 200, service.delete_records(name, [parts[1]])
+        raise LookupError(parts)
+
+    def _send(self, status, result):
+        data = json.dumps(result, default=json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+# HTTPServer that hands each accepted connection to a fixed thread pool, so
+# the number of request threads stays bounded however many desks connect
+class PooledHTTPServer(HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, workers=DEFAULT_WORKERS, verbose=False):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+        self.verbose = verbose
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+# One keep-alive connection shared by the calling threads, so a desktop
+# client holds a single server worker; JSON in, JSON out. A GET that fails on a
+# connection the server has dropped is sent again; a write never is, since it
+# may have been applied, so writes don't reuse a connection left idle long
+# enough for the server to be closing it
+class ServiceClient:
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self._conn = None
+        self._used = 0.0  # time.monotonic() of the last response
+        self._lock = threading.Lock()
+
+    def request(self, method, path, body=None, **query):
+        if query:
+            path += "?" + urllib.parse.urlencode(query)
+        data = None if body is None else json.dumps(body).encode()
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        retries = 1 if method == "GET" else 0
+        with self._lock:
+            if self._conn is not None and not retries and time.monotonic() - self._used > REUSE_IDLE_S:
+                self._conn.close()
+                self._conn = None
+            for attempt in range(retries + 1):
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                try:
+                    self._conn.request(method, path, data, headers)
+                    response = self._conn.getresponse()
+                    result = json.loads(response.read())
+                    self._used = time.monotonic()
+                    break
+                except (ConnectionError, http.client.HTTPException) as e:
+                    self._conn.close()
+                    self._conn = None
+                    if attempt == retries:
+                        raise ServiceError(f"{method} {path}: {e}") from e
+        if response.status >= 400:
+            raise ERROR_KINDS.get(result.get("kind"), ServiceError)(result.get("error"))
+        return result
+
+# The server applies every write under its own locks; nothing to lock here
+class _NoLock:
+    def acquire(self):
+        pass
+
+    release = bump = acquire
+
+# Read-only backend over the HTTP API, so a thin client's RecordStore caches
+# server data and refetches a collection only when its version changes
+class RemoteBackend:
+    def __init__(self, client):
+        self.client = client
+        self.locks = collections.defaultdict(_NoLock)
+
+    def signature(self, key):
+        return self.client.request("GET", f"/api/{key}/version")["version"]
+
+    def read(self, key):
+        return self.client.request("GET", f"/api/{key}")
+
+    def write(self, key, records):
+        raise ServiceError("Remote collections are changed through the service API")
+
+    append = remove = update = write
+
+# HospitalService stand-in for a desktop client of hospital_server.py. Reads
+# and search run on a local RecordStore filled from the server; every write
+# and business rule runs on the server, after which the written collection
+# is reloaded so the pages see the change.
+class RemoteService(HospitalService):
+    def __init__(self, url):
+        self.client = ServiceClient(url)
+        self.store = RecordStore(RemoteBackend(self.client))
+        # Search and sort indexes are built here over the local copy
+        self._indexes = {}
+        self._sort_indexes = {}
+
+    def _written(self, key, result):
+        self.store.load(key)
+        return result
+
+    def prime(self):
+        pass
+
+    def add_record(self, key, record):
+        return self._written(key, self.client.request("POST", f"/api/{key}", record))
+
+    def delete_records(self, key, ids):
+        removed = [self.client.request("DELETE", f"/api/{key}/{urllib.parse.quote(rid)}")
+                   for rid in ids]
+        return self._written(key, [rec for batch in removed for rec in batch])
+
+    def book_appointment(self, record):
+        return self._written("appointments", [self.client.request("POST", "/api/appointments", record)])
+
+    def free_slots(self, doctor, date=None, duration=SLOT_MINUTES, count=8):
+        query = {"doctor": doctor, "duration": duration, "count": count}
+        if date:
+            query["date"] = date
+        return [tuple(slot) for slot in self.client.request("GET", "/api/slots", **query)]
+
+    def prices(self, key):
+        return self.client.request("GET", f"/api/prices/{key}")
+
+    def create_invoice(self, patient, items):
+        lines = self.client.request("POST", "/api/invoices", {"patient": patient, "items": items})
+        self.store.load("medicines")
+        return self._written("billing", lines)
+
+    def import_rows(self, key, rows, on_rejected=None, chunk_size=IMPORT_CHUNK_ROWS):
+        # Posts the rows a chunk at a time; the server validates and commits each
+        imported = rejected = 0
+        for chunk in _chunks(rows, chunk_size):
+            sendable = []
+            for line, row in chunk:
+                if isinstance(row, ValueError):
+                    rejected += 1
+                    if on_rejected is not None:
+                        on_rejected(line, None, str(row))
+                else:
+                    sendable.append((line, row))
+            result = self.client.request("POST", f"/api/{key}/import", {"rows": sendable})
+            imported += result["imported"]
+            rejected += len(result["rejected"])
+            if on_rejected is not None:
+                for line, row, error in result["rejected"]:
+                    on_rejected(line, row, error)
+        return self._written(key, (imported, rejected))
+
+    def patient_history(self, patient_id):
+        return self.client.request("GET", f"/api/history/{urllib.parse.quote(patient_id, safe='')}")
+
+    def doctor_appointments(self, doctor):
+        return self.client.request("GET", f"/api/doctor-appointments/{urllib.parse.quote(doctor, safe='')}")
+
+    def dashboard(self):
+        return self.client.request("GET", "/api/dashboard")
+
+    def reorder(self, k=5):
+        return [tuple(item) for item in self.client.request("GET", "/api/reorder", k=k)]
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, storage=STORAGE_MODE, db=SQLITE_PATH,
+          workers=DEFAULT_WORKERS, verbose=False):
+    service = HospitalService(RecordStore(make_backend(storage, DATA_PATHS, db)))
+    service.prime()
+    server = PooledHTTPServer((host, port), service, workers, verbose)
+    print(f"Serving on http://{host}:{server.server_port} ({storage}, {workers} workers)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# Requests/sec on localhost: starts a server in a subprocess over a scratch
+# copy of seeded data, then drives it from `clients` threads, each with its
+# own keep-alive connection, for a read-only and a mixed read/write workload
+def benchmark(clients=8, requests=2000, rows=1000, storage="json", workers=DEFAULT_WORKERS, port=0):
+    workdir = tempfile.mkdtemp(prefix="hms-bench-")
+    try:
+        seed = HospitalService(RecordStore(make_backend(storage, {k: os.path.join(workdir, p)
+                                                                  for k, p in DATA_PATHS.items()},
+                                                        os.path.join(workdir, SQLITE_PATH))))
+        seed.store.save("patients", [{"name": f"Patient {i}", "age": str(20 + i % 60), "disease": "Flu"}
+                                     for i in range(rows)], overwrite=True)
+        seed.store.save("doctors", [{"name": f"Dr {i}", "specialization": "General", "phone": "555"}
+                                    for i in range(max(1, rows // 100))], overwrite=True)
+        seed.store.save("medicines", [{"name": f"Med {i}", "quantity": "1000000", "price": "2.5"}
+                                      for i in range(max(1, rows // 10))], overwrite=True)
+        del seed
+
+        port = port or _free_port()
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--port", str(port),
+                                   "--storage", storage, "--db", os.path.join(workdir, SQLITE_PATH),
+                                   "--workers", str(workers)],
+                                  cwd=workdir, stdout=subprocess.PIPE, text=True)
+        try:
+            server.stdout.readline()  # "Serving on ..."
+            url = f"http://127.0.0.1:{port}"
+            ids = [rec["id"] for rec in ServiceClient(url).request("GET", "/api/patients")]
+            reads = (lambda c, i: c.request("GET", f"/api/patients/{ids[i % len(ids)]}"),
+                     lambda c, i: c.request("GET", "/api/dashboard"),
+                     lambda c, i: c.request("GET", "/api/patients", q=f"patient {i % rows}"))
+            writes = reads + (lambda c, i: c.request("POST", "/api/patients",
+                                                     {"name": f"Walk-in {i}", "age": "30", "disease": "Cold"}),
+                              lambda c, i: c.request("POST", "/api/invoices",
+                                                     {"patient": f"Patient {i}",
+                                                      "items": [["medicines", "Med 0", 1]]}))
+            report = {"clients": clients, "requests": requests, "rows": rows, "storage": storage,
+                      "workers": workers}
+            for name, mix in (("read", reads), ("mixed", writes)):
+                report[name] = _drive(url, clients, requests, mix)
+            return report
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _drive(url, clients, requests, mix):
+    per_client = max(1, requests // clients)
+    latencies = []
+    lock = threading.Lock()
+
+    def run(n):
+        client = ServiceClient(url)
+        timings = []
+        for i in range(per_client):
+            started = time.perf_counter()
+            mix[i % len(mix)](client, n * per_client + i)
+            timings.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(timings)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"requests": len(latencies), "seconds": round(elapsed, 3),
+            "req_per_sec": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2)}
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hospital Management System JSON API server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_cmd = commands.add_parser("serve", help="serve the data files in the working directory")
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_cmd.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default=STORAGE_MODE)
+    serve_cmd.add_argument("--db", default=SQLITE_PATH, help="SQLite database file for --storage sqlite")
+    serve_cmd.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="request threads")
+    serve_cmd.add_argument("--verbose", action="store_true", help="log every request")
+    bench_cmd = commands.add_parser("bench", help="measure requests/sec on localhost, print a JSON report")
+    bench_cmd.add_argument("--clients", type=int, default=8)
+    bench_cmd.add_argument("--requests", type=int, default=2000, help="requests per workload")
+    bench_cmd.add_argument("--rows", type=int, default=1000, help="seeded patients")
+    bench_cmd.add_argument("--storage", choices=["json", "journal", "sqlite", "snapshot"], default="json")
+    bench_cmd.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.storage, args.db, args.workers, args.verbose)
+    else:
+        print(json.dumps(benchmark(args.clients, args.requests, args.rows, args.storage, args.workers), indent=2))
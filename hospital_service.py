@@ -0,0 +1,2246 @@
+import csv
+import json
+import os
+import sys
+import sqlite3
+import shutil
+import struct
+import tempfile
+import mmap
+import uuid
+import re
+import bisect
+import itertools
+import heapq
+import threading
+import contextlib
+import collections
+import collections.abc
+import datetime
+import math
+import time
+import select
+import ctypes
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Dashboard thresholds
+TOTAL_BEDS = 50
+LOW_STOCK_THRESHOLD = 10
+
+# Appointment slots: default length, choices offered in the booking form and
+# the hours searched for free slots
+SLOT_MINUTES = 15
+SLOT_DURATIONS = (15, 30, 45, 60)
+CLINIC_HOURS = ("09:00", "17:00")
+
+# Data file paths
+DATA_PATHS = {
+    "patients": "patients.json",
+    "doctors": "doctors.json",
+    "staff": "staff.json",
+    "medicines": "medicines.json",
+    "lab_tests": "lab_tests.json",
+    "appointments": "appointments.json",
+    "machinery": "machinery.json",
+    "billing": "billing.json",
+}
+
+# Storage mode: "json" rewrites the whole file on every save, "journal" appends
+# inserts/deletes to a per-collection JSON-lines log next to the snapshot,
+# "sqlite" keeps every collection as a table in a single database file,
+# "snapshot" keeps each collection in a compact binary file (SNAPSHOT_SUFFIX)
+STORAGE_MODE = os.environ.get("HMS_STORAGE", "json")
+SNAPSHOT_SUFFIX = ".hms"
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+SQLITE_PATH = os.environ.get("HMS_SQLITE_PATH", "hospital.db")
+
+# Seconds a write waits for another process holding a collection's lock
+LOCK_TIMEOUT = 10
+
+# Write-behind: when set, changes are kept in memory and written this many ms
+# after the last one (and at most WRITE_BEHIND_MAX_MS after the first). A failed
+# flush is retried after twice the previous wait, up to WRITE_BEHIND_RETRY_MAX_MS
+WRITE_BEHIND_MS = int(os.environ.get("HMS_WRITE_BEHIND_MS", "0")) or None
+WRITE_BEHIND_MAX_MS = 2000
+WRITE_BEHIND_RETRY_MAX_MS = 60000
+
+# Live refresh: how the data files are watched for writes from other
+# workstations ("auto" uses inotify on Linux and polls elsewhere, "poll" suits
+# network shares, whose remote writes inotify doesn't see, "off" disables it),
+# and how long a burst of changes must be quiet before pages are refreshed
+WATCH_MODE = os.environ.get("HMS_WATCH", "auto")
+WATCH_POLL_MS = 1000
+WATCH_DEBOUNCE_MS = 250
+WATCH_MAX_DELAY_MS = 2000
+
+# Form fields of the plain managed collections, as labelled in the UI, and
+# the lower-cased ones that may be left blank
+RECORD_FIELDS = {
+    "patients": ("Name", "Age", "Disease", "Bed"),
+    "doctors": ("Name", "Specialization", "Phone"),
+    "staff": ("Name", "Role", "Phone"),
+    "medicines": ("Name", "Quantity", "Price", "Reorder Level"),
+    "lab_tests": ("Test Name", "Price"),
+    "machinery": ("Machine Name", "Quantity", "Supplier"),
+}
+OPTIONAL_FIELDS = {"patients": ("bed",), "medicines": ("reorder level",)}
+INTEGER_FIELDS = ("age", "quantity", "reorder level")
+DECIMAL_FIELDS = ("price",)
+
+# Fields of every collection's records besides "id": the form fields above,
+# and those written by booking and billing. Records are held as slotted
+# objects with these fields (see TypedRecord); NUMERIC_FIELDS are parsed once
+# as they are loaded or stored.
+RECORD_LAYOUTS = {key: tuple(label.lower() for label in labels) for key, labels in RECORD_FIELDS.items()}
+RECORD_LAYOUTS["appointments"] = ("patient name", "doctor", "date", "time", "duration")
+RECORD_LAYOUTS["billing"] = ("invoice", "patient", "type", "item", "medicine", "quantity", "price", "total", "date")
+NUMERIC_FIELDS = INTEGER_FIELDS + DECIMAL_FIELDS + ("duration", "total")
+
+# Indexed columns per SQLite table: column name -> record field
+SQLITE_INDEXES = {
+    "patients": {"name": "name"},
+    "doctors": {"name": "name"},
+    "staff": {"name": "name"},
+    "medicines": {"name": "name"},
+    "lab_tests": {"name": "test name"},
+    "appointments": {"patient": "patient name", "doctor": "doctor", "date": "date"},
+    "machinery": {"name": "machine name"},
+    "billing": {"patient": "patient", "medicine": "medicine", "date": "date"},
+}
+
+# Latency instrumentation, off unless HMS_METRICS is set or enabled from the
+# Diagnostics page
+METRICS_ENABLED = os.environ.get("HMS_METRICS", "") not in ("", "0")
+
+# Latency histogram with 8 log-scale buckets per doubling from 1 µs, so a
+# percentile is read off the bucket counts to within ~9%
+class LatencyHistogram:
+    STEPS = 8
+
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def add(self, seconds, bytes_read=0, bytes_written=0):
+        micros = seconds * 1e6
+        self.buckets[int(math.log2(micros) * self.STEPS) if micros > 1 else 0] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def percentile(self, q):
+        # Upper bound of the bucket holding the q-th fraction of samples
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** ((bucket + 1) / self.STEPS) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        ms = lambda s: round(s * 1000, 3)
+        return {"count": self.count, "mean_ms": ms(self.total / self.count) if self.count else 0.0,
+                "p50_ms": ms(self.percentile(0.5)), "p95_ms": ms(self.percentile(0.95)),
+                "p99_ms": ms(self.percentile(0.99)), "max_ms": ms(self.max),
+                "bytes_read": self.bytes_read, "bytes_written": self.bytes_written}
+
+# A timed section; code inside may set bytes_read / bytes_written
+class _Span:
+    active = True
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.started, self.bytes_read, self.bytes_written)
+
+# Shared stand-in while instrumentation is off: entering it does nothing
+class _NoSpan:
+    active = False
+    bytes_read = bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+_NO_SPAN = _NoSpan()
+
+# Per-operation latency histograms. Operations are named "<op>:<subject>",
+# e.g. "load:patients" or "show_frame:BillingPage"; span() hands out the
+# shared no-op span while disabled, so an instrumented call costs one check.
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.operations = {}  # name -> LatencyHistogram
+        self.since = time.time()
+        self._lock = threading.Lock()
+
+    def span(self, op, subject):
+        if not self.enabled:
+            return _NO_SPAN
+        return _Span(self, f"{op}:{subject}")
+
+    def record(self, name, seconds, bytes_read=0, bytes_written=0):
+        with self._lock:
+            histogram = self.operations.get(name)
+            if histogram is None:
+                histogram = self.operations[name] = LatencyHistogram()
+            histogram.add(seconds, bytes_read, bytes_written)
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.since = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {"enabled": self.enabled,
+                    "since": datetime.datetime.fromtimestamp(self.since).isoformat(timespec="seconds"),
+                    "operations": {name: h.summary() for name, h in sorted(self.operations.items())}}
+
+metrics = Metrics(METRICS_ENABLED)
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def new_record_id():
+    return uuid.uuid4().hex
+
+_MISSING = object()
+
+def _parse_number(value):
+    # "12" -> 12, "2.50" -> 2.5; anything else is kept as written
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return number if math.isfinite(number) else value
+
+def _as_is(value):
+    return value
+
+# A record as a dict-like object with one slot per field of its collection's
+# RECORD_LAYOUTS entry, a fraction of the size of a dict of strings. String
+# values of numeric fields are parsed as they are assigned and other strings
+# interned, so repeated values (doctors, dates, diseases) are stored once.
+# Fields outside the layout are kept in a small side dict.
+class TypedRecord(collections.abc.MutableMapping):
+    __slots__ = ("_extra",)
+    KEY = None
+    SLOTS = {}  # field -> (attribute name, parser for string values)
+
+    def __init__(self, fields=()):
+        self._extra = None
+        slots = self.SLOTS
+        for field, value in (fields.items() if isinstance(fields, collections.abc.Mapping) else fields):
+            slot = slots.get(field)
+            if slot is None:
+                self[field] = value
+            else:
+                setattr(self, slot[0], slot[1](value) if value.__class__ is str else value)
+
+    def __getitem__(self, field):
+        slot = self.SLOTS.get(field)
+        if slot is not None:
+            value = getattr(self, slot[0], _MISSING)
+            if value is not _MISSING:
+                return value
+        elif self._extra and field in self._extra:
+            return self._extra[field]
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        # Hot path for the pages and indexes; skips the KeyError round trip
+        slot = self.SLOTS.get(field)
+        if slot is not None:
+            return getattr(self, slot[0], default)
+        return self._extra.get(field, default) if self._extra else default
+
+    def __contains__(self, field):
+        return self.get(field, _MISSING) is not _MISSING
+
+    def __setitem__(self, field, value):
+        slot = self.SLOTS.get(field)
+        if slot is not None:
+            setattr(self, slot[0], slot[1](value) if value.__class__ is str else value)
+        elif self._extra is None:
+            self._extra = {field: value}
+        else:
+            self._extra[field] = value
+
+    def __delitem__(self, field):
+        slot = self.SLOTS.get(field)
+        if slot is not None and hasattr(self, slot[0]):
+            delattr(self, slot[0])
+        elif slot is None and self._extra and field in self._extra:
+            del self._extra[field]
+        else:
+            raise KeyError(field)
+
+    def __iter__(self):
+        for field, (attr, _) in self.SLOTS.items():
+            if hasattr(self, attr):
+                yield field
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        fields = {}
+        for field, (attr, _) in self.SLOTS.items():
+            value = getattr(self, attr, _MISSING)
+            if value is not _MISSING:
+                fields[field] = value
+        if self._extra:
+            fields.update(self._extra)
+        return fields
+
+    def copy(self):
+        return type(self)(self.to_dict())
+
+    def __reduce__(self):
+        # The classes are built at import, so pickle by collection key
+        return make_record, (self.KEY, self.to_dict())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+def _record_type(key, fields):
+    slots = {"id": ("id", _as_is)}
+    for field in fields:
+        slots[field] = (field.replace(" ", "_"), _parse_number if field in NUMERIC_FIELDS else sys.intern)
+    name = "".join(part.title() for part in key.split("_")) + "Record"
+    return type(name, (TypedRecord,), {"__slots__": tuple(attr for attr, _ in slots.values()), "KEY": key,
+                                       "SLOTS": slots})
+
+RECORD_TYPES = {key: _record_type(key, fields) for key, fields in RECORD_LAYOUTS.items()}
+
+def make_record(key, fields):
+    return RECORD_TYPES[key](fields)
+
+def plain_record(rec):
+    return rec.to_dict() if isinstance(rec, TypedRecord) else rec
+
+def json_default(value):
+    # json.dump(s) hook for TypedRecord values
+    if isinstance(value, TypedRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class ConflictError(ValueError):
+    pass
+
+# Advisory lock on "<data file>.lock", shared by every process working on the
+# data directory. The file also holds the collection's version stamp, a
+# fixed-width counter bumped on every write, which (unlike file mtimes) can't
+# miss two writes that land within the same clock tick.
+class FileLock:
+    WIDTH = 20
+    WIN_OFFSET = 1 << 20  # Windows locks a byte past the stamp so readers aren't blocked
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self, timeout=LOCK_TIMEOUT):
+        # Retries with backoff while another process holds the lock
+        if not os.path.exists(self.path):
+            open(self.path, "ab").close()
+        f = open(self.path, "r+b")
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(self.WIN_OFFSET)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    f.close()
+                    raise ConflictError(f"{os.path.basename(self.path)[:-5]} is busy on another "
+                                        f"workstation, try again") from None
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        self._file = f
+
+    def release(self):
+        f, self._file = self._file, None
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(self.WIN_OFFSET)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+
+    def version(self):
+        # Read without the lock; a torn read only looks like a change
+        try:
+            with open(self.path, "rb") as f:
+                stamp = f.read(self.WIDTH)
+        except FileNotFoundError:
+            return 0
+        except OSError:
+            return None
+        return int(stamp) if stamp.isdigit() else 0
+
+    def bump(self):
+        # Lock holder only
+        self._file.seek(0)
+        stamp = self._file.read(self.WIDTH)
+        self._file.seek(0)
+        self._file.write(b"%0*d" % (self.WIDTH, (int(stamp) if stamp.isdigit() else 0) + 1))
+        self._file.flush()
+
+# One FileLock per collection key, named after `path_for(key)`
+class CollectionLocks:
+    def __init__(self, path_for):
+        self._locks = {}
+        self._path_for = path_for
+
+    def __getitem__(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = FileLock(self._path_for(key) + ".lock")
+        return lock
+
+# Backends read a collection as a list of records and write changes back.
+# append/remove get the full id -> record mapping in case they need a rewrite;
+# commit writes a coalesced batch of upserts and deletes in one go, and
+# bulk_append adds lists of new records (an import) in one commit, taking a
+# list at a time so they are never all in memory.
+# locks[key] is the collection's FileLock; RecordStore holds it around every
+# write and bumps its version stamp, which signature() includes.
+# watch_paths(key) are the files a write to the collection changes.
+
+# One JSON array per collection; every write rewrites the file
+class JsonBackend:
+    def __init__(self, paths):
+        self.paths = paths  # collection key -> data file
+        self.locks = CollectionLocks(lambda key: self.paths[key])
+
+    def signature(self, key):
+        return (_file_signature(self.paths[key]), self.locks[key].version())
+
+    def watch_paths(self, key):
+        return (self.paths[key], self.locks[key].path)
+
+    def read(self, key):
+        if not os.path.exists(self.paths[key]):
+            return []
+        with metrics.span("read", key) as span, open(self.paths[key], "r") as f:
+            records = json.load(f)
+            span.bytes_read = f.tell()
+        return records
+
+    def write(self, key, records):
+        # Written beside the data file and renamed over it, so a crash or a
+        # reader never sees half a file
+        path = self.paths[key]
+        with metrics.span("write", key) as span, open(path + ".tmp", "w") as f:
+            # Converted up front: the indenting encoder is pure Python and
+            # much slower going through json_default per record
+            json.dump([plain_record(rec) for rec in records], f, indent=2)
+            span.bytes_written = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def append(self, key, new_records, records):
+        self.write(key, list(records.values()))
+
+    def remove(self, key, ids, records):
+        self.write(key, list(records.values()))
+
+    def update(self, key, changed, records):
+        self.write(key, list(records.values()))
+
+    def commit(self, key, upserts, ids, records):
+        self.write(key, list(records.values()))
+
+    def bulk_append(self, key, records, chunks):
+        # Still one array, with a record per line; the next write indents it again
+        path = self.paths[key]
+        with metrics.span("write", key) as span, open(path + ".tmp", "w") as f:
+            separator = "[\n"
+            for chunk in itertools.chain([records.values()], chunks):
+                for rec in chunk:
+                    f.write(separator + json.dumps(plain_record(rec)))
+                    separator = ",\n"
+            f.write("[]" if separator == "[\n" else "\n]")
+            span.bytes_written = f.tell()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+# JSON snapshot (the usual data file) plus an append-only log of operations;
+# the log is folded into a fresh snapshot once it passes JOURNAL_COMPACT_BYTES.
+# Replay is keyed by record id, so re-applying a log to a snapshot that
+# already contains it (e.g. after a crash mid-compaction) is harmless.
+class JournalBackend(JsonBackend):
+    def journal_path(self, key):
+        return self.paths[key] + ".journal"
+
+    def signature(self, key):
+        return (super().signature(key), _file_signature(self.journal_path(key)))
+
+    def watch_paths(self, key):
+        return super().watch_paths(key) + (self.journal_path(key),)
+
+    def read(self, key):
+        records = {}
+        for rec in super().read(key):
+            records[rec.get("id") or object()] = rec
+        if os.path.exists(self.journal_path(key)):
+            with metrics.span("replay", key) as span, open(self.journal_path(key), "r") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # Torn last line from a crash mid-append
+                    if line.strip():
+                        self._replay(records, json.loads(line))
+                span.bytes_read = os.fstat(f.fileno()).st_size  # f.tell() is off after a break from iterating
+        return list(records.values())
+
+    def _replay(self, records, op):
+        if op["op"] in ("insert", "update"):
+            rec = op["record"]
+            records[rec.get("id") or object()] = rec
+        elif op["op"] == "delete":
+            if "ids" in op:
+                for rid in op["ids"]:
+                    records.pop(rid, None)
+            else:
+                # Positional deletes written before records had ids
+                keys = list(records)
+                for pos in op["at"]:
+                    records.pop(keys[pos], None)
+
+    def write(self, key, records):
+        super().write(key, records)
+        if os.path.exists(self.journal_path(key)):
+            os.remove(self.journal_path(key))
+
+    def append(self, key, new_records, records):
+        self._log(key, [{"op": "insert", "record": r} for r in new_records], records)
+
+    def bulk_append(self, key, records, chunks):
+        # A fresh snapshot rather than a journal that would need compacting
+        super().bulk_append(key, records, chunks)
+        if os.path.exists(self.journal_path(key)):
+            os.remove(self.journal_path(key))
+
+    def remove(self, key, ids, records):
+        self._log(key, [{"op": "delete", "ids": ids}], records)
+
+    def update(self, key, changed, records):
+        self._log(key, [{"op": "update", "record": r} for r in changed], records)
+
+    def commit(self, key, upserts, ids, records):
+        ops = [{"op": "update", "record": r} for r in upserts]
+        self._log(key, ops + [{"op": "delete", "ids": ids}] if ids else ops, records)
+
+    def _log(self, key, ops, records):
+        path = self.journal_path(key)
+        with metrics.span("append", key) as span, open(path, "a") as f:
+            start = f.tell()
+            f.write("".join(json.dumps(op, default=json_default) + "\n" for op in ops))
+            span.bytes_written = f.tell() - start
+        if os.path.getsize(path) > JOURNAL_COMPACT_BYTES:
+            self.write(key, list(records.values()))
+
+# One table per collection in a single SQLite file. Each row keeps the record
+# as JSON plus copies of the fields the UI filters on, so inserts and deletes
+# touch only the affected rows and their index entries
+class SqliteBackend:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # SQLite serializes single statements itself; the locks cover a
+        # read-check-write (e.g. booking a slot) spanning several
+        self.locks = CollectionLocks(lambda key: f"{db_path}.{key}")
+        # Shared by IOWorker threads; RecordStore.lock serializes access
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS _meta (collection TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            for key, columns in SQLITE_INDEXES.items():
+                extra = "".join(f", {col} TEXT" for col in columns)
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {key} (rowid INTEGER PRIMARY KEY, id TEXT, data TEXT NOT NULL{extra})")
+                # Tables created before records had ids
+                if "id" not in [row[1] for row in self.conn.execute(f"PRAGMA table_info({key})")]:
+                    self.conn.execute(f"ALTER TABLE {key} ADD COLUMN id TEXT")
+                self.conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{key}_id ON {key} (id)")
+                for col in columns:
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{key}_{col} ON {key} ({col})")
+                self.conn.execute("INSERT OR IGNORE INTO _meta (collection, version) VALUES (?, 0)", (key,))
+
+    def signature(self, key):
+        row = self.conn.execute("SELECT version FROM _meta WHERE collection = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def watch_paths(self, key):
+        # The database file is shared by every collection; the lock file's
+        # version stamp tells them apart
+        return (self.locks[key].path,)
+
+    def read(self, key):
+        with metrics.span("read", key) as span:
+            rows = self.conn.execute(f"SELECT data FROM {key} ORDER BY rowid").fetchall()
+            if span.active:
+                span.bytes_read = sum(len(data) for (data,) in rows)
+            return [json.loads(data) for (data,) in rows]
+
+    def _insert_rows(self, key, records):
+        columns = SQLITE_INDEXES[key]
+        sql = (f"INSERT OR REPLACE INTO {key} (id, data{''.join(', ' + c for c in columns)}) "
+               f"VALUES (?, ?{', ?' * len(columns)})")
+        self.conn.executemany(sql, ([r.get("id"), json.dumps(r, default=json_default)]
+                                    + [r.get(field) for field in columns.values()] for r in records))
+
+    def _bump(self, key):
+        self.conn.execute("UPDATE _meta SET version = version + 1 WHERE collection = ?", (key,))
+
+    def write(self, key, records):
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {key}")
+            self._insert_rows(key, records)
+            self._bump(key)
+
+    def append(self, key, new_records, records):
+        with self.conn:
+            self._insert_rows(key, new_records)
+            self._bump(key)
+
+    def bulk_append(self, key, records, chunks):
+        with self.conn:
+            for chunk in chunks:
+                self._insert_rows(key, chunk)
+            self._bump(key)
+
+    def update(self, key, changed, records):
+        columns = SQLITE_INDEXES[key]
+        sql = f"UPDATE {key} SET data = ?{''.join(f', {c} = ?' for c in columns)} WHERE id = ?"
+        with self.conn:
+            self.conn.executemany(sql, ([json.dumps(r, default=json_default)]
+                                        + [r.get(field) for field in columns.values()] + [r["id"]] for r in changed))
+            self._bump(key)
+
+    def _delete_rows(self, key, ids):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self.conn.execute(f"DELETE FROM {key} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+
+    def remove(self, key, ids, records):
+        with self.conn:
+            self._delete_rows(key, ids)
+            self._bump(key)
+
+    def commit(self, key, upserts, ids, records):
+        with self.conn:
+            self._insert_rows(key, upserts)
+            self._delete_rows(key, ids)
+            self._bump(key)
+
+def snapshot_path(path):
+    return os.path.splitext(path)[0] + SNAPSHOT_SUFFIX
+
+# Compact snapshot of one collection, read through mmap:
+#   b"HMSNAP1\0", u32 header length, header JSON {"fields", "rows"}, padding
+#   to 8 bytes, rows + 1 u64 row offsets (little-endian), then the row area:
+#   one flat JSON array in which each record is its value count n followed by
+#   its values in "fields" order (cut short where it lacks the trailing,
+#   optional ones), or -1 followed by the record as an object when its fields
+#   are some other set.
+# Counting rows reads the header only, a page of rows decodes just its slice
+# of the row area, and a full read is a single json.loads into one list.
+class SnapshotFile:
+    MAGIC = b"HMSNAP1\0"
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != self.MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        (length,) = struct.unpack_from("<I", self._map, 8)
+        header = json.loads(self._map[12:12 + length])
+        self.fields = header["fields"]
+        self.rows = header["rows"]
+        self._offsets = 12 + length + (-(12 + length) % 8)
+        self._area = self._offsets + 8 * (self.rows + 1)
+
+    def __len__(self):
+        return self.rows
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _offset(self, i):
+        return self._area + struct.unpack_from("<Q", self._map, self._offsets + 8 * i)[0]
+
+    def records(self, start=0, stop=None, make=dict):
+        # Decodes rows start..stop only, each built by make(mapping or pairs)
+        start, stop, _ = slice(start, stop).indices(self.rows)
+        if start >= stop:
+            return []
+        if start == 0 and stop == self.rows:
+            values = json.loads(self._map[self._area:self._offset(self.rows)])
+        else:
+            values = json.loads(b"[" + self._map[self._offset(start):self._offset(stop) - 1] + b"]")
+        fields, records, i = self.fields, [], 0
+        while i < len(values):
+            n = values[i]
+            if n < 0:
+                records.append(make(values[i + 1]))
+                i += 2
+            else:
+                records.append(make(zip(fields, values[i + 1:i + 1 + n])))
+                i += n + 1
+        return records
+
+    def record(self, i):
+        return self.records(i, i + 1)[0]
+
+    def size(self):
+        return len(self._map)
+
+def write_snapshot(path, records, more=()):
+    # more: further lists of records (an import), encoded a list at a time and
+    # spooled to a temporary file, since the row offsets go before the rows
+    more = iter(more)
+    records = [plain_record(rec) for rec in itertools.chain(records, next(more, ()))]
+    # Fields in order of how many records have them, so a record lacking only
+    # optional fields still fits the layout
+    counts = collections.Counter(field for rec in records for field in rec)
+    fields = sorted(counts, key=lambda field: -counts[field])
+    prefixes = [frozenset(fields[:n]) for n in range(len(fields) + 1)]
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+    def encode(rec):
+        if len(rec) < len(prefixes) and rec.keys() == prefixes[len(rec)]:
+            return dumps([len(rec)] + [rec[field] for field in fields[:len(rec)]])[1:-1].encode()
+        return ("-1," + dumps(rec)).encode()
+
+    rows = [encode(rec) for rec in records]
+    offsets, position = [], 1
+    for row in rows:
+        offsets.append(position)
+        position += len(row) + 1
+    spool = None
+    try:
+        for chunk in more:
+            if spool is None:
+                spool = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+            for rec in chunk:
+                row = encode(plain_record(rec))
+                spool.write((b"," if offsets else b"") + row)
+                offsets.append(position)
+                position += len(row) + 1
+        offsets.append(max(position, 2))  # The row area's length
+        header = json.dumps({"fields": fields, "rows": len(offsets) - 1}).encode()
+        with open(path, "wb") as f:
+            f.write(SnapshotFile.MAGIC + struct.pack("<I", len(header)) + header)
+            f.write(b"\0" * (-(12 + len(header)) % 8))
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+            f.write(b"[" + b",".join(rows))
+            if spool is not None:
+                spool.seek(0)
+                shutil.copyfileobj(spool, f)
+            f.write(b"]")
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+    finally:
+        if spool is not None:
+            spool.close()
+
+# One SnapshotFile per collection beside its JSON file (patients.hms), written
+# whole like the JSON backend's files. Until a collection's first snapshot is
+# written (an install switched to snapshot storage without --to-snapshot), its
+# JSON file and journal are read instead, and that first write carries them over.
+class SnapshotBackend(JsonBackend):
+    def __init__(self, paths):
+        super().__init__(paths)
+        self._json = JournalBackend(paths)
+
+    def _has_snapshot(self, key):
+        return os.path.exists(snapshot_path(self.paths[key]))
+
+    def signature(self, key):
+        if not self._has_snapshot(key):
+            return ("json", self._json.signature(key))
+        return (_file_signature(snapshot_path(self.paths[key])), self.locks[key].version())
+
+    def watch_paths(self, key):
+        return (snapshot_path(self.paths[key]), self.locks[key].path)
+
+    def read(self, key):
+        return self.read_records(key, dict)
+
+    def read_records(self, key, make):
+        # Records built by make() straight from the file's values
+        if not self._has_snapshot(key):
+            return [make(rec) for rec in self._json.read(key)]
+        with metrics.span("read", key) as span, SnapshotFile(snapshot_path(self.paths[key])) as snapshot:
+            span.bytes_read = snapshot.size()
+            return snapshot.records(make=make)
+
+    def count(self, key):
+        if not self._has_snapshot(key):
+            return len(self._json.read(key))
+        with SnapshotFile(snapshot_path(self.paths[key])) as snapshot:
+            return len(snapshot)
+
+    def write(self, key, records):
+        self._write(key, records, ())
+
+    def bulk_append(self, key, records, chunks):
+        self._write(key, records.values(), chunks)
+
+    def _write(self, key, records, more):
+        path = snapshot_path(self.paths[key])
+        with metrics.span("write", key) as span:
+            span.bytes_written = write_snapshot(path + ".tmp", records, more)
+        os.replace(path + ".tmp", path)
+
+# Converts every collection between its JSON file (folding in any journal)
+# and its snapshot; returns the record counts
+def convert_to_snapshot(paths):
+    return _convert(JournalBackend(paths), SnapshotBackend(paths), paths)
+
+def convert_from_snapshot(paths):
+    return _convert(SnapshotBackend(paths), JournalBackend(paths), paths)
+
+def _convert(source, target, paths):
+    counts = {}
+    for key in paths:
+        # Both formats share the collection's lock file
+        lock = target.locks[key]
+        lock.acquire()
+        try:
+            records = source.read(key)
+            target.write(key, records)
+            lock.bump()
+        finally:
+            lock.release()
+        counts[key] = len(records)
+    return counts
+
+def make_backend(mode, paths, db_path=None):
+    if mode == "json":
+        return JsonBackend(paths)
+    if mode == "journal":
+        return JournalBackend(paths)
+    if mode == "sqlite":
+        return SqliteBackend(db_path or SQLITE_PATH)
+    if mode == "snapshot":
+        return SnapshotBackend(paths)
+    raise ValueError(f"Unknown storage mode: {mode}")
+
+# One-shot import of the JSON files (and any pending journals) into SQLite
+def migrate_json_to_sqlite(paths, db_path):
+    source = JournalBackend(paths)
+    target = SqliteBackend(db_path)
+    counts = {}
+    for key in paths:
+        records = source.read(key)
+        for rec in records:
+            if not rec.get("id"):
+                rec["id"] = new_record_id()
+        target.write(key, records)
+        counts[key] = len(records)
+    target.conn.close()
+    return counts
+
+# Three-way merge by record id for a full-collection save that raced with
+# another process: `mine` is the caller's edit of `base`, `theirs` is what is
+# on disk now. The caller's inserts, deletes and replaced records are applied
+# on top of theirs; records the caller didn't touch keep their version.
+def _merge(base, mine, theirs):
+    mine = {rec.setdefault("id", new_record_id()): rec for rec in mine}
+    merged = {rid: rec for rid, rec in theirs.items() if rid in mine or rid not in base}
+    for rid, rec in mine.items():
+        if rid not in base or base[rid] != rec:
+            merged[rid] = rec
+    return list(merged.values())
+
+# A collection handed out for a load-modify-save: copies of the records as a
+# list (edits to them don't reach the cache), and the {id: record} mapping they
+# were read from, which RecordStore.save merges against so records other
+# writers added or changed since are kept
+class Checkout(list):
+    __slots__ = ("base",)
+
+# In-process record store: keeps every parsed collection in memory, keyed by
+# record id, and only re-reads a collection when its files change on disk.
+# Subscribers get ("insert" | "delete", records) and ("update", [(old, new)])
+# for each write, and ("reload", None) when a collection is replaced wholesale.
+# Reads from disk and every write happen under the collection's FileLock, with
+# the cache brought up to date first, so writes from other processes are kept.
+# With write_behind (ms) set, changes apply to the cache and notify at once but
+# reach the backend in one coalesced commit per collection once writes pause;
+# unflushed changes are re-applied if the collection is re-read meanwhile.
+# Records are held as their collection's TypedRecord class unless compact=False.
+class RecordStore:
+    def __init__(self, backend, write_behind=None, compact=True):
+        self.backend = backend
+        self.write_behind = write_behind
+        self.record_types = RECORD_TYPES if compact else {}  # Plain dicts when not compact
+        self._cache = {}      # collection key -> (signature, {id: record})
+        self._listeners = {}  # collection key -> [callback(event, records)]
+        self._held = collections.Counter()  # collection key -> nesting depth of its FileLock
+        self._pending = {}    # collection key -> ({id: upserted record}, {deleted id})
+        self._first_pending = None
+        self._timer = None
+        self._backoff = 0  # ms the next retry waits at least, while background flushes fail
+        self.flush_error = None  # Last failed background flush; its changes stay queued
+        self.on_flush_error = None  # callback(error) when background flushes start failing, (None) once one works
+        self.lock = threading.RLock()  # Pages load and write from IOWorker threads
+        self.hits = 0
+        self.misses = 0
+
+    def subscribe(self, key, callback):
+        self._listeners.setdefault(key, []).append(callback)
+
+    def unsubscribe(self, key, callback):
+        with contextlib.suppress(ValueError):
+            self._listeners.get(key, []).remove(callback)
+
+    def _notify(self, key, event, records):
+        for callback in list(self._listeners.get(key, ())):
+            callback(event, records)
+
+    @contextlib.contextmanager
+    def transaction(self, *keys):
+        # Holds the FileLocks of `keys` (re-entrantly, taken in sorted order)
+        # with their caches refreshed, so a read-check-write inside sees every
+        # other process's writes and none can land before it finishes
+        with self.lock:
+            entered = []
+            try:
+                for key in sorted(set(keys)):
+                    if not self._held[key]:
+                        self.backend.locks[key].acquire()
+                    self._held[key] += 1
+                    entered.append(key)
+                for key in entered:
+                    if self._held[key] == 1:
+                        self._load(key)
+                yield
+            finally:
+                for key in reversed(entered):
+                    self._held[key] -= 1
+                    if not self._held[key]:
+                        self.backend.locks[key].release()
+
+    def load(self, key):
+        with self.lock, metrics.span("load", key):
+            return self._load(key)
+
+    def typed(self, key, rec):
+        # `rec` as the collection's record class (parsed once, here)
+        cls = self.record_types.get(key)
+        return rec if cls is None or type(rec) is cls else cls(rec)
+
+    def _load(self, key):
+        sig = self.backend.signature(key)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == sig:
+            self.hits += 1
+            return cached[1]
+        if not self._held[key]:
+            # Don't read while another process is halfway through a write
+            with self.transaction(key):
+                return self._cache[key][1]
+        self.misses += 1
+        records = {}
+        legacy = False
+        cls = self.record_types.get(key)
+        read_records = getattr(self.backend, "read_records", None)
+        for rec in read_records(key, cls) if cls is not None and read_records else self.backend.read(key):
+            if cls is not None and type(rec) is not cls:
+                rec = cls(rec)
+            if not rec.get("id"):
+                rec["id"] = new_record_id()
+                legacy = True
+            records[rec["id"]] = rec
+        pending = self._pending.get(key)
+        if pending:
+            # Unflushed changes go on top of what was read
+            upserts, ids = pending
+            for rid in ids:
+                records.pop(rid, None)
+            records.update(upserts)
+        if legacy:
+            # Persist the generated ids once so they stay stable across runs
+            self.backend.write(key, list(records.values()))
+            self.backend.locks[key].bump()
+            sig = self.backend.signature(key)
+        self._cache[key] = (sig, records)
+        if cached is not None:
+            # Changed on disk since we last looked
+            self._notify(key, "reload", None)
+        return records
+
+    def get(self, key, record_id):
+        return self.load(key).get(record_id)
+
+    def count(self, key):
+        # Without loading the collection when the backend can count its rows
+        with self.lock:
+            if key in self._cache or key in self._pending or not hasattr(self.backend, "count"):
+                return len(self.load(key))
+            return self.backend.count(key)
+
+    def checkout(self, key):
+        with self.lock:
+            records = self.load(key)
+            checkout = Checkout(rec.copy() for rec in records.values())
+            checkout.base = dict(records)  # Cached records are replaced on write, never mutated
+            return checkout
+
+    def save(self, key, records, base=None, overwrite=False):
+        # Replaces the collection with `records`, merging in changes written
+        # since they were read from `base` (default: that of a Checkout).
+        # Without a base the save must be an explicit overwrite
+        if base is None:
+            base = getattr(records, "base", None)
+        if base is None and not overwrite:
+            raise ValueError(f"Saving {key} needs the records it was edited from: "
+                             "pass a Checkout, base= or overwrite=True")
+        with self.lock, metrics.span("save", key), self.transaction(key):
+            if base is not None:
+                records = _merge(base, records, self._cache[key][1])
+            self._save(key, records)
+
+    def _save(self, key, records):
+        # A full save supersedes anything queued for the collection
+        records = {rec.setdefault("id", new_record_id()): self.typed(key, rec) for rec in records}
+        self.backend.write(key, list(records.values()))
+        self._pending.pop(key, None)
+        self._commit(key, records)
+        self._notify(key, "reload", None)
+
+    def _commit(self, key, records):
+        self.backend.locks[key].bump()
+        self._cache[key] = (self.backend.signature(key), records)
+
+    def _write(self, key, records, call, upserts=(), ids=()):
+        # Runs the backend call now, or queues the change under write-behind
+        if self.write_behind is None:
+            try:
+                call()
+            except Exception:
+                self.invalidate(key)
+                raise
+            self._commit(key, records)
+            return
+        pending_upserts, pending_ids = self._pending.setdefault(key, ({}, set()))
+        for rec in upserts:
+            pending_upserts[rec["id"]] = rec
+            pending_ids.discard(rec["id"])
+        for rid in ids:
+            pending_upserts.pop(rid, None)
+            pending_ids.add(rid)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Debounced: write_behind ms after the latest change, but no later
+        # than WRITE_BEHIND_MAX_MS after the first one still queued
+        now = time.monotonic()
+        if self._first_pending is None:
+            self._first_pending = now
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = min(self.write_behind, WRITE_BEHIND_MAX_MS - (now - self._first_pending) * 1000)
+        delay = max(delay, self._backoff)
+        self._timer = threading.Timer(max(0, delay) / 1000, self._flush_due)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_due(self):
+        try:
+            self.flush()
+        except Exception as e:
+            with self.lock:
+                failing = self.flush_error is not None
+                self.flush_error = e
+                self._backoff = min(max(self._backoff * 2, self.write_behind), WRITE_BEHIND_RETRY_MAX_MS)
+                if self._pending:
+                    self._first_pending = time.monotonic()
+                    self._schedule_flush()  # Retry
+                if not failing and self.on_flush_error is not None:
+                    self.on_flush_error(e)
+
+    def flush(self, key=None):
+        # Writes the queued changes of `key` (default: every collection) now,
+        # each in a single backend commit under the collection's lock
+        with self.lock:
+            for key in [key] if key is not None else list(self._pending):
+                if key not in self._pending:
+                    continue
+                with metrics.span("flush", key), self.transaction(key):
+                    upserts, ids = self._pending[key]
+                    records = self._cache[key][1]
+                    self.backend.commit(key, list(upserts.values()), list(ids), records)
+                    del self._pending[key]
+                    self._commit(key, records)
+            if not self._pending:
+                self._first_pending = None
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                self._backoff = 0
+                if self.flush_error is not None:
+                    self.flush_error = None
+                    if self.on_flush_error is not None:
+                        self.on_flush_error(None)
+
+    def pending(self):
+        with self.lock:
+            return {key: len(upserts) + len(ids) for key, (upserts, ids) in self._pending.items()}
+
+    def insert(self, key, new_records):
+        with self.lock, metrics.span("insert", key), self.transaction(key):
+            return self._insert(key, new_records)
+
+    def _insert(self, key, new_records):
+        new_records = list(new_records)
+        for rec in new_records:
+            rec.setdefault("id", new_record_id())
+        new_records = [self.typed(key, rec) for rec in new_records]
+        records = self.load(key)
+        for rec in new_records:
+            records[rec["id"]] = rec
+        self._write(key, records, lambda: self.backend.append(key, new_records, records), upserts=new_records)
+        self._notify(key, "insert", new_records)
+        return new_records
+
+    def bulk_insert(self, key, chunks):
+        # Streams lists of new records to the backend in one commit, without
+        # holding them in the cache: it's dropped instead, so the next load
+        # reads the result, and subscribers get ("reload", None). Returns how
+        # many were written
+        count = 0
+
+        def with_ids():
+            nonlocal count
+            for chunk in chunks:
+                for rec in chunk:
+                    rec.setdefault("id", new_record_id())
+                count += len(chunk)
+                yield chunk
+
+        with self.lock, metrics.span("bulk_insert", key), self.transaction(key):
+            self.flush(key)
+            try:
+                self.backend.bulk_append(key, self._cache[key][1], with_ids())
+                self.backend.locks[key].bump()
+            finally:
+                self.invalidate(key)
+            self._notify(key, "reload", None)
+        return count
+
+    def delete(self, key, ids):
+        with self.lock, metrics.span("delete", key), self.transaction(key):
+            return self._delete(key, ids)
+
+    def _delete(self, key, ids):
+        records = self.load(key)
+        ids = [rid for rid in ids if rid in records]
+        removed = [records.pop(rid) for rid in ids]
+        if ids:
+            self._write(key, records, lambda: self.backend.remove(key, ids, records), ids=ids)
+            self._notify(key, "delete", removed)
+        return removed
+
+    def update(self, key, changes):
+        # changes: {id: {field: value}}; records are replaced, not mutated
+        with self.lock, metrics.span("update", key), self.transaction(key):
+            return self._update(key, changes)
+
+    def _update(self, key, changes):
+        records = self.load(key)
+        pairs = [(records[rid], self.typed(key, {**records[rid], **fields}))
+                 for rid, fields in changes.items() if rid in records]
+        if pairs:
+            changed = [new for _, new in pairs]
+            for new in changed:
+                records[new["id"]] = new
+            self._write(key, records, lambda: self.backend.update(key, changed, records), upserts=changed)
+            self._notify(key, "update", pairs)
+        return [new for _, new in pairs]
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cached": sorted(self._cache), "pending": self.pending()}
+
+# Watches the files behind each collection (backend.watch_paths) from a daemon
+# thread and calls on_change(keys) there with the collections whose files
+# changed, once a burst of writes has been quiet for WATCH_DEBOUNCE_MS (or
+# WATCH_MAX_DELAY_MS after it began). On Linux inotify reports activity in the
+# data directories; otherwise, or in "poll" mode, the files are stat'ed every
+# WATCH_POLL_MS. Either way a collection is only reported when one of its
+# files' (mtime, size) really moved, so opening a lock file, a temp file being
+# written or a burst that ends where it started are not changes.
+class DataWatcher:
+    # inotify_event: wd, mask, cookie, name length, then the name
+    EVENT = struct.Struct("iIII")
+    IN_MODIFY, IN_ATTRIB, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_Q_OVERFLOW = 0x2, 0x4, 0x80, 0x100, 0x200, 0x4000
+
+    def __init__(self, backend, on_change, mode=WATCH_MODE, keys=tuple(DATA_PATHS)):
+        self.on_change = on_change
+        self.mode = mode
+        watch_paths = getattr(backend, "watch_paths", None)  # None for a RemoteBackend
+        self.files = {os.path.abspath(path): key for key in keys for path in watch_paths(key)} if watch_paths else {}
+        self.method = None  # "inotify" or "poll" while running
+        self._stop = None
+        self._dirs = {}  # inotify watch descriptor -> directory
+
+    def start(self):
+        if self.mode == "off" or not self.files or self._stop is not None:
+            return self
+        fd = self._open_inotify() if self.mode != "poll" else None
+        self.method = "poll" if fd is None else "inotify"
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, args=(fd, self._stop), name="data-watcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        # The thread notices within WATCH_POLL_MS and closes its descriptor
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+            self.method = None
+
+    def _open_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        self._dirs = {}
+        for directory in {os.path.dirname(path) for path in self.files}:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+            if wd < 0:  # Missing directory or out of watches
+                os.close(fd)
+                return None
+            self._dirs[wd] = directory
+        return fd
+
+    def _activity(self, fd):
+        # True if inotify reported anything on a watched file
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        hit, offset = False, 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b"\0")
+            offset += self.EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW or os.path.join(self._dirs.get(wd, ""), os.fsdecode(name)) in self.files:
+                hit = True
+        return hit
+
+    def _signatures(self):
+        return {path: _file_signature(path) for path in self.files}
+
+    def _run(self, fd, stop):
+        reported = seen = self._signatures()
+        first = last = None  # Start and latest activity of the current burst
+        try:
+            while not stop.is_set():
+                if first is None:
+                    timeout = WATCH_POLL_MS / 1000
+                else:
+                    timeout = max(0.0, min(last + WATCH_DEBOUNCE_MS / 1000, first + WATCH_MAX_DELAY_MS / 1000)
+                                  - time.monotonic())
+                if fd is not None:
+                    active = bool(select.select([fd], [], [], timeout)[0]) and self._activity(fd)
+                else:
+                    stop.wait(timeout)
+                    current = self._signatures()
+                    active, seen = current != seen, current
+                now = time.monotonic()
+                if active:
+                    first = now if first is None else first
+                    last = now
+                if first is not None and (now - last >= WATCH_DEBOUNCE_MS / 1000
+                                          or now - first >= WATCH_MAX_DELAY_MS / 1000):
+                    first = None
+                    current = self._signatures()
+                    changed = sorted({key for path, key in self.files.items() if current[path] != reported[path]})
+                    reported = seen = current
+                    if changed and not stop.is_set():
+                        self.on_change(changed)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+# The store behind load_data/save_data, built on first use so that importing
+# this module opens no files (with sqlite storage that would create the database)
+store = None
+_store_lock = threading.Lock()
+
+def default_store():
+    global store
+    with _store_lock:
+        if store is None:
+            store = RecordStore(make_backend(STORAGE_MODE, DATA_PATHS), WRITE_BEHIND_MS)
+        return store
+
+_COLLECTION_BY_PATH = {path: key for key, path in DATA_PATHS.items()}
+
+# Utility functions to load/save JSON; known collections go through the shared store
+def load_data(filename):
+    key = _COLLECTION_BY_PATH.get(filename)
+    if key is not None:
+        # Callers append to / filter the returned list, so hand out a copy
+        # that remembers what it was read from (see RecordStore.save)
+        return default_store().checkout(key)
+    if os.path.exists(filename):
+        with metrics.span("read", filename) as span, open(filename, "r") as f:
+            data = json.load(f)
+            span.bytes_read = f.tell()
+        return data
+    return []
+
+def save_data(filename, data, base=None):
+    key = _COLLECTION_BY_PATH.get(filename)
+    if key is not None:
+        # `data` is load_data's list or a copy of it made with its base
+        default_store().save(key, data, base)
+        return
+    with metrics.span("write", filename) as span, open(filename, "w") as f:
+        json.dump(data, f, indent=2)
+        span.bytes_written = f.tell()
+
+def _to_number(value, default=0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+# Base for indexes kept in step with one collection's store notifications:
+# inserted and deleted records go to the subclass's _add and _remove hooks,
+# an update removes the old record and adds the new one, and a reload (or any
+# other event) rebuilds the index from the store.
+class CollectionIndex:
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        store.subscribe(key, self._on_change)
+
+    def _on_change(self, event, records):
+        if event == "insert":
+            for rec in records:
+                self._add(rec)
+        elif event == "delete":
+            for rec in records:
+                self._remove(rec)
+        elif event == "update":
+            for old, new in records:
+                self._remove(old)
+                self._add(new)
+        else:
+            self.rebuild()
+
+# Min-heap of medicines keyed on quantity relative to their reorder level
+# (a "reorder level" field, else LOW_STOCK_THRESHOLD). A changed medicine
+# gets a fresh entry; superseded entries are dropped when they surface.
+class LowStockIndex(CollectionIndex):
+    def __init__(self, store):
+        self.heap = []      # (quantity / level, seq, id)
+        self.entries = {}   # id -> current heap entry
+        self.info = {}      # id -> (name, quantity, reorder level)
+        self.below = set()  # ids under their reorder level
+        self._seq = itertools.count()
+        super().__init__(store, "medicines")
+
+    def rebuild(self):
+        with self.store.lock:
+            self.heap, self.entries, self.info, self.below = [], {}, {}, set()
+            for med in self.store.load(self.key).values():
+                self.heap.append(self._entry(med))
+            heapq.heapify(self.heap)
+
+    def _entry(self, med):
+        rid = med["id"]
+        quantity = _to_number(med.get("quantity"))
+        level = _to_number(med.get("reorder level"), LOW_STOCK_THRESHOLD) or LOW_STOCK_THRESHOLD
+        entry = (quantity / level, next(self._seq), rid)
+        self.entries[rid] = entry
+        self.info[rid] = (med.get("name", ""), quantity, level)
+        if quantity < level:
+            self.below.add(rid)
+        else:
+            self.below.discard(rid)
+        return entry
+
+    def _add(self, med):
+        heapq.heappush(self.heap, self._entry(med))
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = list(self.entries.values())
+            heapq.heapify(self.heap)
+
+    def _remove(self, med):
+        rid = med["id"]
+        self.entries.pop(rid, None)
+        self.info.pop(rid, None)
+        self.below.discard(rid)
+
+    def top(self, k):
+        # Up to k medicines under their reorder level, lowest first: O(k log n)
+        with self.store.lock:
+            found = []
+            while self.heap and len(found) < k:
+                entry = heapq.heappop(self.heap)
+                if self.entries.get(entry[2]) is not entry:
+                    continue
+                found.append(entry)
+                if entry[0] >= 1:
+                    break
+            for entry in found:
+                heapq.heappush(self.heap, entry)
+            return [(rid,) + self.info[rid] for ratio, _, rid in found if ratio < 1]
+
+# Dashboard aggregates, maintained from store notifications so rendering the
+# dashboard never scans a collection
+class DashboardStats:
+    def __init__(self, store):
+        self.store = store
+        self.appointments_by_date = collections.Counter()
+        self.revenue_by_date = collections.defaultdict(float)
+        self.low_stock = LowStockIndex(store)
+        self.occupied_beds = collections.Counter()
+        self.primed = False  # Changes before prime() are left to its full pass
+        self._handlers = (("appointments", self._on_appointments), ("billing", self._on_billing),
+                          ("patients", self._on_patients))
+        for key, handler in self._handlers:
+            store.subscribe(key, handler)
+
+    def prime(self):
+        # Initial full pass; runs on an IOWorker thread at startup
+        with self.store.lock:
+            self.primed = True
+            for key, handler in self._handlers:
+                handler("reload", None)
+            self.low_stock.rebuild()
+
+    def snapshot(self):
+        with self.store.lock:
+            return {
+                "Patients": self.count("patients"),
+                "Doctors": self.count("doctors"),
+                "Staff": self.count("staff"),
+                "Medicines": self.count("medicines"),
+                "Appointments": self.count("appointments"),
+                "Machinery": self.count("machinery"),
+                "Available Beds": self.available_beds(),
+                "Today's Appointments": self.todays_appointments(),
+                "Low Stock": len(self.low_stock.below),
+                "Today's Revenue": f"{self.todays_revenue():.2f}",
+            }
+
+    def _changes(self, key, event, records, reset):
+        # Yields (record, +1/-1); a reload resets and replays the collection
+        if not self.primed:
+            return ()
+        if event == "reload":
+            reset()
+            return ((r, 1) for r in self.store.load(key).values())
+        if event == "update":
+            return ((r, sign) for old, new in records for r, sign in ((old, -1), (new, 1)))
+        return ((r, 1 if event == "insert" else -1) for r in records)
+
+    def _on_appointments(self, event, records):
+        for appt, sign in self._changes("appointments", event, records, self.appointments_by_date.clear):
+            self.appointments_by_date[appt.get("date", "")] += sign
+
+    def _on_billing(self, event, records):
+        for bill, sign in self._changes("billing", event, records, self.revenue_by_date.clear):
+            self.revenue_by_date[bill.get("date", "")] += sign * _to_number(bill.get("total"))
+
+    def _on_patients(self, event, records):
+        for patient, sign in self._changes("patients", event, records, self.occupied_beds.clear):
+            bed = patient.get("bed")
+            if bed:
+                self.occupied_beds[bed] += sign
+                if self.occupied_beds[bed] <= 0:
+                    del self.occupied_beds[bed]
+
+    def count(self, key):
+        return self.store.count(key)
+
+    def today(self):
+        return datetime.date.today().isoformat()
+
+    def todays_appointments(self):
+        return self.appointments_by_date[self.today()]
+
+    def todays_revenue(self):
+        return self.revenue_by_date.get(self.today(), 0.0)
+
+    def available_beds(self):
+        return max(0, TOTAL_BEDS - len(self.occupied_beds))
+
+# Fields covered by each collection's search index
+SEARCH_FIELDS = {
+    "patients": ("name", "disease", "bed"),
+    "doctors": ("name", "specialization", "phone"),
+    "staff": ("name", "role", "phone"),
+    "medicines": ("name",),
+    "lab_tests": ("test name",),
+    "appointments": ("patient name", "doctor", "date"),
+    "machinery": ("machine name", "supplier"),
+    "billing": ("patient", "item", "medicine", "date"),
+}
+
+# Query tokens shorter than this only match whole tokens: as prefixes they
+# would match (and have to collect) most of a large collection
+SEARCH_MIN_PREFIX = 3
+
+def _tokens(text):
+    return re.findall(r"\w+", str(text).lower())
+
+# Token-based inverted index over a collection's SEARCH_FIELDS, updated from
+# store notifications. Query tokens match indexed tokens by prefix through a
+# sorted vocabulary, so "joh smi" finds "John Smith"; below SEARCH_MIN_PREFIX
+# characters only whole tokens match ("jo" finds "Jo", not "John"). Results
+# are grouped by matching token, then in insertion order.
+class SearchIndex(CollectionIndex):
+    def __init__(self, store, key):
+        self.fields = SEARCH_FIELDS[key]
+        self.postings = {}  # token -> {id: None}, in insertion order
+        self.vocab = []     # sorted tokens
+        super().__init__(store, key)
+
+    def rebuild(self):
+        with self.store.lock:
+            self.postings = {}
+            for rec in self.store.load(self.key).values():
+                for token in self._record_tokens(rec):
+                    self.postings.setdefault(token, {})[rec["id"]] = None
+            self.vocab = sorted(self.postings)
+
+    def _record_tokens(self, rec):
+        return {t for field in self.fields for t in _tokens(rec.get(field, ""))}
+
+    def _add(self, rec):
+        rid = rec["id"]
+        for token in self._record_tokens(rec):
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.vocab, token)
+            posting[rid] = None
+
+    def _remove(self, rec):
+        rid = rec["id"]
+        for token in self._record_tokens(rec):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(rid, None)
+            if not posting:
+                del self.postings[token]
+                del self.vocab[bisect.bisect_left(self.vocab, token)]
+
+    def _range(self, prefix):
+        lo = bisect.bisect_left(self.vocab, prefix)
+        if len(prefix) < SEARCH_MIN_PREFIX:
+            return lo, lo + (lo < len(self.vocab) and self.vocab[lo] == prefix)
+        return lo, bisect.bisect_left(self.vocab, prefix + "\uffff", lo)
+
+    def _matches(self, lo, hi):
+        if hi - lo == 1:
+            return self.postings[self.vocab[lo]]
+        return dict.fromkeys(itertools.chain.from_iterable(self.postings[t] for t in self.vocab[lo:hi]))
+
+    def search(self, query):
+        # Ids whose fields contain a token starting with every query token
+        with self.store.lock:
+            ranges = [self._range(t) for t in set(_tokens(query))]
+            if not ranges:
+                return []
+            # Drive the intersection from the query token with the fewest hits
+            sizes = [sum(len(self.postings[t]) for t in self.vocab[lo:hi]) for lo, hi in ranges]
+            ranges = [r for _, r in sorted(zip(sizes, ranges))]
+            result = self._matches(*ranges[0])
+            for lo, hi in ranges[1:]:
+                if not result:
+                    break
+                other = self._matches(lo, hi)
+                result = [rid for rid in result if rid in other]
+            return list(result)
+
+# Fields whose values sort as dates and times rather than text, and a field
+# to fall back on where older records lack one (billing lines written before
+# "item" only carry "medicine")
+DATE_FIELDS = ("date",)
+TIME_FIELDS = ("time",)
+SORT_FALLBACKS = {"item": "medicine"}
+
+def sort_key(field, value):
+    # Numbers order numerically and dates/times chronologically; values that
+    # don't parse come after those that do, as text, and blanks go last
+    if value is None or value == "":
+        return (2, "")
+    try:
+        if field in NUMERIC_FIELDS:
+            return (0, float(value))
+        if field in DATE_FIELDS:
+            try:
+                return (0, datetime.date.fromisoformat(value).toordinal())
+            except ValueError:
+                return (0, datetime.datetime.strptime(value, "%Y-%m-%d").toordinal())
+        if field in TIME_FIELDS:
+            return (0, _minutes(value))
+    except (TypeError, ValueError):
+        pass
+    return (1, str(value).lower())
+
+# One collection's records in ascending order of a field: parallel sorted
+# lists of keys and ids, so the order (or its reverse) is a list copy and
+# each record's key is computed once. Kept in step with store notifications
+# by bisecting single rows in and out.
+class SortIndex(CollectionIndex):
+    def __init__(self, store, key, field):
+        self.field = field
+        self.keys = []  # (sort key, id), ascending
+        self.ids = []   # ids in the same order
+        super().__init__(store, key)
+
+    def _entry(self, rec):
+        value = rec.get(self.field)
+        if value is None and self.field in SORT_FALLBACKS:
+            value = rec.get(SORT_FALLBACKS[self.field])
+        return (sort_key(self.field, value), rec["id"])
+
+    def rebuild(self):
+        with self.store.lock:
+            self.keys = sorted(self._entry(rec) for rec in self.store.load(self.key).values())
+            self.ids = [rid for _, rid in self.keys]
+
+    def _add(self, rec):
+        entry = self._entry(rec)
+        pos = bisect.bisect_left(self.keys, entry)
+        self.keys.insert(pos, entry)
+        self.ids.insert(pos, entry[1])
+
+    def _remove(self, rec):
+        entry = self._entry(rec)
+        pos = bisect.bisect_left(self.keys, entry)
+        if pos < len(self.keys) and self.keys[pos] == entry:
+            del self.keys[pos]
+            del self.ids[pos]
+
+    def order(self, descending=False, among=None):
+        # Ids in sorted order, optionally only those in `among`
+        with self.store.lock:
+            ids = self.ids[::-1] if descending else list(self.ids)
+        if among is not None:
+            among = set(among)
+            ids = [rid for rid in ids if rid in among]
+        return ids
+
+def _name_key(name):
+    # References are free text: match them ignoring case and spacing
+    return " ".join(str(name).split()).casefold()
+
+# Secondary index from a free-text reference field (an appointment's "patient
+# name" or "doctor", a bill's "patient") to the ids of the records carrying
+# it, kept in step with store notifications, so one name's records are found
+# in O(k) of their number rather than by scanning the collection.
+class ReferenceIndex(CollectionIndex):
+    def __init__(self, store, key, field):
+        self.field = field
+        self.ids = {}  # normalized name -> {id: None}, in insertion order
+        super().__init__(store, key)
+
+    def rebuild(self):
+        with self.store.lock:
+            self.ids = {}
+            for rec in self.store.load(self.key).values():
+                self._add(rec)
+
+    def _add(self, rec):
+        name = rec.get(self.field)
+        if name:
+            self.ids.setdefault(_name_key(name), {})[rec["id"]] = None
+
+    def _remove(self, rec):
+        name = rec.get(self.field)
+        ids = self.ids.get(_name_key(name)) if name else None
+        if ids is not None:
+            ids.pop(rec["id"], None)
+            if not ids:
+                del self.ids[_name_key(name)]
+
+    def lookup(self, name):
+        with self.store.lock:
+            records = self.store.load(self.key)
+            return [records[rid] for rid in self.ids.get(_name_key(name), ()) if rid in records]
+
+class BookingError(ValueError):
+    pass
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+def _hhmm(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+# Per-doctor, per-day interval index over appointments. Each day holds sorted
+# (start, end, id) intervals in minutes, so a conflict check is a bisect and
+# free slots come from walking the gaps between bookings.
+class SlotIndex(CollectionIndex):
+    def __init__(self, store):
+        self.days = {}  # (doctor, date) -> sorted [(start, end, id)]
+        super().__init__(store, "appointments")
+
+    def rebuild(self):
+        with self.store.lock:
+            self.days = {}
+            for appt in self.store.load(self.key).values():
+                self._add(appt)
+
+    def _interval(self, appt):
+        try:
+            start = _minutes(appt.get("time", ""))
+        except ValueError:
+            return None
+        return (start, start + int(appt.get("duration") or SLOT_MINUTES), appt["id"])
+
+    def _add(self, appt):
+        interval = self._interval(appt)
+        if interval is not None:
+            bisect.insort(self.days.setdefault((appt.get("doctor"), appt.get("date")), []), interval)
+
+    def _remove(self, appt):
+        interval = self._interval(appt)
+        day = self.days.get((appt.get("doctor"), appt.get("date")))
+        if interval is None or not day:
+            return
+        i = bisect.bisect_left(day, interval)
+        if i < len(day) and day[i] == interval:
+            del day[i]
+
+    def conflict(self, doctor, date, start, duration):
+        # The booked interval overlapping [start, start + duration), if any
+        day = self.days.get((doctor, date), [])
+        i = bisect.bisect_left(day, (start,))
+        if i > 0 and day[i - 1][1] > start:
+            return day[i - 1]
+        if i < len(day) and day[i][0] < start + duration:
+            return day[i]
+        return None
+
+    def book(self, record):
+        # Checks and inserts under the appointments lock so two bookings, from
+        # this process or another workstation, can't race
+        start = _minutes(record["time"])
+        duration = int(record.get("duration") or SLOT_MINUTES)
+        with self.store.transaction("appointments"):
+            clash = self.conflict(record["doctor"], record["date"], start, duration)
+            if clash is not None:
+                raise BookingError(f"{record['doctor']} is already booked from "
+                                   f"{_hhmm(clash[0])} to {_hhmm(clash[1])} on {record['date']}")
+            records = self.store.insert("appointments", [record])
+            try:
+                # Written through even under write-behind, so other desks see the slot taken
+                self.store.flush("appointments")
+            except Exception:
+                # Otherwise the booking stays queued and is written by a later flush
+                self.store.delete("appointments", [rec["id"] for rec in records])
+                raise
+            return records
+
+    def free_slots(self, doctor, date, duration=SLOT_MINUTES, count=8, max_days=30):
+        # Next `count` free (date, time) starts on the SLOT_MINUTES grid within
+        # CLINIC_HOURS, beginning at `date` (and not in the past)
+        opens, closes = (_minutes(t) for t in CLINIC_HOURS)
+        now = datetime.datetime.now()
+        day = max(datetime.datetime.strptime(date, "%Y-%m-%d").date(), now.date())
+        found = []
+        with self.store.lock:
+            for _ in range(max_days):
+                key = day.isoformat()
+                start = opens
+                if day == now.date():
+                    start = max(start, now.hour * 60 + now.minute)
+                for booked_start, booked_end, _ in self.days.get((doctor, key), []) + [(closes, closes, None)]:
+                    start = -(-start // SLOT_MINUTES) * SLOT_MINUTES  # round up to the grid
+                    while start + duration <= min(booked_start, closes) and len(found) < count:
+                        found.append((key, _hhmm(start)))
+                        start += SLOT_MINUTES
+                    start = max(start, booked_end)
+                if len(found) >= count:
+                    break
+                day += datetime.timedelta(days=1)
+        return found
+
+# Collections that can appear on an invoice: key -> (label, name field)
+BILLABLE = {"medicines": ("Medicine", "name"), "lab_tests": ("Lab Test", "test name")}
+
+class BillingError(ValueError):
+    pass
+
+# Name -> price tables for BILLABLE collections. A table is built on first
+# use and dropped whenever names or prices in its collection change,
+# including on disk; stock-only updates keep it.
+class PriceCache:
+    def __init__(self, store):
+        self.store = store
+        self._tables = {}  # collection key -> ({name: price}, {name: id})
+        for key in BILLABLE:
+            store.subscribe(key, lambda event, records, key=key: self._on_change(key, event, records))
+
+    def _on_change(self, key, event, records):
+        name_field = BILLABLE[key][1]
+        if event == "update" and all(old.get(name_field) == new.get(name_field) and
+                                     old.get("price") == new.get("price") for old, new in records):
+            return
+        self._tables.pop(key, None)
+
+    def _table(self, key):
+        with self.store.lock:
+            records = self.store.load(key)  # Notices on-disk changes, which drop the table
+            table = self._tables.get(key)
+            if table is None:
+                name_field = BILLABLE[key][1]
+                table = ({rec.get(name_field, ""): _to_number(rec.get("price")) for rec in records.values()},
+                         {rec.get(name_field, ""): rid for rid, rec in records.items()})
+                self._tables[key] = table
+            return table
+
+    def prices(self, key):
+        return self._table(key)[0]
+
+    def record_id(self, key, name):
+        return self._table(key)[1].get(name)
+
+# Builds every line of one invoice, takes the medicines out of stock and
+# commits the lines in a single store write. items are (collection key,
+# item name, quantity) tuples. Everything happens in one store transaction on
+# medicines and billing, so no other workstation can take the same stock in
+# between, and the stock change is rolled back if the billing write fails: a
+# bill is either fully recorded with its stock taken or not at all.
+def create_invoice(store, price_cache, patient, items):
+    invoice = new_record_id()
+    today = datetime.date.today().isoformat()
+    lines = []
+    with store.transaction("medicines", "billing"):
+        wanted = collections.Counter()
+        for key, name, qty in items:
+            price = price_cache.prices(key).get(name)
+            if price is None:
+                raise BillingError(f"Unknown {BILLABLE[key][0].lower()}: {name}")
+            line = {"invoice": invoice, "patient": patient, "type": key, "item": name,
+                    "quantity": qty, "price": price, "total": price * qty, "date": today}
+            if key == "medicines":
+                line["medicine"] = name
+                wanted[name] += qty
+            lines.append(line)
+
+        medicines = store.load("medicines")
+        before, after = {}, {}
+        for name, qty in wanted.items():
+            rid = price_cache.record_id("medicines", name)
+            in_stock = int(_to_number(medicines[rid].get("quantity")))
+            if qty > in_stock:
+                raise BillingError(f"Only {in_stock} of {name} in stock")
+            before[rid] = {"quantity": medicines[rid].get("quantity")}
+            after[rid] = {"quantity": str(in_stock - qty)}
+
+        store.update("medicines", after)
+        try:
+            store.insert("billing", lines)
+            store.flush("billing")
+        except Exception:
+            # A failed write-behind flush leaves the lines queued; take them back out
+            store.delete("billing", [line["id"] for line in lines if "id" in line])
+            store.update("medicines", before)
+            raise
+        # Written through even under write-behind, so other desks see the stock taken
+        store.flush("medicines")
+        return lines
+
+class ValidationError(ValueError):
+    pass
+
+# Rows per store write when importing
+IMPORT_CHUNK_ROWS = 5000
+
+def _check_date(date):
+    # The date as stored and indexed: zero-padded ISO, so "2031-1-5" and
+    # "2031-01-05" are the same day
+    try:
+        return datetime.datetime.strptime(date, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise ValidationError("Date must be in YYYY-MM-DD format") from None
+
+# Every operation the desktop app and the HTTP server offer on the hospital
+# data, independent of any UI. Calls are thread-safe: they run under the
+# store lock, so the Tk IOWorker threads and server request threads can share
+# one instance. The dashboard and slot indexes are primed on first use.
+class HospitalService:
+    def __init__(self, store):
+        self.store = store
+        self.stats = DashboardStats(store)
+        self.slots = SlotIndex(store)
+        self.prices_cache = PriceCache(store)
+        self._indexes = {}  # collection key -> SearchIndex
+        self._sort_indexes = {}  # (collection key, field) -> SortIndex
+        self._references = {}  # (collection key, field) -> ReferenceIndex
+        self._primed = False
+
+    def prime(self):
+        with self.store.lock:
+            if not self._primed:
+                self.stats.prime()
+                self.slots.rebuild()
+                self._primed = True
+
+    def records(self, key):
+        return list(self.store.load(key).values())
+
+    def get(self, key, record_id):
+        return self.store.get(key, record_id)
+
+    def index(self, key):
+        with self.store.lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._indexes[key] = SearchIndex(self.store, key)
+                index.rebuild()
+            return index
+
+    def search(self, key, query):
+        # Ids of the matching records, see SearchIndex.search
+        return self.index(key).search(query)
+
+    def sort_index(self, key, field):
+        with self.store.lock:
+            index = self._sort_indexes.get((key, field))
+            if index is None:
+                index = self._sort_indexes[key, field] = SortIndex(self.store, key, field)
+                index.rebuild()
+            return index
+
+    def sorted_ids(self, key, field, descending=False, among=None):
+        # Ids ordered by `field` (see sort_key), optionally only those in `among`
+        return self.sort_index(key, field).order(descending, among)
+
+    def reference_index(self, key, field):
+        with self.store.lock:
+            index = self._references.get((key, field))
+            if index is None:
+                index = self._references[key, field] = ReferenceIndex(self.store, key, field)
+                index.rebuild()
+            return index
+
+    def patient_history(self, patient_id):
+        # The patient's appointments and bills (matched by name, as they're
+        # recorded) in date order, with totals; raises LookupError if unknown
+        with self.store.lock:
+            patient = self.store.get("patients", patient_id)
+            if patient is None:
+                raise LookupError(patient_id)
+            name = patient.get("name", "")
+            appointments = self.reference_index("appointments", "patient name").lookup(name)
+            bills = self.reference_index("billing", "patient").lookup(name)
+        appointments.sort(key=lambda a: (sort_key("date", a.get("date")), sort_key("time", a.get("time"))))
+        bills.sort(key=lambda b: (sort_key("date", b.get("date")), str(b.get("invoice", ""))))
+        today = datetime.date.today().isoformat()
+        return {
+            "patient": patient,
+            "appointments": appointments,
+            "bills": bills,
+            "totals": {
+                "appointments": len(appointments),
+                "upcoming": sum(1 for a in appointments if str(a.get("date", "")) >= today),
+                "invoices": len({b.get("invoice") for b in bills}),
+                "billed": round(sum(_to_number(b.get("total")) for b in bills), 2),
+            },
+        }
+
+    def doctor_appointments(self, doctor):
+        appointments = self.reference_index("appointments", "doctor").lookup(doctor)
+        appointments.sort(key=lambda a: (sort_key("date", a.get("date")), sort_key("time", a.get("time"))))
+        return appointments
+
+    def validate_record(self, key, record):
+        # Returns the record with blank optional fields dropped, or raises
+        optional = OPTIONAL_FIELDS.get(key, ())
+        clean = {}
+        for label in RECORD_FIELDS[key]:
+            field = label.lower()
+            value = str(record.get(field, "")).strip()
+            if not value:
+                if field in optional:
+                    continue
+                raise ValidationError(f"{label} is required")
+            if field in INTEGER_FIELDS and not value.isdigit():
+                raise ValidationError(f"{label} must be a number")
+            if field in DECIMAL_FIELDS and _to_number(value, None) is None:
+                raise ValidationError(f"{label} must be a number")
+            clean[field] = value
+        if key == "patients" and "bed" in clean:
+            self.prime()
+            if clean["bed"] in self.stats.occupied_beds:
+                raise ValidationError(f"Bed {clean['bed']} is already occupied")
+        return clean
+
+    def add_record(self, key, record):
+        with self.store.transaction(key):
+            return self.store.insert(key, [self.validate_record(key, record)])[0]
+
+    def delete_records(self, key, ids):
+        return self.store.delete(key, ids)
+
+    def validate_appointment(self, record):
+        clean = {field: str(record.get(field, "")).strip() for field in ("patient name", "doctor", "date", "time")}
+        if not all(clean.values()):
+            raise ValidationError("All fields are required")
+        clean["date"] = _check_date(clean["date"])
+        try:
+            clean["time"] = datetime.datetime.strptime(clean["time"], "%H:%M").strftime("%H:%M")
+        except ValueError:
+            raise ValidationError("Time must be in HH:MM format") from None
+        duration = str(record.get("duration") or SLOT_MINUTES).strip()
+        if not duration.isdigit() or not int(duration):
+            raise ValidationError("Duration must be a number of minutes")
+        clean["duration"] = int(duration)
+        return clean
+
+    def validate_bill(self, record):
+        # A billing line as written by create_invoice; used for imports
+        clean = {field: str(value).strip() for field, value in record.items() if str(value).strip()}
+        if not clean.get("patient"):
+            raise ValidationError("Patient Name is required")
+        if not clean.get("item", clean.get("medicine")):
+            raise ValidationError("Item is required")
+        if not clean.get("quantity", "").isdigit():
+            raise ValidationError("Quantity must be a number")
+        if _to_number(clean.get("price"), None) is None:
+            raise ValidationError("Price must be a number")
+        if "total" in clean and _to_number(clean["total"], None) is None:
+            raise ValidationError("Total must be a number")
+        quantity, price = int(clean["quantity"]), float(clean["price"])
+        # The total is price times quantity, as create_invoice writes it; an
+        # imported one that disagrees would skew reports and revenue
+        total = price * quantity
+        if "total" in clean and abs(float(clean["total"]) - total) >= 0.005:
+            raise ValidationError(f"Total {clean['total']} is not price {clean['price']} x quantity {quantity}")
+        return clean | {"quantity": quantity, "price": price, "total": total,
+                        "date": _check_date(clean.get("date", ""))}
+
+    def book_appointment(self, record):
+        record = self.validate_appointment(record)
+        if record["duration"] not in SLOT_DURATIONS:
+            raise ValidationError(f"Duration must be one of {', '.join(map(str, SLOT_DURATIONS))} minutes")
+        self.prime()
+        return self.slots.book(record)
+
+    def free_slots(self, doctor, date=None, duration=SLOT_MINUTES, count=8):
+        date = _check_date(date or datetime.date.today().isoformat())
+        self.prime()
+        return self.slots.free_slots(doctor, date, int(duration), int(count))
+
+    def prices(self, key):
+        return dict(self.prices_cache.prices(key))
+
+    def create_invoice(self, patient, items):
+        patient = str(patient).strip()
+        if not patient:
+            raise ValidationError("Patient Name is required")
+        if not items:
+            raise ValidationError("Add at least one line to the invoice")
+        if any(key not in BILLABLE or not str(qty).isdigit() or not int(qty) for key, _, qty in items):
+            raise ValidationError("Each line needs a medicine or lab test and a positive quantity")
+        items = [(key, name, int(qty)) for key, name, qty in items]
+        return create_invoice(self.store, self.prices_cache, patient, items)
+
+    def dashboard(self):
+        self.prime()
+        return self.stats.snapshot()
+
+    def reorder(self, k=5):
+        self.prime()
+        return self.stats.low_stock.top(int(k))
+
+    def import_rows(self, key, rows, on_rejected=None, chunk_size=IMPORT_CHUNK_ROWS):
+        # rows: iterable of (line number, {field: value} or the ValueError that
+        # made the line unreadable). Each row gets the
+        # same checks as the add/book/bill forms (appointments are taken as
+        # history, so overlaps are not rejected) and valid rows are streamed
+        # to storage chunk_size at a time, in a single commit holding the
+        # collection's lock throughout. Returns (imported, rejected) counts.
+        rejected = 0
+
+        def chunks():
+            nonlocal rejected
+            existing = self.store.load(key)  # Nothing else can write it until the import is done
+            chunk, beds, ids = [], set(), set()
+            for line, row in rows:
+                try:
+                    if isinstance(row, ValueError):
+                        raise row
+                    record = self._import_record(key, row, beds, ids, existing)
+                except ValueError as e:
+                    rejected += 1
+                    if on_rejected is not None:
+                        on_rejected(line, None if isinstance(row, ValueError) else row, str(e))
+                    continue
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        imported = self.store.bulk_insert(key, chunks())
+        return imported, rejected
+
+    def _import_record(self, key, row, beds, ids, existing):
+        # beds/ids: taken by rows imported so far, which the indexes don't know;
+        # existing: the collection's records before the import
+        row = {str(field).strip().lower(): "" if value is None else value
+               for field, value in row.items() if field is not None}
+        if key == "appointments":
+            record = self.validate_appointment(row)
+        elif key == "billing":
+            record = self.validate_bill(row)
+        else:
+            record = self.validate_record(key, row)
+            if "bed" in record:
+                if record["bed"] in beds:
+                    raise ValidationError(f"Bed {record['bed']} is already occupied")
+                beds.add(record["bed"])
+        rid = str(row.get("id") or "").strip()
+        if rid:
+            # Keep ids from an export so references survive a round trip
+            if rid in ids or rid in existing:
+                raise ValidationError(f"Duplicate id {rid}")
+            ids.add(rid)
+            record["id"] = rid
+        return record
+
+    def export_records(self, key):
+        return self.records(key)
+
+# Bulk transfer files: CSV with a header row, or JSON lines (.jsonl/.ndjson).
+# Rows are streamed in and out, so file size doesn't affect memory use.
+TRANSFER_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+def transfer_format(path):
+    fmt = TRANSFER_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValidationError(f"Unsupported file type: {path} (use .csv or .jsonl)")
+    return fmt
+
+def read_rows(path):
+    # Yields (line number, row); lines that aren't a JSON object come through
+    # as a ValidationError in place of the row, which import_rows rejects
+    fmt = transfer_format(path)
+    with open(path, "r", newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                row = ValidationError(f"Invalid JSON: {e}")
+            yield line, row if isinstance(row, (dict, ValueError)) else ValidationError("Expected a JSON object")
+
+def import_file(service, key, path, rejects_path=None, chunk_size=IMPORT_CHUNK_ROWS):
+    # Rejected rows go to rejects_path (JSON lines with line, error and row);
+    # the file is only created when something is rejected
+    rejects_path = rejects_path or path + ".rejected.jsonl"
+    rejects = None
+
+    def reject(line, row, error):
+        nonlocal rejects
+        if rejects is None:
+            rejects = open(rejects_path, "w", encoding="utf-8")
+        rejects.write(json.dumps({"line": line, "error": error, "row": row}) + "\n")
+
+    try:
+        imported, rejected = service.import_rows(key, read_rows(path), reject, chunk_size)
+    finally:
+        if rejects is not None:
+            rejects.close()
+    return {"collection": key, "file": path, "imported": imported, "rejected": rejected,
+            "rejects_file": rejects_path if rejected else None}
+
+def export_file(service, key, path):
+    fmt = transfer_format(path)
+    records = service.export_records(key)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            columns = list(dict.fromkeys(field for rec in records for field in rec))
+            writer = csv.DictWriter(f, columns, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            for rec in records:
+                f.write(json.dumps(rec, default=json_default) + "\n")
+    return len(records)
@@ -0,0 +1,36 @@
+import threading
+import pytest
+from hospital_service import DATA_PATHS, RecordStore, HospitalService, make_backend
+from hospital_server import PooledHTTPServer
+
+# Every collection's data file inside the test's scratch directory
+@pytest.fixture
+def paths(tmp_path):
+    return {key: str(tmp_path / path) for key, path in DATA_PATHS.items()}
+
+# Opens another RecordStore over the same files, as a second workstation
+# sharing the data directory would
+@pytest.fixture
+def make_store(paths, tmp_path):
+    def make(storage="json", **options):
+        return RecordStore(make_backend(storage, paths, str(tmp_path / "hospital.db")), **options)
+    return make
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+@pytest.fixture
+def service(store):
+    return HospitalService(store)
+
+# The API served over `service` on a free local port; yields its URL
+@pytest.fixture
+def server(service):
+    httpd = PooledHTTPServer(("127.0.0.1", 0), service, workers=2)
+    threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()  # Quick shutdown
+    try:
+        yield f"http://127.0.0.1:{httpd.server_port}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,50 @@
+import pytest
+from hospital_service import SlotIndex, BookingError
+
+@pytest.fixture
+def slots(store):
+    index = SlotIndex(store)
+    index.rebuild()
+    return index
+
+def _appt(time, duration="30", doctor="Dr X", date="2031-01-06"):
+    return {"patient name": "Ann", "doctor": doctor, "date": date, "time": time, "duration": duration}
+
+def test_unpadded_date_and_time_are_stored_padded(service):
+    (appt,) = service.book_appointment({"patient name": "Ann", "doctor": "Dr X", "date": "2031-1-5", "time": "9:00"})
+    assert (appt["date"], appt["time"]) == ("2031-01-05", "09:00")
+
+def test_unpadded_booking_clashes_with_padded_one(service):
+    service.book_appointment({"patient name": "Ann", "doctor": "Dr X", "date": "2031-1-5", "time": "9:00"})
+    with pytest.raises(BookingError):
+        service.book_appointment({"patient name": "Ben", "doctor": "Dr X", "date": "2031-01-05", "time": "09:00"})
+    assert ("2031-01-05", "09:00") not in service.free_slots("Dr X", "2031-1-5")
+
+def test_overlapping_booking_is_refused(slots):
+    slots.book(_appt("10:00"))
+    for time in ("09:45", "10:15"):
+        with pytest.raises(BookingError):
+            slots.book(_appt(time))
+    slots.book(_appt("10:30"))
+    slots.book(_appt("09:30"))
+    slots.book(_appt("10:00", doctor="Dr Y"))
+    assert len(slots.store.load("appointments")) == 4
+
+def test_free_slots_walk_the_gaps(slots):
+    slots.book(_appt("09:15", duration="15"))
+    slots.book(_appt("09:45", duration="45"))
+    assert slots.free_slots("Dr X", "2031-01-06", count=4) == [
+        ("2031-01-06", "09:00"), ("2031-01-06", "09:30"), ("2031-01-06", "10:30"), ("2031-01-06", "10:45")]
+    assert slots.free_slots("Dr X", "2031-01-06", duration=30, count=1) == [("2031-01-06", "10:30")]
+
+def test_index_follows_edits_and_other_workstations(slots, make_store):
+    (rid,) = [rec["id"] for rec in slots.book(_appt("10:00"))]
+    slots.store.update("appointments", {rid: {"time": "11:00"}})
+    slots.book(_appt("10:00"))
+    with pytest.raises(BookingError):
+        slots.book(_appt("11:00"))
+    slots.store.delete("appointments", [rid])
+    slots.book(_appt("11:00", duration="15"))
+    make_store().insert("appointments", [_appt("12:00")])
+    with pytest.raises(BookingError):
+        slots.book(_appt("12:15"))
@@ -0,0 +1,18 @@
+import pytest
+from hospital_service import DATA_PATHS, SlotIndex
+from hospital_bench import generate
+
+@pytest.mark.parametrize("storage", ["json", "sqlite", "snapshot"])
+def test_generated_data_loads_in_every_storage(make_store, tmp_path, storage):
+    sizes = generate(str(tmp_path), 300, storage)
+    store = make_store(storage)
+    assert {key: len(store.load(key)) for key in DATA_PATHS} == sizes
+    with pytest.raises(FileExistsError):
+        generate(str(tmp_path), 300, storage)
+
+def test_generated_appointments_never_overlap(store, tmp_path):
+    generate(str(tmp_path), 500)
+    slots = SlotIndex(store)
+    slots.rebuild()
+    for day in slots.days.values():
+        assert all(end <= start for (_, end, _), (start, _, _) in zip(day, day[1:]))
@@ -0,0 +1,25 @@
+import datetime
+from hospital_service import TOTAL_BEDS, DashboardStats
+
+def test_counters_follow_writes_and_reloads(store, make_store):
+    today = datetime.date.today().isoformat()
+    store.insert("patients", [{"name": "Ann", "age": "30", "disease": "Flu", "bed": "B01"}])
+    stats = DashboardStats(store)
+    stats.prime()
+    store.insert("patients", [{"name": "Ben", "age": "41", "disease": "Cold", "bed": "B02"}])
+    store.insert("appointments", [{"patient name": "Ann", "doctor": "Dr X", "date": today, "time": "09:00"},
+                                  {"patient name": "Ben", "doctor": "Dr X", "date": "2001-01-01", "time": "09:00"}])
+    store.insert("billing", [{"patient": "Ann", "item": "Aspirin", "quantity": "2", "price": "2.5", "total": "5",
+                              "date": today}])
+    snapshot = stats.snapshot()
+    assert (snapshot["Patients"], snapshot["Available Beds"]) == (2, TOTAL_BEDS - 2)
+    assert (snapshot["Today's Appointments"], snapshot["Today's Revenue"]) == (1, "5.00")
+    ann, ben = store.load("patients")
+    store.update("patients", {ben: {"bed": "B01"}})
+    assert stats.available_beds() == TOTAL_BEDS - 1
+    store.delete("patients", [ann])
+    assert stats.available_beds() == TOTAL_BEDS - 1
+    make_store().insert("billing", [{"patient": "Ben", "item": "Zinc", "quantity": "1", "price": "1.5",
+                                     "total": "1.5", "date": today}])
+    store.load("billing")
+    assert stats.snapshot()["Today's Revenue"] == "6.50"
@@ -0,0 +1,47 @@
+import queue
+import pytest
+import hospital_service
+from hospital_service import DataWatcher
+
+@pytest.fixture
+def watch(store, monkeypatch):
+    # Starts a watcher over `store`'s files and returns a function giving its
+    # next batch of changed collections (queue.Empty if none comes in time)
+    monkeypatch.setattr(hospital_service, "WATCH_POLL_MS", 20)
+    monkeypatch.setattr(hospital_service, "WATCH_DEBOUNCE_MS", 50)
+    watchers = []
+
+    def start(mode):
+        changes = queue.Queue()
+        watcher = DataWatcher(store.backend, changes.put, mode=mode).start()
+        watchers.append(watcher)
+        return lambda timeout=3: changes.get(timeout=timeout)
+
+    yield start
+    for watcher in watchers:
+        watcher.stop()
+
+@pytest.mark.parametrize("mode", ["auto", "poll"])
+def test_writes_elsewhere_are_reported_once_per_burst(watch, make_store, mode):
+    changes = watch(mode)
+    other = make_store()
+    other.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    other.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    other.insert("patients", [{"name": "Cy", "age": "30", "disease": "Flu"}])
+    assert changes() == ["patients", "staff"]
+    with pytest.raises(queue.Empty):
+        changes(timeout=0.3)
+
+def test_reads_and_locking_are_not_changes(watch, store):
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    changes = watch("auto")
+    store.invalidate()
+    store.load("staff")
+    with store.transaction("staff", "patients"):
+        pass
+    with pytest.raises(queue.Empty):
+        changes(timeout=0.3)
+
+def test_off_mode_starts_nothing(store):
+    watcher = DataWatcher(store.backend, print, mode="off").start()
+    assert watcher.method is None
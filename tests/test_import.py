@@ -0,0 +1,55 @@
+import json
+import pytest
+from hospital_service import HospitalService, import_file, export_file
+
+def test_import_rejects_ids_already_stored(service):
+    row = lambda rid, name: (0, {"id": rid, "name": name, "role": "Nurse", "phone": "1"})
+    assert service.import_rows("staff", [row("a", "Ann")]) == (1, 0)
+    rejected = []
+    rows = [row("b", "Ben"), row("a", "Ann"), row("c", "Cy"), row("b", "Ben")]
+    imported = service.import_rows("staff", rows, lambda line, row, error: rejected.append(row["id"]), chunk_size=2)
+    assert imported == (2, 2)
+    assert rejected == ["a", "b"]
+    assert sorted(service.store.load("staff")) == ["a", "b", "c"]
+
+def test_import_rejects_bad_bill_dates_and_totals(service):
+    bill = {"patient": "Ann", "item": "Aspirin", "quantity": "2", "price": "2.5", "total": "5", "date": "2031-1-5"}
+    rejected = []
+    rows = [(1, bill), (2, bill | {"date": "not-a-date"}), (3, bill | {"total": "999"})]
+    assert service.import_rows("billing", rows, lambda line, row, error: rejected.append(line)) == (1, 2)
+    assert rejected == [2, 3]
+    (line,) = service.store.load("billing").values()
+    assert (line["date"], line["total"]) == ("2031-01-05", 5.0)
+
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "snapshot"])
+def test_import_streams_chunks_in_one_commit(make_store, storage):
+    store = make_store(storage)
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    service, events = HospitalService(store), []
+    store.subscribe("staff", lambda event, records: events.append(event))
+    rows = [(n, {"name": f"Staff {n}", "role": "Porter", "phone": str(n)}) for n in range(5)]
+    assert service.import_rows("staff", rows, chunk_size=2) == (5, 0)
+    assert events == ["reload"]
+    assert "staff" not in store.stats()["cached"]  # Imported rows weren't held
+    names = sorted(rec["name"] for rec in make_store(storage).load("staff").values())
+    assert names == ["Ann"] + [f"Staff {n}" for n in range(5)]
+    assert len(store.load("staff")) == 6
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl"])
+def test_export_then_import_round_trips(service, make_store, tmp_path, suffix):
+    service.add_record("staff", {"name": "Ann", "role": "Nurse", "phone": "1"})
+    service.add_record("staff", {"name": "Ben", "role": "Porter", "phone": "2"})
+    path = str(tmp_path / ("staff" + suffix))
+    assert export_file(service, "staff", path) == 2
+    service.store.delete("staff", list(service.store.load("staff")))
+    result = import_file(service, "staff", path)
+    assert (result["imported"], result["rejected"], result["rejects_file"]) == (2, 0, None)
+    assert sorted(rec["name"] for rec in make_store().load("staff").values()) == ["Ann", "Ben"]
+
+def test_unreadable_lines_go_to_the_rejects_file(service, tmp_path):
+    path = tmp_path / "staff.jsonl"
+    path.write_text('{"name": "Ann", "role": "Nurse", "phone": "1"}\nnot json\n[1]\n{"name": "", "role": "Nurse"}\n')
+    result = import_file(service, "staff", str(path))
+    assert (result["imported"], result["rejected"]) == (1, 3)
+    with open(result["rejects_file"]) as f:
+        assert [json.loads(line)["line"] for line in f] == [2, 3, 4]
@@ -0,0 +1,30 @@
+import pytest
+from hospital_service import PriceCache, BillingError, create_invoice
+
+@pytest.fixture
+def prices(store):
+    store.insert("medicines", [{"name": "Aspirin", "quantity": "10", "price": "2.5"}])
+    store.insert("lab_tests", [{"test name": "X-Ray", "price": "40"}])
+    return PriceCache(store)
+
+def test_invoice_lines_are_written_in_one_batch(store, prices):
+    events = []
+    store.subscribe("billing", lambda event, records: events.append((event, len(records))))
+    lines = create_invoice(store, prices, "Ann", [("medicines", "Aspirin", 2), ("lab_tests", "X-Ray", 1)])
+    assert events == [("insert", 2)]
+    assert len({line["invoice"] for line in lines}) == 1
+    assert [float(line["total"]) for line in lines] == [5.0, 40.0]
+    with pytest.raises(BillingError):
+        create_invoice(store, prices, "Ann", [("lab_tests", "MRI", 1)])
+    assert len(store.load("billing")) == 2
+
+def test_price_changes_reach_the_cache(store, make_store, prices):
+    table = prices.prices("medicines")
+    assert table == {"Aspirin": 2.5}
+    (aspirin,) = store.load("medicines")
+    store.update("medicines", {aspirin: {"quantity": "9"}})
+    assert prices.prices("medicines") is table  # Stock changes keep the table
+    store.update("medicines", {aspirin: {"price": "3"}})
+    assert prices.prices("medicines") == {"Aspirin": 3.0}
+    make_store().insert("lab_tests", [{"test name": "MRI", "price": "90"}])
+    assert prices.prices("lab_tests") == {"X-Ray": 40.0, "MRI": 90.0}
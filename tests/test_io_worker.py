@@ -0,0 +1,19 @@
+import threading
+from Hospital import IOWorker
+
+def test_tasks_on_one_key_run_in_order_and_report_back():
+    posted, done = [], threading.Event()
+    worker = IOWorker(lambda fn, *args: posted.append((fn, args)))
+    order = []
+    gate = threading.Event()
+    worker.submit("patients", gate.wait)
+    for n in range(5):
+        worker.submit("patients", order.append, n)
+    worker.submit("billing", lambda: 42, on_done=lambda result: None)
+    worker.submit("billing", lambda: 1 / 0, on_error=lambda error: done.set())
+    gate.set()
+    worker.shutdown()
+    assert order == [0, 1, 2, 3, 4]
+    results = [args[0] for _, args in posted]
+    assert 42 in results and any(isinstance(result, ZeroDivisionError) for result in results)
+    assert not done.is_set()  # Callbacks go to post(), not straight to the worker thread
@@ -0,0 +1,35 @@
+import os
+import json
+import hospital_service
+
+def names(store):
+    return sorted(rec["name"] for rec in store.load("staff").values())
+
+def test_writes_append_to_the_journal_and_replay(make_store, paths):
+    store = make_store("journal")
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    (ann,) = store.load("staff")
+    store.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    store.update("staff", {ann: {"phone": "9"}})
+    store.delete("staff", [rid for rid, rec in store.load("staff").items() if rec["name"] == "Ben"])
+    assert not os.path.exists(paths["staff"])
+    with open(paths["staff"] + ".journal") as f:
+        assert [line.split('"op": ')[1][1:7] for line in f] == ["insert", "insert", "update", "delete"]
+    fresh = make_store("journal")
+    assert names(fresh) == ["Ann"] and fresh.get("staff", ann)["phone"] == "9"
+
+def test_journal_is_compacted_into_the_data_file(make_store, paths, monkeypatch):
+    monkeypatch.setattr(hospital_service, "JOURNAL_COMPACT_BYTES", 300)
+    store = make_store("journal")
+    for i in range(5):
+        store.insert("staff", [{"name": f"Nurse {i}", "role": "Nurse", "phone": str(i)}])
+    with open(paths["staff"]) as f:
+        assert len(json.load(f)) >= 3  # Folded in at least once; later inserts may still be in the journal
+    assert names(make_store("journal")) == [f"Nurse {i}" for i in range(5)]
+
+def test_torn_last_line_is_ignored(make_store, paths):
+    store = make_store("journal")
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    with open(paths["staff"] + ".journal", "a") as f:
+        f.write('{"op": "insert", "record": {"id": "x", "na')
+    assert names(make_store("journal")) == ["Ann"]
@@ -0,0 +1,44 @@
+import pytest
+from hospital_service import LOW_STOCK_THRESHOLD, LowStockIndex, PriceCache, BillingError, create_invoice
+
+def _medicine(name, quantity, level=None):
+    med = {"name": name, "quantity": str(quantity), "price": "2"}
+    if level is not None:
+        med["reorder level"] = str(level)
+    return med
+
+def names(index, k=10):
+    return [name for _, name, _, _ in index.top(k)]
+
+def test_top_lists_medicines_under_their_reorder_level_lowest_first(store):
+    index = LowStockIndex(store)
+    index.rebuild()
+    store.insert("medicines", [_medicine("Aspirin", 5), _medicine("Dolo", 50, level=100),
+                               _medicine("Iodine", LOW_STOCK_THRESHOLD), _medicine("Zinc", 1, level=2)])
+    assert names(index) == ["Aspirin", "Dolo", "Zinc"]
+    assert names(index, 2) == ["Aspirin", "Dolo"]
+    assert len(index.below) == 3
+
+def test_index_follows_updates_and_deletes(store):
+    index = LowStockIndex(store)
+    index.rebuild()
+    store.insert("medicines", [_medicine("Aspirin", 5), _medicine("Dolo", 8)])
+    aspirin, dolo = store.load("medicines")
+    store.update("medicines", {aspirin: {"quantity": "50"}, dolo: {"quantity": "1"}})
+    assert names(index) == ["Dolo"]
+    store.delete("medicines", [dolo])
+    assert names(index) == [] and not index.below
+    for quantity in range(9, 0, -1):
+        store.update("medicines", {aspirin: {"quantity": str(quantity)}})
+    assert index.top(5) == [(aspirin, "Aspirin", 1.0, LOW_STOCK_THRESHOLD)]
+    assert len(index.heap) <= 2 * len(index.entries) + 64
+
+def test_billing_more_than_in_stock_changes_nothing(store):
+    store.insert("medicines", [_medicine("Aspirin", 3)])
+    prices = PriceCache(store)
+    with pytest.raises(BillingError):
+        create_invoice(store, prices, "Ann", [("medicines", "Aspirin", 2), ("medicines", "Aspirin", 2)])
+    assert [int(med["quantity"]) for med in store.load("medicines").values()] == [3]
+    assert not store.load("billing")
+    create_invoice(store, prices, "Ann", [("medicines", "Aspirin", 3)])
+    assert [int(med["quantity"]) for med in store.load("medicines").values()] == [0]
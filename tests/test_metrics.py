@@ -0,0 +1,25 @@
+from hospital_service import LatencyHistogram, Metrics
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    with metrics.span("load", "patients") as span:
+        span.bytes_read = 10
+    assert not span.active and metrics.snapshot()["operations"] == {}
+
+def test_spans_are_timed_with_their_bytes():
+    metrics = Metrics(enabled=True)
+    for n in range(3):
+        with metrics.span("write", "staff") as span:
+            span.bytes_written = 100 * n
+    summary = metrics.snapshot()["operations"]["write:staff"]
+    assert (summary["count"], summary["bytes_written"]) == (3, 300)
+    metrics.reset()
+    assert metrics.snapshot()["operations"] == {}
+
+def test_percentiles_are_within_a_bucket():
+    histogram = LatencyHistogram()
+    for micros in range(1, 1001):
+        histogram.add(micros / 1e6)
+    for q in (0.5, 0.95, 0.99):
+        assert q * 1e-3 <= histogram.percentile(q) <= q * 1e-3 * 2 ** (1 / LatencyHistogram.STEPS)
+    assert histogram.percentile(1) == histogram.max == 1e-3
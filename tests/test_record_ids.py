@@ -0,0 +1,15 @@
+import json
+
+def test_records_without_ids_get_stable_ones(make_store, paths):
+    with open(paths["staff"], "w") as f:
+        json.dump([{"name": "Ann", "role": "Nurse", "phone": "1"}, {"name": "Ben", "role": "Nurse", "phone": "2"}], f)
+    ids = list(make_store().load("staff"))
+    assert len(set(ids)) == 2 and all(ids)
+    assert list(make_store().load("staff")) == ids
+
+def test_delete_by_id_keeps_the_rest_in_order(store, make_store):
+    store.insert("staff", [{"name": name, "role": "Nurse", "phone": "1"} for name in ("Ann", "Ben", "Cy", "Dee")])
+    ann, ben, cy, dee = store.load("staff")
+    store.delete("staff", [ben, dee, "no-such-id"])
+    assert list(store.load("staff")) == [ann, cy]
+    assert [rec["name"] for rec in make_store().load("staff").values()] == ["Ann", "Cy"]
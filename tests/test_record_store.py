@@ -0,0 +1,88 @@
+import threading
+import pytest
+from hospital_service import HospitalService, FileLock, ConflictError
+
+@pytest.fixture
+def stores(make_store):
+    # Two workstations sharing one data directory
+    return make_store(), make_store()
+
+def names(store):
+    return sorted(rec["name"] for rec in store.load("staff").values())
+
+def test_save_keeps_records_written_after_checkout(stores):
+    a, b = stores
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    records = a.checkout("staff")
+    b.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    a.load("staff")  # Picks up Ben before the save
+    records.append({"name": "Cy", "role": "Nurse", "phone": "3"})
+    a.save("staff", records)
+    assert names(b) == ["Ann", "Ben", "Cy"]
+
+def test_save_of_filtered_copy_deletes_only_what_was_dropped(stores):
+    a, b = stores
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}, {"name": "Dee", "role": "Nurse", "phone": "4"}])
+    checkout = a.checkout("staff")
+    records = [rec for rec in checkout if rec["name"] != "Dee"]
+    b.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    a.load("staff")
+    a.save("staff", records, base=checkout.base)
+    assert names(b) == ["Ann", "Ben"]
+
+def test_save_merges_against_its_own_checkout(stores):
+    a, b = stores
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}, {"name": "Dee", "role": "Nurse", "phone": "4"}])
+    checkout = a.checkout("staff")
+    records = [rec for rec in checkout if rec["name"] != "Dee"]
+    b.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    a.checkout("staff")  # Someone else's load-modify-save starting meanwhile
+    with pytest.raises(ValueError):
+        a.save("staff", records)
+    a.save("staff", records, base=checkout.base)
+    assert names(b) == ["Ann", "Ben"]
+
+def test_checkout_edits_reach_the_cache_only_on_save(stores):
+    a, b = stores
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    service = HospitalService(a)
+    records = a.checkout("staff")
+    records[0]["role"] = "Doctor"
+    assert [rec["role"] for rec in a.load("staff").values()] == ["Nurse"]
+    assert service.search("staff", "doctor") == []
+    b.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    a.save("staff", records)
+    assert {rec["name"]: rec["role"] for rec in b.load("staff").values()} == {"Ann": "Doctor", "Ben": "Nurse"}
+    assert [a.get("staff", rid)["name"] for rid in service.search("staff", "doctor")] == ["Ann"]
+
+def test_transaction_holds_off_other_writers(stores):
+    a, b = stores
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    written = threading.Event()
+    writer = threading.Thread(target=lambda: (b.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}]),
+                                              written.set()))
+    with a.transaction("staff"):
+        writer.start()
+        assert not written.wait(0.2)
+        a.insert("staff", [{"name": "Cy", "role": "Nurse", "phone": "3"}])
+    assert written.wait(5)
+    writer.join()
+    assert names(a) == ["Ann", "Ben", "Cy"]
+
+def test_every_write_bumps_the_version_stamp(stores):
+    a, b = stores
+    versions = [a.backend.locks["staff"].version()]
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    versions.append(b.backend.locks["staff"].version())
+    a.update("staff", {rid: {"phone": "2"} for rid in a.load("staff")})
+    versions.append(b.backend.locks["staff"].version())
+    assert versions == [0, 1, 2]
+
+def test_busy_lock_times_out_with_a_conflict(paths):
+    held = FileLock(paths["staff"] + ".lock")
+    held.acquire()
+    try:
+        with pytest.raises(ConflictError):
+            FileLock(paths["staff"] + ".lock").acquire(timeout=0.05)
+    finally:
+        held.release()
@@ -0,0 +1,50 @@
+import pytest
+from hospital_server import RemoteService
+
+# `service` served over the API, and a RemoteService talking to it
+@pytest.fixture
+def remote(service, server):
+    return service, RemoteService(server)
+
+def test_sorted_ids(remote):
+    service, client = remote
+    for name, age in (("Cara", "41"), ("Abe", "9"), ("Bo", "30")):
+        client.add_record("patients", {"name": name, "age": age, "disease": "Flu"})
+    client.store.load("patients")
+    names = lambda ids: [client.store.get("patients", rid)["name"] for rid in ids]
+    assert names(client.sorted_ids("patients", "age")) == ["Abe", "Bo", "Cara"]
+    assert names(client.sorted_ids("patients", "name", descending=True)) == ["Cara", "Bo", "Abe"]
+
+def test_sort_order_follows_edits(service):
+    service.store.insert("patients", [{"name": name, "age": age, "disease": "Flu"}
+                                      for name, age in (("Cara", "41"), ("Abe", "9"), ("Bo", ""), ("Dee", "x"))])
+    names = lambda ids: [service.get("patients", rid)["name"] for rid in ids]
+    assert names(service.sorted_ids("patients", "age")) == ["Abe", "Cara", "Dee", "Bo"]
+    abe, cara = service.sorted_ids("patients", "age")[:2]
+    service.store.update("patients", {abe: {"age": "50"}})
+    service.store.delete("patients", [cara])
+    assert names(service.sorted_ids("patients", "age")) == ["Abe", "Dee", "Bo"]
+    assert names(service.sorted_ids("patients", "name", descending=True, among={abe, cara})) == ["Abe"]
+
+def test_patient_history(remote):
+    service, client = remote
+    patient = client.add_record("patients", {"name": "Dana Roy", "age": "52", "disease": "Asthma"})
+    client.add_record("doctors", {"name": "Dr Who", "specialization": "General", "phone": "555"})
+    client.add_record("medicines", {"name": "Dolo", "quantity": "10", "price": "2.5"})
+    client.book_appointment({"patient name": "dana  roy", "doctor": "Dr Who", "date": "2031-01-06",
+                             "time": "10:00"})
+    client.create_invoice("Dana Roy", [("medicines", "Dolo", 2)])
+    history = client.patient_history(patient["id"])
+    assert history["patient"]["name"] == "Dana Roy"
+    assert [a["date"] for a in history["appointments"]] == ["2031-01-06"]
+    assert history["totals"]["invoices"] == 1 and history["totals"]["billed"] == 5.0
+    with pytest.raises(LookupError):
+        client.patient_history("no-such-id")
+
+def test_doctor_appointments(remote):
+    service, client = remote
+    client.add_record("doctors", {"name": "Dr A/B", "specialization": "ENT", "phone": "555"})
+    for time in ("11:00", "09:30"):
+        client.book_appointment({"patient name": "Eve", "doctor": "Dr A/B", "date": "2031-01-06", "time": time})
+    assert [a["time"] for a in client.doctor_appointments("Dr A/B")] == ["09:30", "11:00"]
+    assert client.doctor_appointments("Dr Nobody") == []
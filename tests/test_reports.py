@@ -0,0 +1,68 @@
+import os
+import pytest
+from hospital_reports import ReportEngine
+
+def _line(date, item, total):
+    return {"invoice": f"inv-{date}-{item}", "patient": "Ann", "type": "medicines", "item": item, "medicine": item,
+            "quantity": "1", "price": str(total), "total": str(total), "date": date}
+
+def _revenue(engine):
+    return engine.report("revenue_by_medicine", "2031-01-01", "2031-01-31")["rows"]
+
+@pytest.mark.parametrize("storage", ["json", "sqlite", "snapshot"])
+def test_rerun_recomputes_only_changed_days(make_store, tmp_path, storage):
+    store = make_store(storage)
+    store.insert("billing", [_line("2031-01-0%d" % day, "Aspirin", 2) for day in range(1, 6)])
+    cache = str(tmp_path / "reports.cache.json")
+    run = lambda: ReportEngine(make_store(storage).backend, cache_path=cache, workers=0, chunk_rows=2)
+    engine = run()
+    assert _revenue(engine) == [["Aspirin", 5, 10.0]]
+    assert engine.recomputed["billing"] == "all"
+    rid = next(rid for rid, rec in store.load("billing").items() if rec["date"] == "2031-01-03")
+    store.update("billing", {rid: {"total": "7"}})
+    engine = run()
+    assert _revenue(engine) == [["Aspirin", 5, 15.0]]
+    assert engine.recomputed["billing"] == 1
+    engine = run()
+    _revenue(engine)
+    assert engine.recomputed["billing"] == 0
+
+def test_store_engine_picks_up_days_written_elsewhere(store, make_store, tmp_path):
+    store.insert("billing", [_line("2031-01-0%d" % day, "Aspirin", 2) for day in range(1, 6)])
+    engine = ReportEngine(store.backend, store, cache_path=str(tmp_path / "reports.cache.json"))
+    assert _revenue(engine) == [["Aspirin", 5, 10.0]]
+    store.insert("billing", [_line("2031-01-02", "Iodine", 3)])
+    assert _revenue(engine) == [["Aspirin", 5, 10.0], ["Iodine", 1, 3.0]]
+    assert engine.recomputed["billing"] == 1
+    make_store().insert("billing", [_line("2031-01-04", "Iodine", 3)])
+    assert _revenue(engine) == [["Aspirin", 5, 10.0], ["Iodine", 2, 6.0]]
+    assert engine.recomputed["billing"] == 1
+
+def test_pool_and_inline_runs_agree(store, tmp_path):
+    store.insert("billing", [_line("2031-01-%02d" % day, item, day)
+                             for day in range(1, 29) for item in ("Aspirin", "Zinc")])
+    store.insert("appointments", [{"patient name": "Ann", "doctor": doctor, "date": "2031-01-0%d" % day,
+                                   "time": "09:00", "duration": "30"} for day in (1, 2) for doctor in ("Dr X", "Dr Y")])
+
+    def run(workers):
+        engine = ReportEngine(store.backend, cache_path=None, workers=workers, chunk_rows=5)
+        return {name: engine.report(name, "2031-01-01", "2031-01-31")["rows"]
+                for name in ("revenue_by_medicine", "revenue_by_patient", "doctor_load")}
+
+    reports = [run(0), run(2)]
+    assert reports[0] == reports[1]
+    assert reports[0]["revenue_by_medicine"] == [["Aspirin", 28, 406.0], ["Zinc", 28, 406.0]]
+    assert reports[0]["revenue_by_patient"] == [["Ann", 56, 812.0]]
+    assert reports[0]["doctor_load"][:2] == [["2031-01-01", "Dr X", 1, 30], ["2031-01-01", "Dr Y", 1, 30]]
+    assert not os.path.exists(tmp_path / "reports.cache.json")
+
+def test_unreadable_cache_is_rebuilt(store, tmp_path):
+    store.insert("billing", [_line("2031-01-01", "Aspirin", 2)])
+    cache = tmp_path / "reports.cache.json"
+    cache.write_text("{not json")
+    engine = ReportEngine(store.backend, cache_path=str(cache), workers=0)
+    assert _revenue(engine) == [["Aspirin", 1, 2.0]]
+    assert engine.recomputed["billing"] == "all"
+    engine = ReportEngine(store.backend, cache_path=str(cache), workers=0)
+    _revenue(engine)
+    assert engine.recomputed["billing"] == 0
@@ -0,0 +1,28 @@
+def names(service, query):
+    return [service.store.get("patients", rid)["name"] for rid in service.search("patients", query)]
+
+def test_short_tokens_match_whole_tokens_only(service):
+    for name in ("John Smith", "Jo March", "Johnny Smithers"):
+        service.add_record("patients", {"name": name, "age": "30", "disease": "Flu"})
+    assert names(service, "jo") == ["Jo March"]
+    assert sorted(names(service, "joh")) == ["John Smith", "Johnny Smithers"]
+    assert names(service, "smith jo") == []
+    assert names(service, "smith mar") == []
+    assert names(service, "march jo") == ["Jo March"]
+    assert names(service, "joh smithe") == ["Johnny Smithers"]
+    assert names(service, "j") == []
+
+def test_index_follows_writes(service):
+    ann = service.add_record("patients", {"name": "Ann Lee", "age": "30", "disease": "Flu"})
+    assert names(service, "lee") == ["Ann Lee"]
+    service.store.update("patients", {ann["id"]: {"name": "Ann Park"}})
+    assert names(service, "lee") == [] and names(service, "park") == ["Ann Park"]
+    service.store.delete("patients", [ann["id"]])
+    assert names(service, "park") == []
+
+def test_index_is_rebuilt_when_another_writer_changes_the_file(service, make_store):
+    service.add_record("patients", {"name": "Ann Lee", "age": "30", "disease": "Flu"})
+    assert names(service, "lee") == ["Ann Lee"]
+    make_store().insert("patients", [{"name": "Bo Lee", "age": "41", "disease": "Cold"}])
+    service.store.load("patients")
+    assert names(service, "lee") == ["Ann Lee", "Bo Lee"]
@@ -0,0 +1,54 @@
+import socket
+import threading
+import pytest
+from hospital_server import ServiceClient, ServiceError
+
+# A server that reads each request and hangs up without answering, as one
+# closing an idle keep-alive connection does; counts the requests it saw
+@pytest.fixture
+def hangup():
+    listener = socket.create_server(("127.0.0.1", 0))
+    seen = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            with conn:
+                seen.append(conn.recv(65536).split(b" ", 1)[0].decode())
+
+    threading.Thread(target=serve, daemon=True).start()
+    try:
+        yield ServiceClient(f"http://127.0.0.1:{listener.getsockname()[1]}"), seen
+    finally:
+        listener.close()
+
+def test_get_is_retried(hangup):
+    client, seen = hangup
+    with pytest.raises(ServiceError):
+        client.request("GET", "/api/patients")
+    assert seen == ["GET", "GET"]
+
+@pytest.mark.parametrize("method", ["POST", "DELETE"])
+def test_write_is_not_resent(hangup, method):
+    client, seen = hangup
+    with pytest.raises(ServiceError):
+        client.request(method, "/api/patients", {"name": "Ann"} if method == "POST" else None)
+    assert seen == [method]
+
+@pytest.mark.parametrize("path, body", [
+    ("/api/patients", None),
+    ("/api/patients", ["Ann"]),
+    ("/api/appointments", "Ann"),
+    ("/api/invoices", None),
+    ("/api/invoices", {"patient": "Ann", "items": {"medicines": 1}}),
+    ("/api/invoices", {"patient": "Ann", "items": [["medicines", ["Dolo"], 1]]}),
+    ("/api/staff/import", {"rows": {"1": {}}}),
+    ("/api/staff/import", {"rows": [[1, "Ann"]]}),
+    ("/api/staff/import", {"rows": [{"name": "Ann"}]}),
+])
+def test_malformed_body_is_rejected(server, path, body):
+    with pytest.raises(ValueError):
+        ServiceClient(server).request("POST", path, body)
@@ -0,0 +1,37 @@
+import os
+from hospital_service import (SnapshotFile, make_backend, snapshot_path, write_snapshot, convert_to_snapshot,
+                              convert_from_snapshot)
+
+def test_snapshot_store_reads_json_until_first_write(make_store, paths):
+    # An install switched to snapshot storage without converting its data first
+    make_store().insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    store = make_store("snapshot")
+    assert [rec["name"] for rec in store.load("staff").values()] == ["Ann"]
+    assert store.backend.count("staff") == 1
+    store.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    assert os.path.exists(snapshot_path(paths["staff"]))
+    fresh = make_store("snapshot")
+    assert sorted(rec["name"] for rec in fresh.load("staff").values()) == ["Ann", "Ben"]
+
+def test_rows_decode_by_slice_in_any_layout(tmp_path):
+    records = [{"id": "a", "name": "Ann", "phone": "1"}, {"id": "b", "name": "Ben"},
+               {"id": "c", "phone": "3"}, {"id": "d", "name": "Dee", "phone": "4", "notes": "xé"}]
+    path = str(tmp_path / "staff.hms")
+    write_snapshot(path, records[:2], [records[2:3], records[3:]])
+    with SnapshotFile(path) as snapshot:
+        assert len(snapshot) == 4
+        assert snapshot.records() == records
+        assert snapshot.records(1, 3) == records[1:3]
+        assert snapshot.record(3) == records[3]
+    write_snapshot(path, [])
+    with SnapshotFile(path) as snapshot:
+        assert len(snapshot) == 0 and snapshot.records() == []
+
+def test_conversion_round_trips_every_collection(make_store, paths):
+    make_store().insert("patients", [{"name": "Ann", "age": "30", "disease": "Flu"}])
+    make_store("journal").insert("patients", [{"name": "Ben", "age": "41", "disease": "Cold"}])
+    assert convert_to_snapshot(paths)["patients"] == 2
+    assert make_backend("snapshot", paths).count("patients") == 2
+    os.remove(paths["patients"])
+    assert convert_from_snapshot(paths)["patients"] == 2
+    assert sorted(rec["name"] for rec in make_store().load("patients").values()) == ["Ann", "Ben"]
@@ -0,0 +1,26 @@
+def test_writes_round_trip_through_the_database(make_store):
+    store = make_store("sqlite")
+    store.insert("patients", [{"name": "Ann", "age": "30", "disease": "Flu"},
+                              {"name": "Ben", "age": "41", "disease": "Cold"}])
+    ann, ben = store.load("patients")
+    store.update("patients", {ann: {"name": "Ann Lee"}})
+    store.delete("patients", [ben])
+    fresh = make_store("sqlite")
+    assert [rec["name"] for rec in fresh.load("patients").values()] == ["Ann Lee"]
+    assert fresh.get("patients", ann)["age"] == 30
+
+def test_indexed_columns_follow_the_record(make_store):
+    store = make_store("sqlite")
+    store.insert("appointments", [{"patient name": "Ann", "doctor": "Dr X", "date": "2031-01-05", "time": "09:00",
+                                   "duration": "15"}])
+    (rid,) = store.load("appointments")
+    store.update("appointments", {rid: {"doctor": "Dr Y"}})
+    rows = store.backend.conn.execute("SELECT id, patient, doctor, date FROM appointments").fetchall()
+    assert rows == [(rid, "Ann", "Dr Y", "2031-01-05")]
+
+def test_other_connections_see_each_write(make_store):
+    a, b = make_store("sqlite"), make_store("sqlite")
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    assert [rec["name"] for rec in b.load("staff").values()] == ["Ann"]
+    a.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    assert sorted(rec["name"] for rec in b.load("staff").values()) == ["Ann", "Ben"]
@@ -0,0 +1,22 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_the_app_opens_no_files_and_defers_reports(tmp_path):
+    # Run in an empty directory with sqlite storage, which would create the
+    # database if anything built the default store
+    code = ("import sys, Hospital, hospital_service; "
+            "assert 'hospital_reports' not in sys.modules; assert hospital_service.store is None")
+    env = dict(os.environ, HMS_STORAGE="sqlite", PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True)
+    assert os.listdir(tmp_path) == []
+
+def test_load_data_builds_the_default_store_on_first_use(tmp_path):
+    code = ("import hospital_service as hs; "
+            "records = hs.load_data('staff.json'); assert hs.store is not None; "
+            "records.append({'name': 'Ann', 'role': 'Nurse', 'phone': '1'}); hs.save_data('staff.json', records); "
+            "assert [rec['name'] for rec in hs.RecordStore(hs.JsonBackend(hs.DATA_PATHS)).load('staff').values()] "
+            "== ['Ann']")
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=dict(os.environ, PYTHONPATH=ROOT), check=True)
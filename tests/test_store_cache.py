@@ -0,0 +1,19 @@
+def names(store):
+    return sorted(rec["name"] for rec in store.load("staff").values())
+
+def test_repeat_loads_are_served_from_the_cache(store):
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    store.load("staff")
+    misses, hits = store.misses, store.hits
+    for _ in range(3):
+        assert names(store) == ["Ann"]
+    assert (store.misses, store.hits) == (misses, hits + 3)
+
+def test_another_writer_invalidates_the_cache(make_store):
+    a, b = make_store(), make_store()
+    a.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    assert names(b) == ["Ann"]
+    a.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    assert names(b) == ["Ann", "Ben"]
+    a.delete("staff", [rid for rid, rec in a.load("staff").items() if rec["name"] == "Ann"])
+    assert names(b) == ["Ben"]
@@ -0,0 +1,28 @@
+import json
+import pickle
+from hospital_service import RECORD_TYPES, TypedRecord, json_default, make_record, plain_record
+
+def test_fields_are_typed_and_extras_kept():
+    rec = make_record("medicines", {"id": "m1", "name": "Aspirin", "quantity": "12", "price": "2.50",
+                                    "batch": "B7"})
+    assert isinstance(rec, RECORD_TYPES["medicines"])
+    assert (rec["quantity"], rec["price"], rec["batch"]) == (12, 2.5, "B7")
+    assert rec.get("reorder level") is None and "reorder level" not in rec
+    rec["quantity"] = "x"  # Unparsable numbers are kept as written
+    del rec["batch"]
+    assert rec.to_dict() == {"id": "m1", "name": "Aspirin", "quantity": "x", "price": 2.5}
+    assert len(rec) == 4 and list(rec) == ["id", "name", "quantity", "price"]
+
+def test_records_copy_pickle_and_serialize_as_plain_dicts():
+    rec = make_record("patients", {"id": "p1", "name": "Ann", "age": "30", "disease": "Flu"})
+    copy = rec.copy()
+    copy["age"] = 31
+    assert rec["age"] == 30
+    assert pickle.loads(pickle.dumps(rec)) == rec
+    assert json.loads(json.dumps([rec], default=json_default)) == [plain_record(rec)]
+    assert not hasattr(rec, "__dict__") and isinstance(rec, TypedRecord)
+
+def test_store_holds_typed_records_unless_compact_is_off(make_store):
+    make_store().insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    assert all(isinstance(rec, RECORD_TYPES["staff"]) for rec in make_store().load("staff").values())
+    assert all(type(rec) is dict for rec in make_store(compact=False).load("staff").values())
@@ -0,0 +1,78 @@
+import time
+import threading
+import pytest
+from hospital_service import HospitalService, BookingError
+
+def names(store):
+    return sorted(rec["name"] for rec in store.load("staff").values())
+
+def _failing(store, attempts=None):
+    # Makes the backend's commits fail until the returned callable is called
+    commit = store.backend.commit
+
+    def fail(*args):
+        if attempts is not None:
+            attempts.append(time.monotonic())
+        raise OSError("disk full")
+
+    store.backend.commit = fail
+    return lambda: setattr(store.backend, "commit", commit)
+
+def test_burst_of_edits_is_written_in_one_commit(make_store):
+    store, other = make_store(write_behind=60000), make_store()
+    commits = []
+    commit = store.backend.commit
+    store.backend.commit = lambda key, *args: (commits.append(key), commit(key, *args))
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    store.insert("staff", [{"name": "Ben", "role": "Nurse", "phone": "2"}])
+    ann, ben = store.load("staff")
+    store.update("staff", {ann: {"phone": "9"}})
+    store.delete("staff", [ben])
+    assert store.pending() == {"staff": 2}
+    assert names(other) == []
+    store.invalidate("staff")
+    assert names(store) == ["Ann"]  # Queued changes survive a re-read
+    store.flush()
+    assert commits == ["staff"] and store.pending() == {}
+    assert names(other) == ["Ann"] and other.get("staff", ann)["phone"] == "9"
+
+def test_background_flush_runs_once_writes_pause(make_store):
+    store = make_store(write_behind=20)
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    deadline = time.monotonic() + 5
+    while store.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert store.pending() == {}
+    assert names(make_store()) == ["Ann"]
+
+def test_failed_background_flush_is_reported_and_retried(make_store):
+    store = make_store(write_behind=10)
+    store.load("staff")
+    states, failed = [], threading.Event()
+    store.on_flush_error = lambda error: (states.append(error), failed.set())
+    attempts = []
+    restore = _failing(store, attempts)
+    store.insert("staff", [{"name": "Ann", "role": "Nurse", "phone": "1"}])
+    assert failed.wait(5)
+    time.sleep(0.5)
+    assert isinstance(store.flush_error, OSError)
+    assert 3 <= len(attempts) <= 8  # 10, 20, 40... ms apart rather than every 10 ms
+    assert store.pending() == {"staff": 1}
+    restore()
+    store.flush()
+    assert store.flush_error is None
+    assert len(states) == 2 and states[1] is None
+    assert names(make_store()) == ["Ann"]
+
+def test_failed_booking_flush_takes_the_booking_back(make_store):
+    service = HospitalService(make_store(write_behind=60000))
+    appointment = {"patient name": "Ann", "doctor": "Dr X", "date": "2031-01-05", "time": "09:00"}
+    restore = _failing(service.store)
+    with pytest.raises(OSError):
+        service.book_appointment(dict(appointment))
+    assert not service.store.load("appointments")
+    restore()
+    service.store.flush()
+    service.book_appointment(dict(appointment))
+    with pytest.raises(BookingError):
+        service.book_appointment(dict(appointment))